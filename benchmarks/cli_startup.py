@@ -0,0 +1,101 @@
+"""
+Бенчмарк холодного старта CLI по `python -X importtime`.
+
+Для каждой команды измеряет:
+  - startup: время импорта при `telegram-digest <команда> --help`;
+  - command: время импорта модулей, которые команда загружает при запуске;
+и показывает, какие тяжелые пакеты попали в импорт.
+
+Запуск:
+    python benchmarks/cli_startup.py [--repeat 5] [--output startup.json]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+HEAVY_MODULES = ["telethon", "firebase_admin", "google.cloud.firestore", "openai", "weasyprint", "ebooklib", "bs4"]
+
+# команда -> модули, которые она импортирует при выполнении
+COMMANDS: Dict[str, List[str]] = {
+    "": [],
+    "test-connection": ["telethon"],
+    "fetch": ["telegram_digest.fetcher"],
+    "listen": ["telegram_digest.listener", "telethon"],
+    "summarize-posts": ["telegram_digest.summarizer"],
+    "pdf": ["telegram_digest.pdf_digest"],
+    "run": ["telegram_digest.pdf_digest", "telegram_digest.pipeline", "telethon"],
+    "links": ["telegram_digest.links", "telegram_digest.storage"],
+    "serve": ["telegram_digest.daemon", "telethon"],
+    "maintain": ["telegram_digest.maintenance"],
+    "migrate": ["telegram_digest.migrate_flat"],
+    "pdf-test": ["telegram_digest.pdf_digest"],
+}
+
+CLI_CODE = "import sys; from telegram_digest.cli.app import app; app()"
+
+def run_importtime(code: str, args: List[str]) -> Dict[str, int]:
+    """Запускает интерпретатор с -X importtime, возвращает {модуль: cumulative мкс}."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [SRC_DIR, env.get("PYTHONPATH")]))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, *args],
+        env=env, capture_output=True, text=True
+    )
+    cumulative: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Отступ в имени показывает вложенность импорта, его сохраняем
+        cumulative[name[1:].rstrip()] = int(cumulative_us)
+    return cumulative
+
+def total_ms(cumulative: Dict[str, int]) -> float:
+    """Суммарное время импорта: cumulative модулей верхнего уровня (без отступа)."""
+    return sum(us for name, us in cumulative.items() if not name.startswith(" ")) / 1000
+
+def measure(code: str, args: List[str], repeat: int) -> Dict[str, object]:
+    totals = []
+    heavy: Dict[str, float] = {}
+    for _ in range(repeat):
+        cumulative = run_importtime(code, args)
+        totals.append(total_ms(cumulative))
+        for name, us in cumulative.items():
+            if name.strip() in HEAVY_MODULES:
+                heavy[name.strip()] = us / 1000
+    return {"import_ms": round(statistics.median(totals), 1), "heavy_ms": heavy}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="сколько раз повторять замер (берется медиана)")
+    parser.add_argument("--output", help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for command, modules in COMMANDS.items():
+        cli_args = [command, "--help"] if command else ["--help"]
+        startup = measure(CLI_CODE, cli_args, args.repeat)
+        entry = {"startup": startup}
+        if modules:
+            code = "; ".join(f"import {module}" for module in ["telegram_digest.cli.app", *modules])
+            entry["command"] = measure(code, [], args.repeat)
+        results[command or "--help"] = entry
+        heavy = ", ".join(sorted(startup["heavy_ms"])) or "—"
+        line = f"{command or '--help':<16} startup {startup['import_ms']:>8.1f} ms  heavy: {heavy}"
+        if modules:
+            line += f" | command {entry['command']['import_ms']:>8.1f} ms"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
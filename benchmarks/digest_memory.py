@@ -0,0 +1,111 @@
+"""
+Бенчмарк пиковой памяти при сборке дайджеста на синтетических данных.
+
+Сравнивает два пути (без PDF — WeasyPrint одинаково обрабатывает HTML в обоих):
+  full      — все посты списком, весь HTML строкой, EPUB из полного списка постов
+              (render_digest_html + save_epub, как раньше работал generate_digest);
+  streaming — посты генератором по каналам, HTML пишется в файл по частям,
+              EPUB собирается по мере отрисовки каналов (build_digest).
+
+Каждый режим запускается в отдельном процессе; печатается пик tracemalloc и max RSS.
+
+Запуск:
+    python benchmarks/digest_memory.py [--posts 50000] [--channels 50] [--output memory.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Tuple
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+DATE_FROM = datetime(2025, 1, 1, tzinfo=timezone.utc)
+DATE_TO = DATE_FROM + timedelta(days=90)
+WORDS = "телеграм канал новости рынок модель данные продукт запуск команда идея рост пост".split()
+
+def synthetic_channel(channel: str, count: int, seed: int) -> List[dict]:
+    rnd = random.Random(seed)
+    posts = []
+    for i in range(count):
+        text = " ".join(rnd.choice(WORDS) for _ in range(80))
+        posts.append({
+            'id': f"{channel}_{i}",
+            'channel': channel,
+            'date': DATE_FROM + timedelta(minutes=i * 37 % (90 * 24 * 60)),
+            'summary': " ".join(rnd.choice(WORDS) for _ in range(20)),
+            'text_html': f"<b>{text[:40]}</b><br>{text}",
+        })
+    return posts
+
+def synthetic_channels(posts: int, channels: int) -> Iterator[Tuple[str, List[dict]]]:
+    per_channel = posts // channels
+    for n in range(channels):
+        channel = f"@channel{n}"
+        yield channel, synthetic_channel(channel, per_channel, n)
+
+def run_mode(mode: str, posts: int, channels: int) -> dict:
+    from telegram_digest import pdf_digest
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    if mode == "full":
+        all_posts = [post for _, channel_posts in synthetic_channels(posts, channels) for post in channel_posts]
+        html = pdf_digest.render_digest_html(all_posts, DATE_FROM, DATE_TO)
+        pdf_digest.save_epub(pdf_digest.group_posts_by_channel(all_posts), DATE_FROM, DATE_TO)
+        count = len(all_posts)
+    else:
+        _, _, count = pdf_digest.build_digest(synthetic_channels(posts, channels), DATE_FROM, DATE_TO, pdf=False)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "mode": mode,
+        "posts": count,
+        "seconds": round(elapsed, 2),
+        "tracemalloc_peak_mb": round(peak / 2**20, 1),
+        # ru_maxrss в Linux — килобайты
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=50_000)
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--output", help="куда сохранить результаты в JSON")
+    parser.add_argument("--mode", choices=["full", "streaming"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Дочерний процесс: один режим, результат — JSON в stdout
+        print(json.dumps(run_mode(args.mode, args.posts, args.channels)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in ("full", "streaming"):
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode,
+                 "--posts", str(args.posts), "--channels", str(args.channels)],
+                cwd=workdir, capture_output=True, text=True, check=True
+            )
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{mode:<10} {result['posts']} постов: {result['seconds']:>7.2f} с, "
+                  f"пик tracemalloc {result['tracemalloc_peak_mb']:>8.1f} МБ, max RSS {result['max_rss_mb']:>8.1f} МБ")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
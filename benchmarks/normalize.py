@@ -0,0 +1,112 @@
+"""
+Бенчмарк нормализации сообщений на синтетических сообщениях Telethon.
+
+Сравнивает:
+  html2text — прежний путь: html2text.handle() над message.message
+              и entities через hasattr;
+  entities  — message_to_post: текст как есть, компактные entities и HTML из них.
+
+Запуск:
+    python benchmarks/normalize.py [--messages 5000] [--repeat 3] [--output normalize.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timezone
+from typing import List
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+import html2text
+from telethon.tl.types import (
+    Message, MessageEntityBold, MessageEntityItalic, MessageEntityTextUrl, MessageEntityUrl, PeerChannel
+)
+
+WORDS = "телеграм канал новости рынок модель данные продукт запуск команда идея рост пост 🚀 *важно* _итог_".split()
+
+def utf16_len(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+def synthetic_messages(count: int) -> List[Message]:
+    rnd = random.Random(0)
+    now = datetime.now(timezone.utc)
+    messages = []
+    for i in range(count):
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(20, 200))]
+        words.insert(5, "example.com/path")
+        text = " ".join(words)
+        # Сущности на первых словах: жирный, курсив, ссылка-текст и голая ссылка
+        offsets, position = [], 0
+        for word in words[:6]:
+            offsets.append((position, utf16_len(word)))
+            position += utf16_len(word) + 1
+        entities = [
+            MessageEntityBold(*offsets[0]),
+            MessageEntityItalic(*offsets[1]),
+            MessageEntityTextUrl(*offsets[2], url="https://example.com/a?b=1&c=2"),
+            MessageEntityUrl(*offsets[5]),
+        ]
+        messages.append(Message(id=i + 1, peer_id=PeerChannel(1), date=now, message=text, entities=entities))
+    return messages
+
+def legacy_message_to_post(message: Message, channel_id: str, h2t: html2text.HTML2Text) -> dict:
+    """Прежний message_to_post — для сравнения."""
+    plain_text = h2t.handle(message.message) if message.message else None
+    entities = []
+    if message.entities:
+        for entity in message.entities:
+            entity_dict = {'type': entity.__class__.__name__, 'offset': entity.offset, 'length': entity.length}
+            if hasattr(entity, 'url'):
+                entity_dict['url'] = entity.url
+            if hasattr(entity, 'user_id'):
+                entity_dict['user_id'] = entity.user_id
+            entities.append(entity_dict)
+    return {'msg_id': message.id, 'channel_id': channel_id, 'date': message.date,
+            'text_html': message.message, 'plain_text': plain_text, 'entities': entities}
+
+def best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    from telegram_digest.fetcher import message_to_post
+
+    messages = synthetic_messages(args.messages)
+    h2t = html2text.HTML2Text()
+    h2t.ignore_links = False
+    h2t.ignore_images = True
+
+    legacy = best_of(args.repeat, lambda: [legacy_message_to_post(m, "@chan", h2t) for m in messages])
+    current = best_of(args.repeat, lambda: [message_to_post(m, "@chan") for m in messages])
+    results = {
+        "messages": args.messages,
+        "html2text_seconds": round(legacy, 3),
+        "entities_seconds": round(current, 3),
+        "html2text_us_per_message": round(legacy / args.messages * 1e6, 1),
+        "entities_us_per_message": round(current / args.messages * 1e6, 1),
+    }
+    print(f"html2text {results['html2text_seconds']:>7.3f} с ({results['html2text_us_per_message']} мкс/сообщение)")
+    print(f"entities  {results['entities_seconds']:>7.3f} с ({results['entities_us_per_message']} мкс/сообщение), "
+          f"x{legacy / max(current, 1e-9):.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Сквозной офлайн-бенчмарк конвейера: загрузка -> саммари -> дайджест.
+
+Ничего не ходит в сеть:
+  FakeTelegramClient — синтетические истории каналов нужного размера,
+                       отдаются страницами на GetHistoryRequest (с задержкой --telegram-latency);
+  StubOpenAI         — ответ chat.completions.create через --llm-latency секунд
+                       (пакетный режим с JSON-ответом тоже поддерживается);
+  хранилище          — SQLite во временном каталоге (STORAGE_BACKEND=sqlite).
+
+Для каждого масштаба (--posts 1000 10000 100000) запускается отдельный процесс,
+этапы идут по очереди на одной базе:
+  fetch     — fetch_posts, посты/с;
+  summarize — summarize_stream по всем постам из хранилища, саммари/с;
+  render    — build_digest (HTML и EPUB; PDF — с флагом --pdf), секунды.
+После каждого этапа записывается max RSS процесса (пик с начала запуска),
+в результат попадают и счетчики telegram_digest.metrics (чтения/записи БД, токены и т. п.).
+
+Результаты — JSON с датой и коммитом, чтобы сравнивать запуски между собой;
+--compare старый.json печатает изменение относительно прошлого запуска.
+
+Запуск:
+    python benchmarks/pipeline.py [--posts 1000 10000 100000] [--channels 20]
+        [--llm-latency 0.05] [--concurrency 32] [--pack-tokens 0] [--pdf]
+        [--output pipeline.json] [--compare previous.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from telethon.tl.types import Channel, ChatPhotoEmpty, Message, MessageEntityBold, PeerChannel
+
+WORDS = "телеграм канал новости рынок модель данные продукт запуск команда идея рост пост".split()
+# Показатели для --compare: (этап, поле, больше — лучше)
+COMPARED = [
+    ("fetch", "posts_per_second", True),
+    ("summarize", "summaries_per_second", True),
+    ("render", "seconds", False),
+    ("render", "max_rss_mb", False),
+]
+
+def max_rss_mb() -> float:
+    # ru_maxrss в Linux — килобайты
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+class FakeTelegramClient:
+    """
+    Клиент Telegram с синтетическими историями: channels каналов по per_channel сообщений,
+    равномерно за последние days дней. Сообщения создаются по запросу страницы,
+    так что история в 100k постов не держится в памяти.
+    """
+
+    def __init__(self, channels: int, per_channel: int, days: int, latency: float = 0.0):
+        self.per_channel = per_channel
+        self.latency = latency
+        self.now = datetime.now(timezone.utc)
+        # Последнее сообщение — сейчас, самое старое — чуть позже начала периода
+        self.step = timedelta(days=days) * 0.95 / max(per_channel, 1)
+        self.channel_ids = {f"@bench{n}": 1000 + n for n in range(channels)}
+        self.requests = 0
+        self.flood_sleep_threshold = 0
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def get_entity(self, channel_id: str) -> Channel:
+        return Channel(id=self.channel_ids[channel_id], title=f"Канал {channel_id}", photo=ChatPhotoEmpty(),
+                       date=None, access_hash=1, username=channel_id.lstrip("@"))
+
+    def message(self, peer_id: int, msg_id: int) -> Message:
+        rnd = random.Random(peer_id * 1_000_003 + msg_id)
+        # Номер в тексте делает посты уникальными: кэш саммари не срабатывает
+        text = f"Пост {msg_id} " + " ".join(rnd.choices(WORDS, k=rnd.randint(60, 120)))
+        return Message(
+            id=msg_id, peer_id=PeerChannel(peer_id), date=self.now - self.step * (self.per_channel - msg_id),
+            message=text, entities=[MessageEntityBold(0, 4)]
+        )
+
+    async def __call__(self, request):
+        """GetHistoryRequest: сообщения от новых к старым, ниже offset_id и выше min_id."""
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        newest = request.offset_id - 1 if request.offset_id else self.per_channel
+        oldest = max(newest - request.limit, request.min_id)
+        peer_id = request.peer.channel_id
+        return SimpleNamespace(messages=[self.message(peer_id, msg_id) for msg_id in range(newest, oldest, -1)])
+
+class StubOpenAI:
+    """Замена openai.AsyncOpenAI для summarizer: фиксированная задержка на запрос."""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, model: str, messages: List[dict], max_tokens: int, temperature: float, response_format=None):
+        from telegram_digest.summarizer import estimate_tokens
+
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        content = messages[-1]['content']
+        if response_format:
+            # Пакетный режим: JSON по id из заголовков «### id»
+            reply = json.dumps({item_id: f"Саммари текста {item_id}." for item_id in re.findall(r"^### (\S+)$", content, re.M)})
+        else:
+            reply = "Саммари: " + " ".join(content.split()[:12])
+        usage = SimpleNamespace(prompt_tokens=estimate_tokens(content), completion_tokens=estimate_tokens(reply))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=usage)
+
+async def summarize_all(args: argparse.Namespace, client: StubOpenAI) -> Dict[str, str]:
+    """Отдает в summarize_stream все посты хранилища страницами, как это делает конвейер."""
+    from telegram_digest.storage import iter_post_pages
+    from telegram_digest.summarizer import summarize_stream
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def feed() -> None:
+        for page in iter_post_pages(['plain_text'], 500):
+            queue.put_nowait(page)
+            await asyncio.sleep(0)
+        queue.put_nowait(None)
+
+    _, summaries = await asyncio.gather(
+        feed(),
+        summarize_stream(queue, args.concurrency, rpm=None, tpm=None, pack_tokens=args.pack_tokens, client=client)
+    )
+    return summaries
+
+def run_scale(args: argparse.Namespace, posts: int) -> dict:
+    """Один масштаб в текущем процессе (рабочий каталог и база — временные, их задает родитель)."""
+    from telegram_digest.fetcher import fetch_posts
+    from telegram_digest.metrics import metrics
+    from telegram_digest.pdf_digest import build_digest
+    from telegram_digest.storage import count_posts, iter_digest_posts
+
+    client = FakeTelegramClient(args.channels, posts // args.channels, args.days, args.telegram_latency)
+    channel_ids = list(client.channel_ids)
+
+    started = time.perf_counter()
+    asyncio.run(fetch_posts(client, channel_ids, args.days, concurrency=args.fetch_concurrency))
+    elapsed = time.perf_counter() - started
+    stored = count_posts()
+    fetch = {
+        "posts": stored, "telegram_requests": client.requests, "seconds": round(elapsed, 2),
+        "posts_per_second": round(stored / elapsed, 1), "max_rss_mb": max_rss_mb(),
+    }
+
+    llm = StubOpenAI(args.llm_latency)
+    started = time.perf_counter()
+    summaries = asyncio.run(summarize_all(args, llm))
+    elapsed = time.perf_counter() - started
+    summarize = {
+        "summaries": len(summaries), "openai_requests": llm.requests, "seconds": round(elapsed, 2),
+        "summaries_per_second": round(len(summaries) / elapsed, 1), "max_rss_mb": max_rss_mb(),
+    }
+
+    date_to = datetime.now(timezone.utc)
+    date_from = date_to - timedelta(days=args.days)
+    started = time.perf_counter()
+    _, _, count = build_digest(
+        ((channel, list(iter_digest_posts(channel, date_from, date_to))) for channel in channel_ids),
+        date_from, date_to, pdf=args.pdf
+    )
+    render = {
+        "posts": count, "pdf": args.pdf, "seconds": round(time.perf_counter() - started, 2), "max_rss_mb": max_rss_mb(),
+    }
+    return {
+        "posts": posts, "fetch": fetch, "summarize": summarize, "render": render,
+        "counters": metrics.snapshot()['counters'],
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(previous_path: str, results: List[dict]) -> None:
+    with open(previous_path, encoding="utf-8") as f:
+        previous = {result['posts']: result for result in json.load(f)['results']}
+    print(f"Сравнение с {previous_path}:")
+    for result in results:
+        before = previous.get(result['posts'])
+        if before is None:
+            continue
+        changes = []
+        for stage, field, higher_is_better in COMPARED:
+            old, new = before[stage][field], result[stage][field]
+            if not old:
+                continue
+            change = (new - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            changes.append(f"{stage}.{field} {old:g} -> {new:g} ({change:+.1f}%{'' if better or not change else ' хуже'})")
+        print(f"  {result['posts']:>7}: " + "; ".join(changes))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--fetch-concurrency", type=int, default=5)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка ответа Telegram, с")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="задержка ответа OpenAI, с")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных запросов к OpenAI")
+    parser.add_argument("--pack-tokens", type=int, default=0, help="пакетный режим summarizer (см. run --pack-tokens)")
+    parser.add_argument("--pdf", action="store_true", help="рендерить и PDF (на 100k постов — долго)")
+    parser.add_argument("--output", help="куда сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Дочерний процесс: один масштаб, результат — JSON в stdout
+        print(json.dumps(run_scale(args, args.child), ensure_ascii=False))
+        return
+
+    forwarded = [
+        "--channels", str(args.channels), "--days", str(args.days),
+        "--fetch-concurrency", str(args.fetch_concurrency), "--telegram-latency", str(args.telegram_latency),
+        "--llm-latency", str(args.llm_latency), "--concurrency", str(args.concurrency),
+        "--pack-tokens", str(args.pack_tokens),
+    ] + (["--pdf"] if args.pdf else [])
+    results = []
+    for posts in args.posts:
+        with tempfile.TemporaryDirectory() as workdir:
+            env = dict(
+                os.environ, STORAGE_BACKEND="sqlite", SQLITE_DB_PATH=os.path.join(workdir, "bench.db"),
+                CHECKPOINT_DIR=os.path.join(workdir, "checkpoints"), LOG_LEVEL="WARNING", METRICS_TEXTFILE=""
+            )
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", str(posts)] + forwarded,
+                cwd=workdir, env=env, capture_output=True, text=True
+            )
+        if proc.returncode:
+            sys.stderr.write(proc.stderr)
+            sys.exit(f"Запуск на {posts} постов завершился с ошибкой")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{posts:>7} постов: загрузка {result['fetch']['posts_per_second']:>8.1f} пост/с, "
+              f"саммари {result['summarize']['summaries_per_second']:>7.1f}/с, "
+              f"дайджест {result['render']['seconds']:>6.2f} с, max RSS {result['render']['max_rss_mb']:>7.1f} МБ")
+
+    report = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "child")},
+        "results": results,
+    }
+    if args.compare:
+        compare(args.compare, results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
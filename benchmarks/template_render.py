@@ -0,0 +1,117 @@
+"""
+Микро-бенчмарк рендеринга множества маленьких дайджестов (по каналам, периодам, подписчикам).
+
+Сравнивает:
+  per_call — новое окружение Jinja на каждый дайджест: шаблоны компилируются каждый раз
+             (так работал render_digest_html раньше);
+  batch    — render_digests_html: одно окружение и скомпилированные шаблоны на все дайджесты.
+
+Дополнительно в отдельных процессах меряется первый рендер с пустым и заполненным
+FileSystemBytecodeCache (холодный старт CLI).
+
+Запуск:
+    python benchmarks/template_render.py [--digests 500] [--posts 20] [--output render.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+DATE_FROM = datetime(2025, 1, 1, tzinfo=timezone.utc)
+DATE_TO = DATE_FROM + timedelta(days=1)
+WORDS = "телеграм канал новости рынок модель данные продукт запуск команда идея рост пост".split()
+
+def synthetic_digests(digests: int, posts: int) -> List[Tuple[List[dict], datetime, datetime]]:
+    rnd = random.Random(0)
+    result = []
+    for n in range(digests):
+        channel = f"@channel{n % 50}"
+        result.append(([
+            {
+                'id': f"{channel}_{n}_{i}",
+                'channel': channel,
+                'date': DATE_FROM + timedelta(minutes=i),
+                'summary': " ".join(rnd.choice(WORDS) for _ in range(20)),
+                'text_html': " ".join(rnd.choice(WORDS) for _ in range(60)),
+            }
+            for i in range(posts)
+        ], DATE_FROM, DATE_TO))
+    return result
+
+def run_per_call(digests: List[Tuple[List[dict], datetime, datetime]]) -> float:
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+    from telegram_digest import pdf_digest
+
+    started = time.perf_counter()
+    for posts, date_from, date_to in digests:
+        env = Environment(loader=FileSystemLoader(pdf_digest.TEMPLATE_DIR), autoescape=select_autoescape(['html', 'xml']))
+        pdf_digest.render_digest_html(posts, date_from, date_to, env)
+    return time.perf_counter() - started
+
+def run_batch(digests: List[Tuple[List[dict], datetime, datetime]]) -> float:
+    from telegram_digest import pdf_digest
+
+    started = time.perf_counter()
+    for _ in pdf_digest.render_digests_html(digests):
+        pass
+    return time.perf_counter() - started
+
+def first_render() -> float:
+    """Время первого рендера в свежем процессе (компиляция или загрузка байткода)."""
+    from telegram_digest import pdf_digest
+
+    digest = synthetic_digests(1, 1)
+    started = time.perf_counter()
+    list(pdf_digest.render_digests_html(digest))
+    return time.perf_counter() - started
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--digests", type=int, default=500)
+    parser.add_argument("--posts", type=int, default=20)
+    parser.add_argument("--output", help="куда сохранить результаты в JSON")
+    parser.add_argument("--first-render", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.first_render:
+        # Дочерний процесс: только первый рендер, результат — в stdout
+        print(first_render())
+        return
+
+    digests = synthetic_digests(args.digests, args.posts)
+    results = {
+        "digests": args.digests,
+        "posts_per_digest": args.posts,
+        "per_call_seconds": round(run_per_call(digests), 3),
+        "batch_seconds": round(run_batch(digests), 3),
+    }
+    print(f"per_call {results['per_call_seconds']:>8.3f} с, batch {results['batch_seconds']:>8.3f} с "
+          f"(x{results['per_call_seconds'] / max(results['batch_seconds'], 1e-9):.1f})")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, JINJA_CACHE_DIR=cache_dir)
+        for label in ("cold", "warm"):
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--first-render"],
+                env=env, capture_output=True, text=True, check=True
+            )
+            seconds = float(proc.stdout.strip().splitlines()[-1])
+            results[f"first_render_{label}_ms"] = round(seconds * 1000, 1)
+            print(f"первый рендер, байткод-кэш {label}: {seconds * 1000:.1f} мс")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
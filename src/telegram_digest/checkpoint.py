@@ -0,0 +1,43 @@
+"""
+Чекпоинты долгих заданий (обслуживание, миграции).
+
+Состояние задания — небольшой JSON (курсор и счетчики) в файле
+CHECKPOINT_DIR/<имя>.json. Запись атомарная (временный файл + os.replace),
+поэтому прерывание в любой момент оставляет последнее целое состояние,
+и следующий запуск продолжает с него.
+"""
+import os
+import json
+from typing import Any, Dict, Optional
+
+def checkpoint_dir() -> str:
+    return os.getenv("CHECKPOINT_DIR", "./storage/checkpoints")
+
+class Checkpoint:
+    """Сохраненный прогресс задания name."""
+
+    def __init__(self, name: str, directory: Optional[str] = None):
+        self.name = name
+        self.path = os.path.join(directory or checkpoint_dir(), f"{name}.json")
+
+    def load(self) -> Dict[str, Any]:
+        """Последнее сохраненное состояние или пустой словарь."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self, state: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        """Задание завершено: следующий запуск начнется сначала."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
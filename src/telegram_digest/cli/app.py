@@ -1,22 +1,26 @@
 import os
 import asyncio
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 import click
-from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError
 from dotenv import load_dotenv
-from ..fetcher import fetch_posts
-from telegram_digest.summarizer import summarize
 import typer
-from telegram_digest.pdf_digest import generate_pdf_digest, generate_test_pdf
-from telegram_digest.config import load_channels_from_yaml
+from telegram_digest.config import load_channels_from_yaml, load_channel_intervals
+from telegram_digest.metrics import get_logger, log_summary, setup_logging, tracked_run, write_textfile
+
+if TYPE_CHECKING:
+    from telethon import TelegramClient
+
+# Тяжелые модули (telethon, firebase_admin, openai, weasyprint, ebooklib)
+# импортируются внутри команд: `--help` и каждая команда платят только за то, что используют.
 
 # Загружаем переменные окружения
 load_dotenv()
 
-def get_client() -> TelegramClient:
+def get_client() -> "TelegramClient":
     """Создает и возвращает клиент Telegram."""
+    from telethon import TelegramClient
+
     session = os.getenv("TG_SESSION", "./storage/session_name.session")
     api_id = int(os.getenv("TG_API_ID", ""))
     api_hash = os.getenv("TG_API_HASH", "")
@@ -27,10 +31,28 @@ def get_client() -> TelegramClient:
     return TelegramClient(session, api_id, api_hash)
 
 app = typer.Typer()
+log = get_logger(__name__)
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    log_level: Optional[str] = typer.Option(None, "--log-level", help="Уровень логирования: DEBUG, INFO, WARNING (по умолчанию LOG_LEVEL или INFO)")
+):
+    """Telegram Digest: загрузка каналов, саммари и дайджест."""
+    setup_logging(log_level)
+
+    def finish() -> None:
+        # Сводка метрик и файл для Prometheus — после любой команды
+        log_summary()
+        write_textfile()
+
+    ctx.call_on_close(finish)
 
 @app.command()
 def test_connection():
     """Проверяет подключение к Telegram."""
+    from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError
+
     client = get_client()
 
     async def inner():
@@ -62,19 +84,22 @@ def test_connection():
 
     asyncio.run(inner())
 
-async def fetch_posts_with_connect(client, channel_ids, days):
+async def fetch_posts_with_connect(client, channel_ids, days, concurrency=5):
+    from telegram_digest.fetcher import fetch_posts
+
     await client.connect()
     try:
-        await fetch_posts(client, channel_ids, days)
+        await fetch_posts(client, channel_ids, days, concurrency=concurrency)
     finally:
         await client.disconnect()
 
 @app.command()
-def fetch(channels: Optional[str] = None, days: int = 7):
+def fetch(channels: Optional[str] = None, days: int = 7, concurrency: int = 5):
     """
     Загружает посты из указанных каналов.
     channels — список ID каналов через запятую или None (тогда берём из YAML).
     days — за сколько дней загружать посты.
+    concurrency — сколько каналов загружать одновременно.
     """
     if channels:
         channel_ids = [c.strip() for c in channels.split(",") if c.strip()]
@@ -85,28 +110,79 @@ def fetch(channels: Optional[str] = None, days: int = 7):
         raise typer.Exit(1)
     # print(f"[DEBUG] Используемые каналы ({len(channel_ids)}): {channel_ids}")
     client = get_client()
-    asyncio.run(fetch_posts_with_connect(client, channel_ids, days))
+    asyncio.run(fetch_posts_with_connect(client, channel_ids, days, concurrency))
+
+@app.command()
+def listen(
+    channels: Optional[str] = typer.Option(None, "--channels", help="ID каналов через запятую (по умолчанию из YAML)"),
+    days: int = typer.Option(1, "--days", help="Глубина догоняющей загрузки для каналов, которые еще не загружались"),
+    batch_size: int = typer.Option(50, "--batch-size", help="Сколько постов копить перед записью"),
+    flush_seconds: float = typer.Option(2.0, "--flush-seconds", help="Максимальная задержка записи, секунд"),
+    catchup_minutes: float = typer.Option(60, "--catchup-minutes", help="Период страховочной догоняющей загрузки (0 — только после переподключения)")
+):
+    """
+    Получает новые и отредактированные посты событиями Telegram, без опроса истории.
+    Посты пишутся в хранилище пакетами; пропуски после разрывов закрываются догоняющей загрузкой.
+    """
+    from telegram_digest.listener import listen as listen_channels
+
+    if channels:
+        channel_ids = [c.strip() for c in channels.split(",") if c.strip()]
+    else:
+        channel_ids = load_channels_from_yaml()
+    if not channel_ids:
+        typer.echo("❌ Список каналов пуст. Укажите --channels или заполните channels.yaml", err=True)
+        raise typer.Exit(1)
+    try:
+        asyncio.run(listen_channels(get_client(), channel_ids, days, batch_size, flush_seconds, catchup_minutes))
+    except KeyboardInterrupt:
+        typer.echo("Остановлено")
 
 @app.command()
-def summarize_posts(batch: int = 50):
+def summarize_posts(
+    batch: int = 50,
+    concurrency: int = 8,
+    rpm: int = 500,
+    tpm: int = 200000,
+    pack_tokens: int = 0
+):
     """
     Заполняет поле summary для постов без дайджеста.
     batch — сколько документов обрабатывать за один запуск.
+    concurrency — сколько запросов к OpenAI держать одновременно.
+    rpm, tpm — лимиты запросов и токенов в минуту (0 — без ограничений).
+    pack_tokens — упаковывать несколько постов в запрос до этого бюджета токенов (0 — выключено).
     """
-    count = summarize(batch_size=batch)
+    from telegram_digest.summarizer import summarize
+
+    count = summarize(batch_size=batch, concurrency=concurrency, rpm=rpm, tpm=tpm, pack_tokens=pack_tokens)
     typer.echo(f"✅ Сформировано {count} саммари")
 
+def _check_split_pdf(split_pdf: bool) -> None:
+    """--split-pdf без pypdf — ошибка до начала работы, а не молчаливый откат к одному PDF."""
+    from telegram_digest.pdf_digest import pdf_merge_available
+
+    if split_pdf and not pdf_merge_available():
+        typer.echo("❌ Для --split-pdf нужен pypdf: poetry install -E split-pdf", err=True)
+        raise typer.Exit(1)
+
 @app.command()
 def pdf(
     from_: Optional[str] = typer.Option(None, "--from", help="Дата начала (YYYY-MM-DD), по умолчанию 7 дней назад"),
     to: Optional[str] = typer.Option(None, "--to", help="Дата конца (YYYY-MM-DD), по умолчанию сегодня"),
-    channels: Optional[List[str]] = typer.Option(None, "--channels", help="Список каналов через пробел (по умолчанию из YAML)")
+    channels: Optional[List[str]] = typer.Option(None, "--channels", help="Список каналов через пробел (по умолчанию из YAML)"),
+    split_pdf: bool = typer.Option(False, "--split-pdf", help="Рендерить PDF по частям (канал — часть) параллельно и склеить (нужен pypdf: poetry install -E split-pdf)"),
+    workers: Optional[int] = typer.Option(None, "--workers", help="Число процессов для рендеринга PDF (по умолчанию — число ядер)"),
+    fragment_cache: bool = typer.Option(True, "--fragment-cache/--no-fragment-cache", help="Брать неизмененные посты из кэша отрисованных фрагментов")
 ):
     """
     Генерирует PDF-дайджест по постам с summary за выбранный период и каналы.
     По умолчанию — последние 7 дней (UTC), каналы из YAML.
     Имя файла: Telegram_<YYYYMMDD>_<YYYYMMDD>.pdf
     """
+    from telegram_digest.pdf_digest import generate_pdf_digest
+
+    _check_split_pdf(split_pdf)
     date_to = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     if to:
         date_to = datetime.strptime(to, "%Y-%m-%d").replace(tzinfo=timezone.utc)
@@ -114,20 +190,171 @@ def pdf(
     if from_:
         date_from = datetime.strptime(from_, "%Y-%m-%d").replace(tzinfo=timezone.utc)
     channel_list = channels if channels else None
-    print(f"DEBUG: Запуск генерации PDF. date_from={date_from}, date_to={date_to}, channels={channel_list}")
-    pdf_path, count = generate_pdf_digest(date_from, date_to, channel_list)
-    print(f"DEBUG: Генерация PDF завершена. Путь: {pdf_path}, постов: {count}")
+    log.debug(f"Запуск генерации PDF. date_from={date_from}, date_to={date_to}, channels={channel_list}")
+    pdf_path, count = generate_pdf_digest(date_from, date_to, channel_list, split_pdf, workers, fragment_cache)
+    log.debug(f"Генерация PDF завершена. Путь: {pdf_path}, постов: {count}")
+    if count == 0:
+        typer.echo(f"❌ Нет постов с summary за выбранный период", err=True)
+        raise typer.Exit(1)
+    typer.echo(f"✓ {os.path.basename(pdf_path)} — {count} постов")
+
+@app.command()
+def run(
+    channels: Optional[str] = typer.Option(None, "--channels", help="ID каналов через запятую (по умолчанию из YAML)"),
+    days: int = typer.Option(1, "--days", help="За сколько дней загружать посты и строить дайджест"),
+    fetch_concurrency: int = typer.Option(5, "--fetch-concurrency", help="Сколько каналов загружать одновременно"),
+    concurrency: int = typer.Option(8, "--concurrency", help="Сколько запросов к OpenAI держать одновременно"),
+    rpm: int = typer.Option(500, "--rpm", help="Лимит запросов к OpenAI в минуту (0 — без ограничений)"),
+    tpm: int = typer.Option(200000, "--tpm", help="Лимит токенов OpenAI в минуту (0 — без ограничений)"),
+    pack_tokens: int = typer.Option(0, "--pack-tokens", help="Бюджет токенов пакетного запроса (0 — выключено)"),
+    split_pdf: bool = typer.Option(False, "--split-pdf", help="Рендерить PDF по частям параллельно и склеить (нужен pypdf: poetry install -E split-pdf)"),
+    workers: Optional[int] = typer.Option(None, "--workers", help="Число процессов для рендеринга PDF"),
+    fragment_cache: bool = typer.Option(True, "--fragment-cache/--no-fragment-cache", help="Брать неизмененные посты из кэша отрисованных фрагментов"),
+    links: bool = typer.Option(False, "--links", help="Загрузить и суммаризировать ссылки из постов")
+):
+    """
+    Загружает посты, делает саммари и собирает дайджест за один запуск:
+    одно подключение к Telegram, саммари начинаются во время загрузки,
+    дайджест строится из загруженного без повторного чтения из базы.
+    """
+    from telegram_digest.pdf_digest import build_digest
+    from telegram_digest.pipeline import run_pipeline, iter_pipeline_channel_posts
+
+    _check_split_pdf(split_pdf)
+    if channels:
+        channel_ids = [c.strip() for c in channels.split(",") if c.strip()]
+    else:
+        channel_ids = load_channels_from_yaml()
+    if not channel_ids:
+        typer.echo("❌ Список каналов пуст. Укажите --channels или заполните channels.yaml", err=True)
+        raise typer.Exit(1)
+    client = get_client()
+    # Один run на весь запуск: метрики загрузки, саммари и рендеринга попадут в его сводку
+    with tracked_run(days) as run_id:
+        fetched, date_from, date_to = asyncio.run(run_pipeline(
+            client, channel_ids, days, fetch_concurrency, concurrency, rpm, tpm, pack_tokens, links, run_id
+        ))
+        pdf_path, _, count = build_digest(
+            iter_pipeline_channel_posts(fetched, date_from, date_to), date_from, date_to,
+            split_pdf=split_pdf, workers=workers, fragment_cache=fragment_cache
+        )
     if count == 0:
         typer.echo(f"❌ Нет постов с summary за выбранный период", err=True)
         raise typer.Exit(1)
     typer.echo(f"✓ {os.path.basename(pdf_path)} — {count} постов")
 
+@app.command()
+def links(
+    channels: Optional[str] = typer.Option(None, "--channels", help="ID каналов через запятую (по умолчанию из YAML)"),
+    days: int = typer.Option(1, "--days", help="За сколько дней брать посты"),
+    concurrency: int = typer.Option(20, "--concurrency", help="Сколько ссылок загружать одновременно"),
+    per_domain: int = typer.Option(2, "--per-domain", help="Сколько одновременных запросов к одному домену"),
+    timeout: float = typer.Option(10, "--timeout", help="Таймаут запроса, секунд"),
+    summarize: bool = typer.Option(True, "--summarize/--no-summarize", help="Делать саммари загруженных страниц")
+):
+    """
+    Загружает ссылки из постов с summary за период: каждая уникальная ссылка —
+    один раз, с кэшем и условными запросами (ETag / Last-Modified).
+    """
+    from telegram_digest.links import collect_urls, enrich_links
+    from telegram_digest.storage import iter_digest_posts
+
+    if channels:
+        channel_ids = [c.strip() for c in channels.split(",") if c.strip()]
+    else:
+        channel_ids = load_channels_from_yaml()
+    if not channel_ids:
+        typer.echo("❌ Список каналов пуст. Укажите --channels или заполните channels.yaml", err=True)
+        raise typer.Exit(1)
+    date_to = datetime.now(timezone.utc)
+    date_from = date_to - timedelta(days=days)
+    urls = collect_urls(
+        post for channel_id in channel_ids for post in iter_digest_posts(channel_id, date_from, date_to)
+    )
+    stats = asyncio.run(enrich_links(urls, concurrency, per_domain, timeout, summarize=summarize))
+    typer.echo(f"✅ Ссылок: {stats['urls']}, ошибок: {stats['errors']}")
+
+@app.command()
+def serve(
+    days: int = typer.Option(1, "--days", help="Период загрузки и дайджеста, дней"),
+    interval: int = typer.Option(60, "--interval", help="Интервал загрузки канала в минутах, если не задан в channels.yaml"),
+    digest_every: float = typer.Option(24, "--digest-every", help="Как часто собирать дайджест, часов"),
+    fetch_concurrency: int = typer.Option(5, "--fetch-concurrency", help="Сколько каналов загружать одновременно"),
+    concurrency: int = typer.Option(8, "--concurrency", help="Сколько запросов к OpenAI держать одновременно"),
+    rpm: int = typer.Option(500, "--rpm", help="Лимит запросов к OpenAI в минуту (0 — без ограничений)"),
+    tpm: int = typer.Option(200000, "--tpm", help="Лимит токенов OpenAI в минуту (0 — без ограничений)"),
+    pack_tokens: int = typer.Option(0, "--pack-tokens", help="Бюджет токенов пакетного запроса (0 — выключено)"),
+    host: str = typer.Option("127.0.0.1", "--host", help="Адрес эндпоинта /health и /metrics"),
+    port: int = typer.Option(8765, "--port", help="Порт эндпоинта /health и /metrics")
+):
+    """
+    Работает постоянно: держит подключения открытыми, загружает каналы
+    по их интервалам, сразу делает саммари и собирает дайджест по расписанию.
+    """
+    from telegram_digest.daemon import DigestDaemon
+
+    intervals = load_channel_intervals(default_minutes=interval)
+    if not intervals:
+        typer.echo("❌ Список каналов пуст. Заполните channels.yaml", err=True)
+        raise typer.Exit(1)
+    daemon = DigestDaemon(
+        get_client(), intervals, days, digest_every, fetch_concurrency,
+        concurrency, rpm, tpm, pack_tokens, host, port
+    )
+    asyncio.run(daemon.run())
+
+@app.command()
+def maintain(
+    jobs: str = typer.Option("clean,backfill,prune", "--jobs", help="Задания через запятую: clean, backfill, prune"),
+    retention_days: Optional[int] = typer.Option(None, "--retention-days", help="Удалять посты старше N дней (без параметра prune пропускается)"),
+    min_words: int = typer.Option(5, "--min-words", help="Посты короче стольких слов удаляются заданием clean"),
+    page_size: int = typer.Option(500, "--page-size", help="Размер страницы обхода"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Только посчитать, ничего не менять"),
+    restart: bool = typer.Option(False, "--restart", help="Начать обходы сначала, игнорируя чекпоинты")
+):
+    """
+    Обслуживание хранилища: удаление пустых и коротких постов, заполнение
+    updated_at и удаление постов старше срока хранения. Прерванный запуск
+    продолжается с места остановки.
+    """
+    from telegram_digest.maintenance import run_maintenance
+
+    job_list = [job.strip() for job in jobs.split(",") if job.strip()]
+    try:
+        run_maintenance(job_list, retention_days, min_words, page_size, dry_run, restart)
+    except ValueError as e:
+        typer.echo(f"❌ {e}", err=True)
+        raise typer.Exit(1)
+
+@app.command()
+def migrate(
+    name: str = typer.Argument(..., help="Имя миграции (например, flat-messages)"),
+    workers: int = typer.Option(8, "--workers", help="Сколько пакетов записи коммитить одновременно"),
+    page_size: int = typer.Option(500, "--page-size", help="Размер страницы чтения"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Только прочитать выборку и оценить время"),
+    sample: int = typer.Option(2000, "--sample", help="Размер выборки для --dry-run"),
+    restart: bool = typer.Option(False, "--restart", help="Начать сначала, игнорируя чекпоинт")
+):
+    """
+    Выполняет миграцию схемы Firestore: чтение по курсору, параллельная
+    пакетная запись, продолжение с чекпоинта после прерывания.
+    """
+    from telegram_digest.migrate_flat import run_migration
+
+    try:
+        run_migration(name, page_size, workers, dry_run, restart, sample)
+    except ValueError as e:
+        typer.echo(f"❌ {e}", err=True)
+        raise typer.Exit(1)
+
 @app.command()
 def pdf_test(channel: str = typer.Option("@cryptoEssay", "--channel", help="ID канала для тестового PDF")):
     """
     Генерирует тестовый PDF с постами из указанного канала.
     Если постов нет, использует тестовые данные.
     """
+    from telegram_digest.pdf_digest import generate_test_pdf
+
     generate_test_pdf(channel)
 
 if __name__ == "__main__":
@@ -1,11 +1,20 @@
 import os
 import yaml
 
-def load_channels_from_yaml(path: str = "channels.yaml") -> list[str]:
+
+def _read_yaml(path: str):
+    """Содержимое channels.yaml или None, если файла нет."""
     if not os.path.exists(path):
-        return []
+        return None
     with open(path, "r", encoding="utf-8") as f:
-        data = yaml.safe_load(f)
+        return yaml.safe_load(f)
+
+
+def load_channels_from_yaml(path: str = "channels.yaml") -> list[str]:
+    return _channels_from_data(_read_yaml(path))
+
+
+def _channels_from_data(data) -> list[str]:
     if not data:
         return []
     # Если это просто список строк
@@ -24,4 +33,24 @@ def load_channels_from_yaml(path: str = "channels.yaml") -> list[str]:
                     if ch.get("enabled", True):
                         result.append(ch.get("id"))
             return [c for c in result if c]
-    return [] 
\ No newline at end of file
+    return []
+
+
+def load_channel_intervals(path: str = "channels.yaml", default_minutes: int = 60) -> dict[str, int]:
+    """
+    Интервалы загрузки каналов для режима serve, в минутах: {канал: интервал}.
+    Интервал канала задается полем interval_minutes, общий — ключом
+    fetch_interval_minutes верхнего уровня, иначе default_minutes.
+    """
+    data = _read_yaml(path)
+    channels = _channels_from_data(data)
+    if not channels:
+        return {}
+    if isinstance(data, dict):
+        default_minutes = int(data.get("fetch_interval_minutes", default_minutes))
+    intervals = {channel: default_minutes for channel in channels}
+    if isinstance(data, dict) and isinstance(data.get("channels"), list):
+        for ch in data["channels"]:
+            if isinstance(ch, dict) and ch.get("id") in intervals and ch.get("interval_minutes"):
+                intervals[ch["id"]] = int(ch["interval_minutes"])
+    return intervals
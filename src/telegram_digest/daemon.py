@@ -0,0 +1,268 @@
+"""
+Резидентный режим (команда `serve`) вместо запуска по cron.
+
+Процесс держит открытыми соединение с Telegram, клиент хранилища и клиент OpenAI.
+Планировщик раз в tick_seconds находит каналы, которым пора обновиться
+(интервал канала — из channels.yaml, см. load_channel_intervals), и загружает их
+вместе с саммари через fetch_and_summarize. После каждого тика загрузки
+досуммаризируются посты без summary, оставшиеся от прошлых тиков (сбой тика,
+недоступность OpenAI), — до BACKLOG_BATCH постов за раз. Дайджест за последние
+days дней собирается раз в digest_every_hours часов.
+
+Локальный HTTP-эндпоинт:
+  /health  — JSON со статусом, глубиной очереди и отставанием каналов (503, если отстаем);
+  /metrics — те же данные в текстовом формате Prometheus, плюс счетчики
+             и тайминги этапов из реестра telegram_digest.metrics.
+"""
+import os
+import json
+import time
+import signal
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from telegram_digest.pdf_digest import generate_digest
+from telegram_digest.metrics import get_logger, metrics, write_textfile
+from telegram_digest.pipeline import fetch_and_summarize
+from telegram_digest.storage import get_posts_without_summary
+from telegram_digest.summarizer import DEFAULT_CONCURRENCY, DEFAULT_RPM, DEFAULT_TPM, summarize_stream
+
+log = get_logger(__name__)
+
+# Как часто планировщик проверяет, каким каналам пора загружаться
+TICK_SECONDS = 30
+# Канал считается отстающим, если не обновлялся дольше LAG_FACTOR интервалов
+LAG_FACTOR = 3
+# Сколько постов без summary досуммаризировать за один тик
+BACKLOG_BATCH = 200
+
+class DigestDaemon:
+    """Планировщик загрузки, саммари и дайджестов с эндпоинтом здоровья и метрик."""
+
+    def __init__(
+        self,
+        client,
+        intervals: Dict[str, int],
+        days: int = 1,
+        digest_every_hours: float = 24,
+        fetch_concurrency: int = 5,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        rpm: Optional[int] = DEFAULT_RPM,
+        tpm: Optional[int] = DEFAULT_TPM,
+        pack_tokens: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        tick_seconds: float = TICK_SECONDS,
+        summary_client=None,
+    ):
+        self.client = client
+        self.intervals = intervals
+        self.days = days
+        self.digest_every_hours = digest_every_hours
+        self.fetch_concurrency = fetch_concurrency
+        self.concurrency = concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.pack_tokens = pack_tokens
+        self.host = host
+        self.port = port
+        self.tick_seconds = tick_seconds
+        self.summary_client = summary_client
+        self.started = time.monotonic()
+        # Время следующей загрузки канала (time.monotonic); 0 — загрузить сразу
+        self.next_fetch: Dict[str, float] = {channel: 0.0 for channel in intervals}
+        self.last_fetched: Dict[str, float] = {}
+        self.to_summarize: Optional[asyncio.Queue] = None
+        self.stopping: Optional[asyncio.Event] = None
+        self.stats = {
+            'fetch_ticks': 0,
+            'fetch_errors': 0,
+            'posts_fetched': 0,
+            'backlog_summaries': 0,
+            'backlog_errors': 0,
+            'digests': 0,
+            'digest_errors': 0,
+        }
+        self.last_digest_at: Optional[datetime] = None
+        self.last_digest_path: Optional[str] = None
+
+    async def run(self) -> None:
+        """Работает до SIGINT/SIGTERM; текущая загрузка при остановке доводится до конца."""
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stopping.set)
+            except NotImplementedError:
+                # Windows: остановка только по KeyboardInterrupt
+                pass
+        if self.summary_client is None:
+            import openai
+
+            self.summary_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        server = await asyncio.start_server(self._handle_http, self.host, self.port)
+        # При port=0 порт выбирает система
+        self.port = server.sockets[0].getsockname()[1]
+        log.info(f"Здоровье и метрики: http://{self.host}:{self.port}/health, /metrics")
+        await self.client.connect()
+        try:
+            await asyncio.gather(self._fetch_loop(), self._digest_loop())
+        finally:
+            server.close()
+            await server.wait_closed()
+            await self.client.disconnect()
+        log.info("Демон остановлен")
+
+    async def _sleep(self, seconds: float) -> None:
+        """Пауза, прерываемая остановкой."""
+        try:
+            await asyncio.wait_for(self.stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def due_channels(self) -> List[str]:
+        now = time.monotonic()
+        return [channel for channel, at in self.next_fetch.items() if at <= now]
+
+    async def _fetch_loop(self) -> None:
+        while not self.stopping.is_set():
+            due = self.due_channels()
+            if due:
+                await self._fetch(due)
+                await self._summarize_backlog()
+            await self._sleep(self.tick_seconds)
+
+    async def _fetch(self, channels: List[str]) -> None:
+        self.stats['fetch_ticks'] += 1
+        self.to_summarize = asyncio.Queue()
+        try:
+            if not self.client.is_connected():
+                await self.client.connect()
+            fetched = await fetch_and_summarize(
+                self.client, channels, self.days, self.fetch_concurrency,
+                self.concurrency, self.rpm, self.tpm, self.pack_tokens,
+                to_summarize=self.to_summarize, summary_client=self.summary_client
+            )
+        except Exception as e:
+            self.stats['fetch_errors'] += 1
+            log.error(f"Ошибка загрузки каналов {', '.join(channels)}: {e}")
+        else:
+            self.stats['posts_fetched'] += sum(len(posts) for posts in fetched.values())
+            finished = time.monotonic()
+            for channel in channels:
+                self.last_fetched[channel] = finished
+        finally:
+            self.to_summarize = None
+            write_textfile()
+        # Следующая попытка — через интервал и после ошибки, чтобы не долбить Telegram
+        for channel in channels:
+            self.next_fetch[channel] = time.monotonic() + self.intervals[channel] * 60
+
+    async def _summarize_backlog(self) -> None:
+        """Саммари для постов, которые прошлые тики сохранили без summary."""
+        try:
+            posts = await asyncio.to_thread(get_posts_without_summary, BACKLOG_BATCH)
+            if not posts:
+                return
+            queue: asyncio.Queue = asyncio.Queue()
+            queue.put_nowait(posts)
+            queue.put_nowait(None)
+            summaries = await summarize_stream(
+                queue, self.concurrency, self.rpm, self.tpm,
+                pack_tokens=self.pack_tokens, client=self.summary_client
+            )
+        except Exception as e:
+            self.stats['backlog_errors'] += 1
+            log.error(f"Ошибка досуммаризации постов без summary: {e}")
+            return
+        self.stats['backlog_summaries'] += len(summaries)
+        log.info(f"Досуммаризировано постов из прошлых тиков: {len(summaries)} из {len(posts)}")
+
+    async def _digest_loop(self) -> None:
+        while True:
+            await self._sleep(self.digest_every_hours * 3600)
+            if self.stopping.is_set():
+                return
+            date_to = datetime.now(timezone.utc)
+            date_from = date_to - timedelta(days=self.days)
+            try:
+                # Рендеринг синхронный и тяжелый — не блокируем загрузку и эндпоинт
+                pdf_path, _, count = await asyncio.to_thread(
+                    generate_digest, date_from, date_to, list(self.intervals)
+                )
+            except Exception as e:
+                self.stats['digest_errors'] += 1
+                log.error(f"Ошибка при сборке дайджеста: {e}")
+                continue
+            self.stats['digests'] += 1
+            self.last_digest_at = date_to
+            self.last_digest_path = pdf_path
+            log.info(f"Дайджест {os.path.basename(pdf_path) if pdf_path else 'без PDF'} — {count} постов")
+
+    def channel_lags(self) -> Dict[str, float]:
+        """Секунды с последней успешной загрузки канала (с запуска, если загрузок не было)."""
+        now = time.monotonic()
+        return {channel: now - self.last_fetched.get(channel, self.started) for channel in self.intervals}
+
+    def health(self) -> Tuple[bool, dict]:
+        lags = self.channel_lags()
+        lagging = [
+            channel for channel, lag in lags.items()
+            if lag > LAG_FACTOR * self.intervals[channel] * 60 + self.tick_seconds
+        ]
+        return not lagging, {
+            'status': "ok" if not lagging else "lagging",
+            'uptime_seconds': round(time.monotonic() - self.started, 1),
+            'queue_depth': self.to_summarize.qsize() if self.to_summarize is not None else 0,
+            'channels_due': len(self.due_channels()),
+            'max_lag_seconds': round(max(lags.values(), default=0.0), 1),
+            'lagging_channels': lagging,
+            'last_digest_at': self.last_digest_at.isoformat() if self.last_digest_at else None,
+            'last_digest_path': self.last_digest_path,
+            **self.stats,
+        }
+
+    def metrics_text(self) -> str:
+        _, health = self.health()
+        lines = [
+            f"telegram_digest_uptime_seconds {health['uptime_seconds']}",
+            f"telegram_digest_summary_queue_depth {health['queue_depth']}",
+            f"telegram_digest_channels_due {health['channels_due']}",
+            f"telegram_digest_fetch_ticks_total {self.stats['fetch_ticks']}",
+            f"telegram_digest_fetch_errors_total {self.stats['fetch_errors']}",
+            f"telegram_digest_posts_fetched_total {self.stats['posts_fetched']}",
+            f"telegram_digest_backlog_summaries_total {self.stats['backlog_summaries']}",
+            f"telegram_digest_backlog_errors_total {self.stats['backlog_errors']}",
+            f"telegram_digest_digests_total {self.stats['digests']}",
+            f"telegram_digest_digest_errors_total {self.stats['digest_errors']}",
+        ]
+        if self.last_digest_at is not None:
+            lines.append(f"telegram_digest_last_digest_timestamp_seconds {self.last_digest_at.timestamp():.0f}")
+        for channel, lag in self.channel_lags().items():
+            lines.append(f'telegram_digest_channel_lag_seconds{{channel="{channel}"}} {lag:.1f}')
+        return "\n".join(lines) + "\n" + metrics.prometheus_text()
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Минимальный HTTP/1.1: смотрим только путь из строки запроса."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            parts = request_line.decode("latin-1").split()
+            path = parts[1] if len(parts) >= 2 else "/"
+            if path == "/health":
+                healthy, data = self.health()
+                status = "200 OK" if healthy else "503 Service Unavailable"
+                content_type, body = "application/json", json.dumps(data, ensure_ascii=False)
+            elif path == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4", self.metrics_text()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "not found\n"
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
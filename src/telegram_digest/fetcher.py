@@ -1,112 +1,292 @@
 import asyncio
-from datetime import datetime, timedelta
-from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from telethon import TelegramClient
-from telethon.tl.types import Message, Channel
+from telethon.tl.types import Message, Channel, InputPeerChannel
 from telethon.tl.functions.messages import GetHistoryRequest
-from telethon.tl.functions.channels import GetFullChannelRequest
-from telethon.errors import ChannelPrivateError, FloodWaitError
-import html2text
-from .firebase_db import upsert_post, start_run, end_run, check_saved_posts
+from telethon.errors import ChannelInvalidError, ChannelPrivateError, FloodWaitError, PeerIdInvalidError
+from .metrics import get_logger, inc, metrics, span
+from .normalization import normalize_message
+from .telegram_scheduler import TelegramScheduler, RESOLVE, HISTORY
+from .storage import (
+    upsert_posts, start_run, end_run, get_channel_state, update_channel_state, update_channel_meta
+)
+
+log = get_logger(__name__)
+
+# Сколько раз канал возвращается в очередь после FloodWaitError, прежде чем сдаться
+FLOOD_WAIT_RETRIES = 10
+
+# Сколько доверяем закэшированному peer канала, прежде чем разрешить его заново
+CHANNEL_META_TTL = timedelta(days=7)
+
+# Ошибки, после которых закэшированный peer считаем устаревшим
+PEER_ERRORS = (ChannelPrivateError, ChannelInvalidError, PeerIdInvalidError)
+
+# Обработчик загруженных страниц: (канал, посты страницы с флагом 'added')
+OnPosts = Callable[[str, List[Dict]], Awaitable[None]]
+
+def message_to_post(message: Message, channel_id: str) -> Dict:
+    """
+    Преобразует сообщение Telegram в словарь поста для upsert_posts.
+    plain_text — текст сообщения как есть, text_html строится из entities (см. normalization).
+    """
+    plain_text, entities, text_html = normalize_message(message)
+    return {
+        'msg_id': message.id,
+        'channel_id': channel_id,
+        'date': message.date,
+        'text_html': text_html,
+        'plain_text': plain_text,
+        'entities': entities
+    }
 
 async def fetch_posts(
     client: TelegramClient,
     channel_ids: List[str],
     days: int = 1,
-    limit: int = 10
+    limit: int = 100,
+    concurrency: int = 5,
+    on_posts: Optional[OnPosts] = None,
+    scheduler: Optional[TelegramScheduler] = None,
+    run_id: Optional[str] = None
 ) -> None:
     """
     Загружает посты из указанных каналов за последние N дней.
+    Каналы берут из общей очереди concurrency воркеров.
+    Для каждого канала загружаются только сообщения новее сохраненной
+    отметки last_seen_msg_id (см. _fetch_channel).
+    Запросы идут через TelegramScheduler: при FloodWait канал возвращается
+    в очередь после ожидания и продолжает с той страницы, на которой остановился,
+    а воркер тем временем берет следующий канал.
     
     Args:
         client: Клиент Telegram
         channel_ids: Список ID каналов
         days: Количество дней для загрузки
-        limit: Максимальное количество постов для загрузки
+        limit: Размер страницы истории (не больше 100 — ограничение Telegram)
+        concurrency: Максимальное количество одновременно загружаемых каналов
+        on_posts: Вызывается после сохранения каждой страницы; у постов
+            выставлен флаг 'added' — был ли пост добавлен в хранилище
+        scheduler: Планировщик запросов (общий для нескольких вызовов); по умолчанию создается свой
+        run_id: Запуск, которым управляет вызывающий (см. metrics.tracked_run);
+            по умолчанию загрузка сама учитывается отдельным run с метриками загрузки
     """
-    # Начинаем новый run
-    run_id = start_run(days)
+    own_run = run_id is None
+    if own_run:
+        run_id = start_run(days)
+        baseline = metrics.snapshot()
     
     try:
-        # Создаем конвертер HTML в текст
-        h2t = html2text.HTML2Text()
-        h2t.ignore_links = False
-        h2t.ignore_images = True
-        
-        # Вычисляем дату начала
-        start_date = datetime.now() - timedelta(days=days)
+        # Вычисляем дату начала (даты сообщений Telegram — в UTC)
+        start_date = datetime.now(timezone.utc) - timedelta(days=days)
         
+        if scheduler is None:
+            scheduler = TelegramScheduler(client)
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
         for channel_id in channel_ids:
-            try:
-                # Получаем информацию о канале
-                channel = await client.get_entity(channel_id)
-                if not isinstance(channel, Channel):
-                    print(f"Пропускаем {channel_id}: не является каналом")
-                    continue
-                
-                # Получаем полную информацию о канале
-                full_channel = await client(GetFullChannelRequest(channel))
-                
-                # Получаем историю сообщений
-                history = await client(GetHistoryRequest(
-                    peer=channel,
-                    limit=limit,
-                    offset_date=None,
-                    offset_id=0,
-                    max_id=0,
-                    min_id=0,
-                    add_offset=0,
-                    hash=0
-                ))
-                
-                added_count = 0
-                min_date = None
-                # Обрабатываем сообщения
-                for message in history.messages:
-                    # Конвертируем HTML в текст
-                    plain_text = h2t.handle(message.message) if message.message else None
-                    
-                    # Преобразуем entities в список словарей
-                    entities = []
-                    if message.entities:
-                        for entity in message.entities:
-                            entity_dict = {
-                                'type': entity.__class__.__name__,
-                                'offset': entity.offset,
-                                'length': entity.length
-                            }
-                            # Добавляем специфичные поля для разных типов entities
-                            if hasattr(entity, 'url'):
-                                entity_dict['url'] = entity.url
-                            if hasattr(entity, 'user_id'):
-                                entity_dict['user_id'] = entity.user_id
-                            entities.append(entity_dict)
-                    
-                    # Сохраняем пост
-                    result = upsert_post(
-                        msg_id=message.id,
-                        channel_id=channel_id,
-                        date=message.date,
-                        text_html=message.message,
-                        plain_text=plain_text,
-                        entities=entities
-                    )
-                    if result:
-                        added_count += 1
-                    # Определяем дату самого старого сообщения
-                    if min_date is None or (message.date and message.date < min_date):
-                        min_date = message.date
-                
-                print(f"Канал: {channel.title} (@{channel.username}) | считано: {len(history.messages)}, добавлено: {added_count}, самое старое: {min_date}")
-                
-            except ChannelPrivateError:
-                print(f"Не удалось получить доступ к каналу {channel_id}: канал приватный")
-            except FloodWaitError as e:
-                print(f"Достигнут лимит запросов, ожидаем {e.seconds} секунд")
-                await asyncio.sleep(e.seconds)
-            except Exception as e:
-                print(f"Ошибка при загрузке канала {channel_id}: {str(e)}")
+            queue.put_nowait({'channel_id': channel_id, 'progress': {}, 'floods': 0, 'force_resolve': False})
+        remaining = len(channel_ids)
+        finished = asyncio.Event()
+        if not remaining:
+            finished.set()
+        
+        async def worker() -> None:
+            nonlocal remaining
+            while True:
+                task = await queue.get()
+                with span("fetch_channel", channel=task['channel_id']):
+                    wait_seconds = await _fetch_channel_task(client, task, limit, start_date, on_posts, scheduler)
+                if wait_seconds is None:
+                    remaining -= 1
+                    if remaining == 0:
+                        finished.set()
+                else:
+                    # Канал вернется в очередь после ожидания, воркер свободен для других
+                    loop.call_later(wait_seconds, queue.put_nowait, task)
+        
+        workers = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))]
+        try:
+            await finished.wait()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        log.info(scheduler.stats_line())
     
     finally:
-        # Завершаем run
-        end_run(run_id) 
\ No newline at end of file
+        if own_run:
+            end_run(run_id, metrics.since(baseline))
+
+async def _fetch_channel_task(
+    client: TelegramClient,
+    task: Dict,
+    limit: int,
+    start_date: datetime,
+    on_posts: Optional[OnPosts],
+    scheduler: TelegramScheduler
+) -> Optional[float]:
+    """
+    Выполняет одну попытку загрузки канала из очереди.
+    Возвращает None, если канал обработан (или пропущен из-за ошибки),
+    иначе — через сколько секунд вернуть его в очередь.
+    Ошибка доступа к каналу сначала повторяется с заново разрешенным peer:
+    закэшированный мог устареть.
+    """
+    channel_id = task['channel_id']
+    try:
+        await _fetch_channel(
+            client, channel_id, limit, start_date, on_posts,
+            task['force_resolve'], scheduler, task['progress']
+        )
+        return None
+    except PEER_ERRORS as e:
+        if not task['force_resolve']:
+            task['force_resolve'] = True
+            return 0
+        if isinstance(e, ChannelPrivateError):
+            log.warning(f"Не удалось получить доступ к каналу {channel_id}: канал приватный")
+        else:
+            log.warning(f"Не удалось получить доступ к каналу {channel_id}: {str(e)}")
+        return None
+    except FloodWaitError as e:
+        task['floods'] += 1
+        if task['floods'] > FLOOD_WAIT_RETRIES:
+            log.warning(f"Канал {channel_id} пропущен: лимит запросов не снят после {FLOOD_WAIT_RETRIES} попыток")
+            return None
+        log.info(f"Достигнут лимит запросов для {channel_id}, канал вернется в очередь через {e.seconds} секунд")
+        return e.seconds
+    except Exception as e:
+        log.error(f"Ошибка при загрузке канала {channel_id}: {str(e)}")
+        return None
+
+async def _resolve_channel(
+    client: TelegramClient,
+    channel_id: str,
+    state: Dict,
+    force: bool = False,
+    scheduler: Optional[TelegramScheduler] = None
+) -> Optional[Tuple[InputPeerChannel, str, Optional[str]]]:
+    """
+    Возвращает (peer, название, username) канала.
+    Пока кэш в channel_state моложе CHANNEL_META_TTL, peer собирается из
+    сохраненных id и access_hash без запросов к Telegram; иначе (или при force)
+    канал разрешается через get_entity и кэш обновляется.
+    Возвращает None, если channel_id — не канал.
+    """
+    resolved_at = state.get('resolved_at')
+    if (not force and state.get('peer_id') and state.get('access_hash') is not None
+            and resolved_at is not None and datetime.now(timezone.utc) - resolved_at < CHANNEL_META_TTL):
+        return InputPeerChannel(state['peer_id'], state['access_hash']), state.get('title'), state.get('username')
+    if scheduler is not None:
+        channel = await scheduler.call(RESOLVE, lambda: client.get_entity(channel_id))
+    else:
+        channel = await client.get_entity(channel_id)
+    if not isinstance(channel, Channel):
+        return None
+    await asyncio.to_thread(
+        update_channel_meta, channel_id, channel.id, channel.access_hash, channel.title, channel.username
+    )
+    return InputPeerChannel(channel.id, channel.access_hash), channel.title, channel.username
+
+async def _fetch_channel(
+    client: TelegramClient,
+    channel_id: str,
+    limit: int,
+    start_date: datetime,
+    on_posts: Optional[OnPosts] = None,
+    force_resolve: bool = False,
+    scheduler: Optional[TelegramScheduler] = None,
+    progress: Optional[Dict] = None
+) -> None:
+    """
+    Загружает историю одного канала и сохраняет новые посты.
+    Канал разрешается из кэша метаданных (см. _resolve_channel), так что
+    обычный запуск не тратит запросы на get_entity.
+    
+    История читается страницами от новых сообщений к старым (offset_id),
+    пока не дойдем до start_date. Если канал уже загружался и загруженный
+    период покрывает start_date, запрашиваются только сообщения новее
+    last_seen_msg_id (min_id), поэтому обычный запуск стоит одного запроса.
+    progress — состояние постраничного чтения; после FloodWait повторный вызов
+    с тем же progress продолжает с прерванной страницы.
+    """
+    if scheduler is None:
+        scheduler = TelegramScheduler(client)
+    if progress is None:
+        progress = {}
+    state = await asyncio.to_thread(get_channel_state, channel_id)
+    # Получаем peer канала (из кэша или через get_entity)
+    resolved = await _resolve_channel(client, channel_id, state, force_resolve, scheduler)
+    if resolved is None:
+        log.warning(f"Пропускаем {channel_id}: не является каналом")
+        return
+    peer, title, username = resolved
+    
+    last_seen = state.get('last_seen_msg_id') or 0
+    covered_from = state.get('covered_from')
+    # Если нужно загрузить глубже уже загруженного периода — читаем без min_id
+    incremental = bool(last_seen) and covered_from is not None and covered_from <= start_date
+    min_id = last_seen if incremental else 0
+    
+    progress.setdefault('read', 0)
+    progress.setdefault('added', 0)
+    progress.setdefault('min_date', None)
+    progress.setdefault('max_msg_id', last_seen)
+    progress.setdefault('offset_id', 0)
+    while True:
+        # Получаем очередную страницу истории сообщений
+        history = await scheduler.call(HISTORY, GetHistoryRequest(
+            peer=peer,
+            limit=limit,
+            offset_date=None,
+            offset_id=progress['offset_id'],
+            max_id=0,
+            min_id=min_id,
+            add_offset=0,
+            hash=0
+        ))
+        if not history.messages:
+            break
+        
+        # Обрабатываем сообщения
+        page_posts = []
+        for message in history.messages:
+            progress['max_msg_id'] = max(progress['max_msg_id'], message.id)
+            # Служебные сообщения и сообщения старше периода не сохраняем
+            if not isinstance(message, Message) or message.date < start_date:
+                continue
+            progress['read'] += 1
+            page_posts.append(message_to_post(message, channel_id))
+            # Определяем дату самого старого сообщения
+            if progress['min_date'] is None or message.date < progress['min_date']:
+                progress['min_date'] = message.date
+        
+        # Сохраняем страницу одним пакетом (синхронный вызов Firestore
+        # выносим в поток, чтобы не блокировать загрузку остальных каналов)
+        if page_posts:
+            results = await asyncio.to_thread(upsert_posts, page_posts)
+            progress['added'] += sum(results)
+            inc("messages_fetched", len(page_posts))
+            inc("posts_added", sum(results))
+            if on_posts is not None:
+                for post, added in zip(page_posts, results):
+                    post['added'] = added
+                await on_posts(channel_id, page_posts)
+        
+        oldest = history.messages[-1]
+        # Дошли до начала периода или до конца истории канала
+        if oldest.date < start_date or len(history.messages) < limit:
+            break
+        progress['offset_id'] = oldest.id
+    
+    # Отметку сохраняем только после успешной загрузки всего периода
+    if incremental:
+        covered_from = min(covered_from, start_date)
+    else:
+        covered_from = start_date
+    await asyncio.to_thread(update_channel_state, channel_id, progress['max_msg_id'], covered_from)
+    
+    log.info(f"Канал: {title} (@{username}) | считано: {progress['read']}, добавлено: {progress['added']}, "
+             f"самое старое: {progress['min_date']}")
@@ -1,9 +1,15 @@
 import os
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
 from dotenv import load_dotenv
+from telegram_digest.metrics import get_logger
+from telegram_digest.models import is_valid_post, post_doc_id, link_doc_id
+
+log = get_logger(__name__)
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -24,8 +30,22 @@ def init_firebase():
     
     return firestore.client()
 
-# Получение клиента Firestore
-db = init_firebase()
+_db = None
+
+def get_db():
+    """
+    Возвращает клиент Firestore, инициализируя Firebase при первом обращении.
+    Импорт модуля не открывает соединений и не читает учетные данные.
+    """
+    global _db
+    if _db is None:
+        _db = init_firebase()
+    return _db
+
+# Firestore ограничивает один пакет записи 500 операциями
+BATCH_LIMIT = 500
+# Сколько раз BulkWriter повторяет неудавшуюся запись
+BULK_WRITE_ATTEMPTS = 5
 
 def upsert_post(
     msg_id: int,
@@ -37,33 +57,112 @@ def upsert_post(
     entities: Optional[List[Dict[str, Any]]] = None,
 ) -> bool:
     """Добавляет или обновляет пост. Возвращает True, если добавлен, иначе False."""
-    # Проверки на валидность поста
-    if not msg_id or not channel_id or not date:
-        return False
-    if plain_text is None or (isinstance(plain_text, str) and not plain_text.strip()):
-        return False
-    if isinstance(plain_text, str) and len(plain_text.split()) < 5:
-        return False
-    doc_id = f"{channel_id}_{msg_id}"
-    doc_ref = db.collection('messages').document(doc_id)
-    if doc_ref.get().exists:
-        return False
-    post_data = {
+    return upsert_posts([{
         'msg_id': msg_id,
-        'channel': channel_id,
+        'channel_id': channel_id,
         'date': date,
         'text_html': text_html,
         'plain_text': plain_text,
         'summary': summary,
-        'entities': entities or [],
-        'updated_at': firestore.SERVER_TIMESTAMP
-    }
-    try:
-        doc_ref.set(post_data, merge=True)
-        return True
-    except Exception as e:
-        print(f"[ERROR] Ошибка при сохранении поста {msg_id}: {str(e)}")
-        raise
+        'entities': entities,
+    }])[0]
+
+def upsert_posts(posts: List[Dict[str, Any]]) -> List[bool]:
+    """
+    Пакетно добавляет посты. Каждый пост — словарь с ключами аргументов upsert_post.
+    Существование проверяется одним get_all на пакет, новые документы пишутся
+    одним WriteBatch на пакет (до BATCH_LIMIT документов).
+    Возвращает список того же размера: True — пост добавлен, False — пропущен.
+    """
+    db = get_db()
+    results = [False] * len(posts)
+    candidates = []
+    seen_ids = set()
+    for i, post in enumerate(posts):
+        if not is_valid_post(post):
+            continue
+        doc_id = post_doc_id(post['channel_id'], post['msg_id'])
+        # Дубликаты внутри одного вызова добавляем один раз
+        if doc_id in seen_ids:
+            continue
+        seen_ids.add(doc_id)
+        candidates.append((i, doc_id, post))
+    
+    messages_ref = db.collection('messages')
+    for start in range(0, len(candidates), BATCH_LIMIT):
+        chunk = candidates[start:start + BATCH_LIMIT]
+        refs = [messages_ref.document(doc_id) for _, doc_id, _ in chunk]
+        # Читаем только одно поле — нам нужен лишь факт существования документа
+        existing = {snap.id for snap in db.get_all(refs, field_paths=['msg_id']) if snap.exists}
+        
+        batch = db.batch()
+        added = []
+        for (i, doc_id, post), doc_ref in zip(chunk, refs):
+            if doc_id in existing:
+                continue
+            batch.set(doc_ref, {
+                'msg_id': post['msg_id'],
+                'channel': post['channel_id'],
+                'date': post['date'],
+                'text_html': post.get('text_html'),
+                'plain_text': post['plain_text'],
+                'summary': post.get('summary'),
+                'entities': post.get('entities') or [],
+                'updated_at': firestore.SERVER_TIMESTAMP
+            }, merge=True)
+            added.append(i)
+        if not added:
+            continue
+        try:
+            batch.commit()
+        except Exception as e:
+            log.error(f"Ошибка при сохранении пакета из {len(added)} постов: {str(e)}")
+            raise
+        for i in added:
+            results[i] = True
+    return results
+
+def update_posts(posts: List[Dict[str, Any]]) -> List[bool]:
+    """
+    Сохраняет отредактированные посты (ключи как в upsert_posts), создавая отсутствующие.
+    Если текст изменился, summary сбрасывается — пост заново попадет в summarizer.
+    Возвращает список того же размера: True — текст изменился (или пост новый).
+    """
+    db = get_db()
+    results = [False] * len(posts)
+    candidates = {}
+    for i, post in enumerate(posts):
+        if is_valid_post(post):
+            # Из нескольких правок одного поста берем последнюю
+            candidates[post_doc_id(post['channel_id'], post['msg_id'])] = (i, post)
+    
+    messages_ref = db.collection('messages')
+    items = list(candidates.items())
+    for start in range(0, len(items), BATCH_LIMIT):
+        chunk = items[start:start + BATCH_LIMIT]
+        refs = [messages_ref.document(doc_id) for doc_id, _ in chunk]
+        stored = {
+            snap.id: (snap.to_dict() or {}).get('plain_text')
+            for snap in db.get_all(refs, field_paths=['plain_text']) if snap.exists
+        }
+        batch = db.batch()
+        for (doc_id, (i, post)), doc_ref in zip(chunk, refs):
+            data = {
+                'msg_id': post['msg_id'],
+                'channel': post['channel_id'],
+                'date': post['date'],
+                'text_html': post.get('text_html'),
+                'plain_text': post['plain_text'],
+                'entities': post.get('entities') or [],
+                'updated_at': firestore.SERVER_TIMESTAMP
+            }
+            changed = doc_id not in stored or stored[doc_id] != post['plain_text']
+            if changed:
+                data['summary'] = None
+            batch.set(doc_ref, data, merge=True)
+            results[i] = changed
+        batch.commit()
+    return results
 
 def get_posts(
     channel_id: str,
@@ -72,6 +171,7 @@ def get_posts(
     limit: int = 10
 ) -> List[Dict[str, Any]]:
     """Получает посты из канала за указанный период."""
+    db = get_db()
     query = db.collection('messages').where('channel', '==', channel_id)
     
     if start_date:
@@ -84,8 +184,87 @@ def get_posts(
     
     return [doc.to_dict() for doc in query.stream()]
 
+def iter_digest_posts(
+    channel_id: str,
+    date_from: datetime,
+    date_to: datetime,
+    page_size: int = 300
+) -> Iterator[Dict[str, Any]]:
+    """
+    Итерирует посты канала с date_from <= date < date_to, у которых summary уже заполнено,
+    от старых к новым. Фильтрация выполняется на сервере, чтение — страницами по курсору.
+    Требует составной индекс messages(channel ASC, date ASC, summary ASC),
+    см. firestore.indexes.json.
+    """
+    db = get_db()
+    query = (
+        db.collection('messages')
+        .where(filter=FieldFilter('channel', '==', channel_id))
+        .where(filter=FieldFilter('date', '>=', date_from))
+        .where(filter=FieldFilter('date', '<', date_to))
+        .where(filter=FieldFilter('summary', '!=', None))
+        .order_by('date')
+    )
+    last_doc = None
+    while True:
+        page_query = query.limit(page_size)
+        if last_doc is not None:
+            page_query = page_query.start_after(last_doc)
+        docs = list(page_query.stream())
+        for doc in docs:
+            data = doc.to_dict() or {}
+            data['id'] = doc.id
+            yield data
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+def get_posts_without_summary(limit: int = 50) -> List[Dict[str, Any]]:
+    """Возвращает посты без summary; id документа кладется в поле 'id'."""
+    db = get_db()
+    query = db.collection('messages').where(filter=FieldFilter('summary', '==', None)).limit(limit)
+    posts = []
+    for doc in query.stream():
+        data = doc.to_dict() or {}
+        data['id'] = doc.id
+        posts.append(data)
+    return posts
+
+def get_posts_by_ids(doc_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Читает посты по id документов пакетами get_all: {id: пост}, отсутствующие пропускаются.
+    fields — читать только эти поля (например, ['summary']).
+    """
+    db = get_db()
+    messages_ref = db.collection('messages')
+    posts = {}
+    for start in range(0, len(doc_ids), BATCH_LIMIT):
+        refs = [messages_ref.document(doc_id) for doc_id in doc_ids[start:start + BATCH_LIMIT]]
+        for snap in db.get_all(refs, field_paths=fields):
+            if snap.exists:
+                data = snap.to_dict() or {}
+                data['id'] = snap.id
+                posts[snap.id] = data
+    return posts
+
+def save_summaries(summaries: Dict[str, str]) -> None:
+    """Сохраняет summary пакетами: {id документа: summary}."""
+    db = get_db()
+    messages_ref = db.collection('messages')
+    items = list(summaries.items())
+    for start in range(0, len(items), BATCH_LIMIT):
+        batch = db.batch()
+        for doc_id, summary in items[start:start + BATCH_LIMIT]:
+            # updated_at меняется вместе с summary — по нему инвалидируется кэш фрагментов
+            batch.update(messages_ref.document(doc_id), {
+                'summary': summary,
+                'updated_at': firestore.SERVER_TIMESTAMP
+            })
+        batch.commit()
+
 def start_run(period_days: int) -> str:
     """Начинает новый run, возвращает его ID."""
+    db = get_db()
     run_ref = db.collection('runs').document()
     
     run_data = {
@@ -97,17 +276,157 @@ def start_run(period_days: int) -> str:
     run_ref.set(run_data)
     return run_ref.id
 
-def end_run(run_id: str) -> None:
-    """Завершает run, устанавливая ended_at."""
+def end_run(run_id: str, metrics: Optional[Dict[str, Any]] = None) -> None:
+    """Завершает run, устанавливая ended_at; metrics — JSON-сводка метрик запуска."""
+    db = get_db()
     run_ref = db.collection('runs').document(run_id)
     
-    run_ref.update({
+    data = {
         'ended_at': firestore.SERVER_TIMESTAMP,
         'status': 'completed'
-    })
+    }
+    if metrics is not None:
+        data['metrics'] = metrics
+    run_ref.update(data)
+
+def get_channel_state(channel_id: str) -> Dict[str, Any]:
+    """
+    Возвращает состояние канала или пустой словарь: отметку загрузки
+    (last_seen_msg_id, covered_from) и кэш метаданных (peer_id, access_hash, title, username, resolved_at).
+    """
+    db = get_db()
+    doc = db.collection('channel_state').document(channel_id).get()
+    if doc.exists:
+        return doc.to_dict() or {}
+    return {}
+
+def update_channel_state(channel_id: str, last_seen_msg_id: int, covered_from: datetime) -> None:
+    """
+    Сохраняет отметку последнего загруженного сообщения канала.
+    covered_from — дата, начиная с которой история канала загружена без пропусков.
+    """
+    db = get_db()
+    db.collection('channel_state').document(channel_id).set({
+        'last_seen_msg_id': last_seen_msg_id,
+        'covered_from': covered_from,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+def update_channel_meta(channel_id: str, peer_id: int, access_hash: int, title: str, username: Optional[str]) -> None:
+    """Кэширует разрешенный канал, чтобы не вызывать get_entity при каждой загрузке."""
+    db = get_db()
+    db.collection('channel_state').document(channel_id).set({
+        'peer_id': peer_id,
+        'access_hash': access_hash,
+        'title': title,
+        'username': username,
+        'resolved_at': firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+def get_links(urls: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Возвращает сохраненные ссылки по нормализованным URL: {url: запись}."""
+    db = get_db()
+    links_ref = db.collection('links')
+    links = {}
+    for start in range(0, len(urls), BATCH_LIMIT):
+        refs = [links_ref.document(link_doc_id(url)) for url in urls[start:start + BATCH_LIMIT]]
+        for snap in db.get_all(refs):
+            if snap.exists:
+                data = snap.to_dict() or {}
+                links[data['url']] = data
+    return links
+
+def save_links(links: List[Dict[str, Any]]) -> None:
+    """Сохраняет записи ссылок целиком (ключ — нормализованный URL в поле url)."""
+    db = get_db()
+    links_ref = db.collection('links')
+    for start in range(0, len(links), BATCH_LIMIT):
+        batch = db.batch()
+        for link in links[start:start + BATCH_LIMIT]:
+            batch.set(links_ref.document(link_doc_id(link['url'])), link)
+        batch.commit()
+
+def count_posts(channel_id: Optional[str] = None, before: Optional[datetime] = None) -> int:
+    """Число постов (канала, с датой раньше before) — агрегирующим запросом count() без чтения документов."""
+    db = get_db()
+    query = db.collection('messages')
+    if channel_id is not None:
+        query = query.where(filter=FieldFilter('channel', '==', channel_id))
+    if before is not None:
+        query = query.where(filter=FieldFilter('date', '<', before))
+    return int(query.count(alias='count').get()[0][0].value)
+
+def iter_post_pages(
+    fields: List[str],
+    page_size: int = BATCH_LIMIT,
+    start_after: Optional[str] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Обходит все посты страницами в порядке id документа, читая только поля fields (проекция select).
+    Каждый пост — {'id': ..., поле: значение}; отсутствующие в документе поля не попадают в словарь.
+    start_after — id последнего обработанного поста (курсор из чекпоинта).
+    """
+    db = get_db()
+    query = db.collection('messages').select(fields or [FieldPath.document_id()]).order_by(FieldPath.document_id())
+    cursor = start_after
+    while True:
+        page_query = query.limit(page_size)
+        if cursor is not None:
+            page_query = page_query.start_after({FieldPath.document_id(): cursor})
+        page = []
+        for doc in page_query.stream():
+            data = doc.to_dict() or {}
+            data['id'] = doc.id
+            page.append(data)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        cursor = page[-1]['id']
+
+def get_post_ids_before(before: datetime, limit: int = BATCH_LIMIT) -> List[str]:
+    """id постов с датой раньше before (не больше limit) — читаются только имена документов."""
+    db = get_db()
+    query = (
+        db.collection('messages')
+        .where(filter=FieldFilter('date', '<', before))
+        .select([FieldPath.document_id()])
+        .limit(limit)
+    )
+    return [doc.id for doc in query.stream()]
+
+def _bulk_writer():
+    """BulkWriter с ограниченным числом повторов: неудачи печатаются, а не теряются молча."""
+    writer = get_db().bulk_writer()
+
+    def on_error(failure, _writer) -> bool:
+        if failure.attempts >= BULK_WRITE_ATTEMPTS:
+            log.error(f"Запись не удалась после {failure.attempts} попыток: {failure.message}")
+            return False
+        return True
+
+    writer.on_write_error(on_error)
+    return writer
+
+def delete_posts(doc_ids: List[str]) -> None:
+    """Удаляет посты по id через BulkWriter (параллельные пакеты с повторами)."""
+    messages_ref = get_db().collection('messages')
+    writer = _bulk_writer()
+    for doc_id in doc_ids:
+        writer.delete(messages_ref.document(doc_id))
+    writer.close()
+
+def touch_posts(doc_ids: List[str]) -> None:
+    """Проставляет updated_at постам через BulkWriter (нужно кэшу фрагментов для старых документов)."""
+    messages_ref = get_db().collection('messages')
+    writer = _bulk_writer()
+    for doc_id in doc_ids:
+        writer.update(messages_ref.document(doc_id), {'updated_at': firestore.SERVER_TIMESTAMP})
+    writer.close()
 
 def get_latest_run() -> Optional[Dict[str, Any]]:
     """Получает информацию о последнем запуске."""
+    db = get_db()
     query = db.collection('runs').order_by('started_at', direction=firestore.Query.DESCENDING).limit(1)
     
     docs = list(query.stream())
@@ -115,27 +434,31 @@ def get_latest_run() -> Optional[Dict[str, Any]]:
         return docs[0].to_dict()
     return None
 
-def check_saved_posts(channel_id: str) -> None:
-    """Проверяет сохраненные посты для канала."""
-    print(f"\nПроверяем сохраненные посты для канала {channel_id}...")
-    
-    query = db.collection('messages').where('channel', '==', channel_id)
-    messages = list(query.stream())
-    
-    if not messages:
-        print(f"❌ Нет постов для канала {channel_id} в коллекции messages")
+def check_saved_posts(channel_id: str, sample: int = 10) -> None:
+    """Проверяет сохраненные посты канала: число постов (count()) и последние sample постов."""
+    db = get_db()
+    log.info(f"Проверяем сохраненные посты для канала {channel_id}...")
+
+    total = count_posts(channel_id)
+    if not total:
+        log.warning(f"❌ Нет постов для канала {channel_id} в коллекции messages")
         return
-    
-    print(f"✅ Найдено {len(messages)} постов")
-    for msg in messages:
-        data = msg.to_dict()
-        if not data:
-            continue
-        if 'msg_id' not in data or data['msg_id'] is None or 'plain_text' not in data:
-            print(f"[WARNING] Некорректный пост в базе: id={msg.id}, data={data}")
+
+    log.info(f"✅ Найдено {total} постов, последние {min(sample, total)}:")
+    query = (
+        db.collection('messages')
+        .where(filter=FieldFilter('channel', '==', channel_id))
+        .select(['msg_id', 'date', 'plain_text'])
+        .order_by('date', direction=firestore.Query.DESCENDING)
+        .limit(sample)
+    )
+    for msg in query.stream():
+        data = msg.to_dict() or {}
+        if data.get('msg_id') is None or 'plain_text' not in data:
+            log.warning(f"Некорректный пост в базе: id={msg.id}, data={data}")
             continue
         plain = data.get('plain_text')
         if not isinstance(plain, str):
-            print(f"[WARNING] Некорректный plain_text (не строка) в посте id={msg.id}: {plain}")
+            log.warning(f"Некорректный plain_text (не строка) в посте id={msg.id}: {plain}")
             plain = ""
-        print(f"- Пост {data['msg_id']} от {data['date']}: {plain[:50]}...") 
\ No newline at end of file
+        log.info(f"- Пост {data['msg_id']} от {data['date']}: {plain[:50]}...")
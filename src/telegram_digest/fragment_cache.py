@@ -0,0 +1,72 @@
+import os
+import time
+import hashlib
+import tempfile
+from typing import Optional
+
+DEFAULT_CACHE_DIR = "./storage/fragments"
+# Фрагменты, к которым не обращались дольше этого срока, удаляются
+DEFAULT_MAX_AGE_DAYS = 30
+
+class FragmentCache:
+    """
+    Дисковый кэш отрисованных HTML-фрагментов постов.
+    Ключ — (id поста, updated_at, хэш шаблона): изменение поста или шаблона
+    дает новый ключ, поэтому инвалидировать вручную ничего не нужно.
+    """
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, template_hash: str = ""):
+        self.directory = directory
+        self.template_hash = template_hash
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, post: dict) -> Optional[str]:
+        """Ключ фрагмента или None, если у поста нет id или updated_at (такой пост не кэшируем)."""
+        if not post.get('id') or not post.get('updated_at'):
+            return None
+        payload = f"{post['id']}\0{post['updated_at']}\0{self.template_hash}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        # Раскладываем по подкаталогам, чтобы не держать сотни тысяч файлов в одном
+        return os.path.join(self.directory, key[:2], f"{key}.html")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                html = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Обновляем mtime — по нему prune понимает, что фрагмент еще нужен
+        os.utime(path)
+        return html
+
+    def put(self, key: str, html: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Пишем во временный файл и переименовываем: прерванная запись не оставит битый фрагмент
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(tmp_path, path)
+
+    def prune(self, max_age_days: int = DEFAULT_MAX_AGE_DAYS) -> int:
+        """Удаляет фрагменты, не использованные max_age_days дней. Возвращает число удаленных."""
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def stats_line(self) -> str:
+        total = self.hits + self.misses
+        skipped = 100 * self.hits / total if total else 0
+        return f"Кэш фрагментов: из кэша {self.hits}, отрисовано {self.misses} (пропущено {skipped:.0f}% рендеринга постов)"
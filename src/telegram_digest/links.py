@@ -0,0 +1,243 @@
+"""
+Обогащение ссылок из постов (F-04).
+
+Уникальные URL собираются по всем постам запуска (collect_urls) и нормализуются,
+так что ссылка из десяти каналов загружается и суммаризируется один раз.
+Загрузка идет через один пул соединений httpx.AsyncClient с общим лимитом
+параллельности, лимитом на домен и таймаутами. Из HTML извлекаются заголовок
+и читаемый текст; записи хранятся в хранилище links по нормализованному URL.
+Повторная проверка не чаще LINK_TTL и условным запросом (ETag / Last-Modified):
+ответ 304 не перекачивает страницу и не сбрасывает саммари. После ошибки
+(429, 5xx, таймаут) ссылка перепроверяется уже через LINK_ERROR_TTL.
+"""
+import re
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import httpx
+from bs4 import BeautifulSoup
+from telegram_digest.metrics import get_logger, inc, span
+from telegram_digest.normalization import utf16_slice
+from telegram_digest.storage import get_links, save_links
+
+log = get_logger(__name__)
+
+DEFAULT_CONCURRENCY = 20
+# Больше параллельных запросов к одному сайту — риск бана и 429
+PER_DOMAIN_LIMIT = 2
+TIMEOUT_SECONDS = 10
+# Ссылку не перепроверяем чаще, чем раз в LINK_TTL
+LINK_TTL = timedelta(hours=24)
+# После ошибки загрузки (часто временной) повторяем раньше
+LINK_ERROR_TTL = timedelta(minutes=15)
+# Сколько читаем из ответа и сколько текста храним
+MAX_BODY_BYTES = 2 * 2**20
+MAX_TEXT_CHARS = 20_000
+# Сколько текста страницы отправляем в саммари
+SUMMARY_TEXT_CHARS = 4_000
+WRITE_BATCH_SIZE = 50
+USER_AGENT = "Mozilla/5.0 (compatible; telegram-digest)"
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+
+# Параметры, которые не меняют страницу, а только помечают источник перехода
+TRACKING_PARAMS = {"fbclid", "gclid", "yclid", "igshid", "mc_cid", "mc_eid"}
+# Эти теги не содержат читаемого текста страницы
+NOISE_TAGS = ["script", "style", "noscript", "template", "svg", "nav", "header", "footer", "aside", "form"]
+
+def normalize_url(url: str) -> Optional[str]:
+    """
+    Приводит URL к каноническому виду: схема и хост в нижнем регистре, без порта
+    по умолчанию, фрагмента и меток (utm_* и т.п.). Не-HTTP ссылки — None.
+    """
+    url = url.strip()
+    # Схема без "//" (mailto:, tg:) — не веб-ссылка; "host:8080" — порт, а не схема
+    if not re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*:(?!\d)", url):
+        url = "http://" + url
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if scheme not in ("http", "https") or not host:
+        return None
+    netloc = host if port is None or (scheme, port) in (("http", 80), ("https", 443)) else f"{host}:{port}"
+    query = urlencode([
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    ])
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+def extract_urls(post: Dict[str, Any]) -> List[str]:
+    """URL из entities поста: адреса ссылок-текста и голые ссылки из текста."""
+    urls = []
+    text = post.get('plain_text') or ""
+    for entity in post.get('entities') or ():
+        if entity.get('type') == 'MessageEntityTextUrl' and entity.get('url'):
+            urls.append(entity['url'])
+        elif entity.get('type') == 'MessageEntityUrl':
+            urls.append(utf16_slice(text, entity['offset'], entity['length']))
+    return urls
+
+def collect_urls(posts: Iterable[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Уникальные нормализованные URL по всем постам: {url: [id постов]}."""
+    urls: Dict[str, List[str]] = {}
+    for post in posts:
+        for raw_url in extract_urls(post):
+            url = normalize_url(raw_url)
+            if url is not None:
+                urls.setdefault(url, []).append(post.get('id'))
+    return urls
+
+def extract_text(body: bytes, encoding: Optional[str] = None) -> Tuple[Optional[str], str]:
+    """Заголовок и читаемый текст HTML-страницы (article/main, иначе body без служебных блоков)."""
+    soup = BeautifulSoup(body, "html.parser", from_encoding=encoding)
+    title = soup.title.get_text(" ", strip=True) if soup.title else None
+    for tag in soup(NOISE_TAGS):
+        tag.decompose()
+    root = soup.find("article") or soup.find("main") or soup.body or soup
+    lines = (line.strip() for line in root.get_text("\n").splitlines())
+    text = "\n".join(line for line in lines if line)
+    return title or None, text[:MAX_TEXT_CHARS]
+
+def _is_fresh(record: Dict[str, Any], now: datetime, ttl: timedelta, error_ttl: timedelta) -> bool:
+    """Проверялась ли ссылка недавно: для ошибочных записей срок короче."""
+    fetched_at = record.get('fetched_at')
+    if fetched_at is None:
+        return False
+    return now - fetched_at < (min(ttl, error_ttl) if record.get('error') else ttl)
+
+async def _fetch_link(client: httpx.AsyncClient, url: str, existing: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], str]:
+    """
+    Загружает одну ссылку, при наличии сохраненной версии — условным запросом.
+    Возвращает (запись, исход): fetched, not_modified или error.
+    """
+    now = datetime.now(timezone.utc)
+    record = dict(existing or {}, url=url, fetched_at=now, error=None)
+    headers = {}
+    if existing and existing.get('etag'):
+        headers['If-None-Match'] = existing['etag']
+    if existing and existing.get('last_modified'):
+        headers['If-Modified-Since'] = existing['last_modified']
+    try:
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and existing:
+                return record, "not_modified"
+            record['status'] = response.status_code
+            if response.status_code != 200:
+                # 429, 5xx и т. п. часто временные: сохраненные текст, саммари
+                # и валидаторы остаются, записываем только статус и ошибку
+                record['error'] = f"HTTP {response.status_code}"
+                return record, "error"
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            record.update(
+                final_url=str(response.url),
+                content_type=content_type or None,
+                etag=response.headers.get("etag"),
+                last_modified=response.headers.get("last-modified"),
+            )
+            body = bytearray()
+            if content_type in HTML_TYPES:
+                async for chunk in response.aiter_bytes():
+                    body += chunk
+                    if len(body) >= MAX_BODY_BYTES:
+                        break
+            encoding = response.charset_encoding
+    except httpx.HTTPError as e:
+        record.update(status=None, error=f"{type(e).__name__}: {e}")
+        return record, "error"
+    title, text = (None, None)
+    if body:
+        # Разбор HTML — CPU-работа, не держим на ней event loop
+        title, text = await asyncio.to_thread(extract_text, bytes(body), encoding)
+    if not existing or existing.get('text') != text:
+        # Страница изменилась — старое саммари больше не подходит
+        record['summary'] = None
+    record.update(title=title, text=text)
+    return record, "fetched"
+
+async def enrich_links(
+    urls: Iterable[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    per_domain: int = PER_DOMAIN_LIMIT,
+    timeout: float = TIMEOUT_SECONDS,
+    ttl: timedelta = LINK_TTL,
+    error_ttl: timedelta = LINK_ERROR_TTL,
+    summarize: bool = False,
+    client: Optional[httpx.AsyncClient] = None,
+    summary_client=None,
+) -> Dict[str, int]:
+    """
+    Загружает и сохраняет ссылки (нормализованные URL, см. collect_urls).
+    Ссылки, проверенные позже ttl назад, не запрашиваются вовсе; ссылки,
+    последняя загрузка которых завершилась ошибкой, — позже error_ttl назад.
+    summarize=True — для страниц без саммари делается саммари (summarize_texts).
+    Возвращает счетчики: urls, cached, fetched, not_modified, errors, summarized.
+    """
+    urls = list(dict.fromkeys(urls))
+    stored = await asyncio.to_thread(get_links, urls)
+    now = datetime.now(timezone.utc)
+    due = [url for url in urls if url not in stored or not _is_fresh(stored[url], now, ttl, error_ttl)]
+    stats = {'urls': len(urls), 'cached': len(urls) - len(due), 'fetched': 0, 'not_modified': 0, 'errors': 0, 'summarized': 0}
+
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(
+            timeout=timeout, follow_redirects=True, headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        )
+    # Сначала ждем слот домена, потом общий: запросы к занятому домену не держат общие слоты
+    domain_limits: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(max(1, per_domain)))
+    global_limit = asyncio.Semaphore(max(1, concurrency))
+    records: List[Dict[str, Any]] = []
+    pending: List[Dict[str, Any]] = []
+
+    async def process(url: str) -> None:
+        async with domain_limits[urlsplit(url).netloc]:
+            async with global_limit:
+                with span("link_fetch"):
+                    record, outcome = await _fetch_link(client, url, stored.get(url))
+        stats[{'fetched': 'fetched', 'not_modified': 'not_modified', 'error': 'errors'}[outcome]] += 1
+        records.append(record)
+        pending.append(record)
+        if len(pending) >= WRITE_BATCH_SIZE:
+            batch = list(pending)
+            pending.clear()
+            await asyncio.to_thread(save_links, batch)
+
+    try:
+        await asyncio.gather(*(process(url) for url in due))
+    finally:
+        if own_client:
+            await client.aclose()
+    if pending:
+        await asyncio.to_thread(save_links, list(pending))
+
+    if summarize:
+        from telegram_digest.summarizer import summarize_texts
+
+        by_url = {record['url']: record for record in records}
+        # Саммари нужны и ранее сохраненным ссылкам, для которых их еще нет
+        for url in urls:
+            if url not in by_url and url in stored:
+                by_url[url] = stored[url]
+        items = [(url, record['text'][:SUMMARY_TEXT_CHARS]) for url, record in by_url.items()
+                 if record.get('text') and record.get('summary') is None]
+        if items:
+            summaries = await summarize_texts(items, client=summary_client)
+            for url, summary in summaries.items():
+                by_url[url]['summary'] = summary
+            await asyncio.to_thread(save_links, [by_url[url] for url in summaries])
+            stats['summarized'] = len(summaries)
+
+    inc("cache_hits", stats['cached'], cache="links")
+    inc("link_requests", len(due))
+    inc("link_errors", stats['errors'])
+    log.info(
+        f"Ссылки: всего {stats['urls']}, из кэша {stats['cached']}, загружено {stats['fetched']}, "
+        f"не изменились {stats['not_modified']}, ошибок {stats['errors']}, саммари {stats['summarized']}"
+    )
+    return stats
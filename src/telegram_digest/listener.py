@@ -0,0 +1,181 @@
+"""
+Push-загрузка постов (команда `listen`) через события Telethon вместо опроса истории.
+
+Новые и отредактированные сообщения каналов из channels.yaml приходят как
+events.NewMessage / events.MessageEdited, сериализуются тем же message_to_post,
+что и при загрузке истории, и пишутся в хранилище пакетами (PostBuffer):
+по достижении max_size постов или через max_delay секунд.
+
+Пропуски закрывает догоняющий проход fetch_posts: при запуске, после
+переподключения к Telegram и (подстраховкой) раз в catchup_minutes минут.
+Он дешевый — читаются только сообщения новее отметки прошлого прохода.
+Отметку last_seen_msg_id двигает только загрузка истории: пост, пришедший
+событием сразу после незамеченного разрыва, не должен скрыть пропуск перед ним.
+"""
+import time
+import asyncio
+from typing import Dict, List, Optional
+from telethon import TelegramClient, events, utils
+from telethon.tl.types import Channel
+from telegram_digest.fetcher import fetch_posts, message_to_post
+from telegram_digest.metrics import get_logger
+from telegram_digest.storage import upsert_posts, update_posts
+
+log = get_logger(__name__)
+
+# Сколько постов копим перед записью и сколько секунд готовы ждать
+BUFFER_MAX_SIZE = 50
+BUFFER_MAX_DELAY = 2.0
+# Как часто проверяем соединение с Telegram
+WATCHDOG_SECONDS = 10
+
+class PostBuffer:
+    """Микро-батчинг записи: новые посты — upsert_posts, правки — update_posts."""
+
+    def __init__(self, max_size: int = BUFFER_MAX_SIZE, max_delay: float = BUFFER_MAX_DELAY):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.new_posts: List[Dict] = []
+        self.edited_posts: List[Dict] = []
+        self.first_added: Optional[float] = None
+        self.added = 0
+        self.updated = 0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.new_posts) + len(self.edited_posts)
+
+    async def add(self, post: Dict, edited: bool = False) -> None:
+        (self.edited_posts if edited else self.new_posts).append(post)
+        if self.first_added is None:
+            self.first_added = time.monotonic()
+        if len(self) >= self.max_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает буфер; если запись не прошла, посты остаются в буфере до следующего flush."""
+        async with self._lock:
+            new_posts, self.new_posts = self.new_posts, []
+            edited_posts, self.edited_posts = self.edited_posts, []
+            first_added, self.first_added = self.first_added, None
+            new_written = False
+            try:
+                if new_posts:
+                    self.added += sum(await asyncio.to_thread(upsert_posts, new_posts))
+                new_written = True
+                if edited_posts:
+                    self.updated += sum(await asyncio.to_thread(update_posts, edited_posts))
+            except Exception:
+                # Возвращаем незаписанное перед постами, пришедшими во время записи
+                if not new_written:
+                    self.new_posts = new_posts + self.new_posts
+                self.edited_posts = edited_posts + self.edited_posts
+                if first_added is not None:
+                    self.first_added = first_added
+                raise
+            if new_posts or edited_posts:
+                log.info(f"Записано: новых {len(new_posts)}, правок {len(edited_posts)}")
+
+    async def run(self) -> None:
+        """Сбрасывает буфер, как только самый старый пост ждет дольше max_delay."""
+        while True:
+            await asyncio.sleep(self.max_delay / 4)
+            if self.first_added is not None and time.monotonic() - self.first_added >= self.max_delay:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    log.error(f"Ошибка записи буфера: {e}")
+
+async def listen(
+    client: TelegramClient,
+    channel_ids: List[str],
+    days: int = 1,
+    max_size: int = BUFFER_MAX_SIZE,
+    max_delay: float = BUFFER_MAX_DELAY,
+    catchup_minutes: float = 60,
+    concurrency: int = 5
+) -> None:
+    """
+    Подписывается на новые и отредактированные сообщения каналов и пишет их в хранилище.
+    days — глубина догоняющего прохода, если канал еще не загружался.
+    catchup_minutes — период страховочного догоняющего прохода (0 — только при переподключении).
+    Работает до отмены (Ctrl+C); буфер при остановке сбрасывается.
+    """
+    await client.connect()
+
+    # Сопоставление id из событий с id каналов из конфига
+    peers: Dict[int, str] = {}
+    entities = []
+    for channel_id in channel_ids:
+        try:
+            entity = await client.get_entity(channel_id)
+        except Exception as e:
+            log.warning(f"Пропускаем {channel_id}: {e}")
+            continue
+        if not isinstance(entity, Channel):
+            log.warning(f"Пропускаем {channel_id}: не является каналом")
+            continue
+        peers[utils.get_peer_id(entity)] = channel_id
+        entities.append(entity)
+    if not entities:
+        log.warning("Нет доступных каналов для подписки")
+        await client.disconnect()
+        return
+
+    buffer = PostBuffer(max_size, max_delay)
+
+    async def on_message(event, edited: bool) -> None:
+        channel_id = peers.get(event.chat_id)
+        if channel_id is None:
+            return
+        await buffer.add(message_to_post(event.message, channel_id), edited)
+
+    async def on_new(event) -> None:
+        await on_message(event, edited=False)
+
+    async def on_edit(event) -> None:
+        await on_message(event, edited=True)
+
+    client.add_event_handler(on_new, events.NewMessage(chats=entities))
+    client.add_event_handler(on_edit, events.MessageEdited(chats=entities))
+    log.info(f"Слушаем {len(entities)} каналов")
+
+    async def catch_up() -> None:
+        await buffer.flush()
+        await fetch_posts(client, list(peers.values()), days, concurrency=concurrency)
+
+    async def watchdog() -> None:
+        last_catchup = time.monotonic()
+        # Проход после переподключения обязателен: если он упал, повторяем на следующих тиках
+        catchup_pending = False
+        while True:
+            await asyncio.sleep(WATCHDOG_SECONDS)
+            if not client.is_connected():
+                log.warning("Соединение с Telegram потеряно, переподключаемся")
+                try:
+                    await client.connect()
+                except Exception as e:
+                    log.error(f"Не удалось переподключиться: {e}")
+                    continue
+                catchup_pending = True
+            if catchup_pending or (catchup_minutes and time.monotonic() - last_catchup >= catchup_minutes * 60):
+                try:
+                    await catch_up()
+                except Exception as e:
+                    log.error(f"Догоняющий проход не удался, повторим: {e}")
+                    catchup_pending = True
+                    continue
+                catchup_pending = False
+                last_catchup = time.monotonic()
+
+    try:
+        # Первый догоняющий проход — уже после подписки, чтобы между ними ничего не потерять:
+        # все, что вышло, пока мы не слушали
+        await catch_up()
+        await asyncio.gather(buffer.run(), watchdog())
+    finally:
+        client.remove_event_handler(on_new)
+        client.remove_event_handler(on_edit)
+        await buffer.flush()
+        log.info(f"Итого: добавлено {buffer.added}, изменено {buffer.updated}")
+        await client.disconnect()
@@ -0,0 +1,137 @@
+"""
+Обслуживание хранилища (команда `maintain`).
+
+Задания не читают документы целиком и не удаляют их по одному:
+  clean    — удаляет пустые и слишком короткие посты; обход страницами
+             по курсору с проекцией только plain_text;
+  backfill — проставляет updated_at старым постам без него (без updated_at
+             пост не попадает в кэш фрагментов); проекция только updated_at;
+  prune    — политика хранения: удаляет посты старше retention_days;
+             отбор на стороне сервера, читаются только id.
+Удаления и обновления идут пакетами (в Firestore — BulkWriter), отчеты —
+агрегирующим count(). Обходы clean и backfill сохраняют курсор в чекпоинт
+после каждой страницы: прерванное задание продолжается с места остановки.
+prune чекпоинт не нужен — каждый проход заново выбирает еще не удаленное.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+from telegram_digest.checkpoint import Checkpoint
+from telegram_digest.metrics import get_logger
+from telegram_digest.storage import (
+    count_posts, delete_posts, get_post_ids_before, iter_post_pages, touch_posts
+)
+
+log = get_logger(__name__)
+
+JOBS = ("clean", "backfill", "prune")
+# Минимум слов в посте — как в is_valid_post
+MIN_WORDS = 5
+PAGE_SIZE = 500
+
+def is_short_text(plain_text: Any, min_words: int = MIN_WORDS) -> bool:
+    """Текст пустой, не строка или короче min_words слов."""
+    return not isinstance(plain_text, str) or len(plain_text.split()) < min_words
+
+def _scan_posts(
+    job: str,
+    fields: List[str],
+    select: Callable[[Dict[str, Any]], bool],
+    action: Callable[[List[str]], None],
+    page_size: int,
+    dry_run: bool
+) -> Dict[str, int]:
+    """
+    Обходит все посты страницами, применяя action к id отобранных select.
+    Курсор и счетчики сохраняются после каждой страницы (в dry_run — нет).
+    """
+    checkpoint = Checkpoint(f"maintain_{job}")
+    state = {} if dry_run else checkpoint.load()
+    if state:
+        log.info(f"{job}: продолжаем после {state['cursor']} (просмотрено {state['scanned']})")
+    scanned, matched = state.get('scanned', 0), state.get('matched', 0)
+    for page in iter_post_pages(fields, page_size, state.get('cursor')):
+        doc_ids = [post['id'] for post in page if select(post)]
+        if doc_ids and not dry_run:
+            action(doc_ids)
+        scanned += len(page)
+        matched += len(doc_ids)
+        if not dry_run:
+            # Сохраняем после записи: при сбое страница повторится, а действия идемпотентны
+            checkpoint.save({'cursor': page[-1]['id'], 'scanned': scanned, 'matched': matched})
+    if not dry_run:
+        checkpoint.clear()
+    return {'scanned': scanned, 'matched': matched}
+
+def clean_short_posts(min_words: int = MIN_WORDS, page_size: int = PAGE_SIZE, dry_run: bool = False) -> Dict[str, int]:
+    """Удаляет посты с пустым или коротким (меньше min_words слов) текстом."""
+    stats = _scan_posts(
+        "clean", ['plain_text'], lambda post: is_short_text(post.get('plain_text'), min_words),
+        delete_posts, page_size, dry_run
+    )
+    log.info(f"clean: просмотрено {stats['scanned']}, {'к удалению' if dry_run else 'удалено'} {stats['matched']}")
+    return stats
+
+def backfill_updated_at(page_size: int = PAGE_SIZE, dry_run: bool = False) -> Dict[str, int]:
+    """Проставляет updated_at постам, у которых его нет."""
+    stats = _scan_posts(
+        "backfill", ['updated_at'], lambda post: not post.get('updated_at'),
+        touch_posts, page_size, dry_run
+    )
+    log.info(f"backfill: просмотрено {stats['scanned']}, {'без updated_at' if dry_run else 'обновлено'} {stats['matched']}")
+    return stats
+
+def prune_old_posts(retention_days: int, page_size: int = PAGE_SIZE, dry_run: bool = False) -> Dict[str, int]:
+    """Удаляет посты с датой старше retention_days дней."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    matched = count_posts(before=cutoff)
+    deleted = 0
+    attempted = set()
+    while not dry_run and deleted < matched:
+        doc_ids = get_post_ids_before(cutoff, page_size)
+        if not doc_ids:
+            break
+        if attempted.intersection(doc_ids):
+            # Удаление не прошло (ошибки записи уже напечатаны) — не крутимся на тех же id
+            log.error("prune: часть постов не удалось удалить, остановлено")
+            break
+        attempted.update(doc_ids)
+        delete_posts(doc_ids)
+        deleted += len(doc_ids)
+        log.info(f"prune: удалено {deleted}/{matched}")
+    log.info(f"prune: постов старше {cutoff:%Y-%m-%d} — {matched}, удалено {deleted}")
+    return {'matched': matched, 'deleted': deleted}
+
+def run_maintenance(
+    jobs: List[str],
+    retention_days: Optional[int] = None,
+    min_words: int = MIN_WORDS,
+    page_size: int = PAGE_SIZE,
+    dry_run: bool = False,
+    restart: bool = False
+) -> Dict[str, Dict[str, int]]:
+    """
+    Выполняет задания jobs по порядку и возвращает их счетчики.
+    prune выполняется, только если задан retention_days.
+    restart — сбросить чекпоинты и начать обходы сначала.
+    """
+    unknown = set(jobs) - set(JOBS)
+    if unknown:
+        raise ValueError(f"Unknown maintenance jobs: {', '.join(sorted(unknown))}, expected: {', '.join(JOBS)}")
+    if restart:
+        for job in JOBS:
+            Checkpoint(f"maintain_{job}").clear()
+    before = count_posts()
+    log.info(f"Постов в хранилище: {before}{' (пробный запуск)' if dry_run else ''}")
+    results = {}
+    for job in jobs:
+        if job == "clean":
+            results[job] = clean_short_posts(min_words, page_size, dry_run)
+        elif job == "backfill":
+            results[job] = backfill_updated_at(page_size, dry_run)
+        elif retention_days is not None:
+            results[job] = prune_old_posts(retention_days, page_size, dry_run)
+        else:
+            log.info("prune: не задан срок хранения, пропускаем")
+    if not dry_run:
+        log.info(f"Постов в хранилище: {count_posts()} (было {before})")
+    return results
@@ -0,0 +1,173 @@
+"""
+Инструментирование конвейера: логгер, счетчики и тайминги этапов.
+
+  get_logger(__name__) — логгер модуля вместо print; уровень задается
+      LOG_LEVEL (или --log-level), по умолчанию INFO;
+  inc("db_reads", 10, op="get_posts_by_ids") — счетчик с метками;
+  with span("fetch_channel", channel=...): — время этапа (число вызовов и сумма секунд).
+
+Все метрики процесса живут в одном потокобезопасном реестре `metrics`.
+Выгрузка:
+  - текстовый файл Prometheus (METRICS_TEXTFILE, для textfile-коллектора
+    node_exporter) — при завершении команды CLI и после тиков `serve`;
+  - JSON-сводка запуска (разница метрик с начала run) — в документ runs
+    через end_run, см. tracked_run.
+"""
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+PREFIX = "telegram_digest"
+
+# (имя, отсортированные метки)
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+def setup_logging(level: Optional[str] = None) -> None:
+    """Настраивает логирование пакета: уровень из аргумента или LOG_LEVEL."""
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    logging.basicConfig(format="%(asctime)s %(levelname)-7s %(message)s", datefmt="%H:%M:%S")
+    logging.getLogger(PREFIX).setLevel(level)
+
+def get_logger(name: str) -> logging.Logger:
+    """Логгер модуля пакета (имена telegram_digest.*)."""
+    return logging.getLogger(name if name.startswith(PREFIX) else f"{PREFIX}.{name}")
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+def _format_key(key: Key) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+class Metrics:
+    """Реестр счетчиков и таймингов процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Key, float] = defaultdict(float)
+        # Ключ -> [число вызовов, сумма секунд]
+        self.spans: Dict[Key, List[float]] = defaultdict(lambda: [0, 0.0])
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        if not value:
+            return
+        with self._lock:
+            self.counters[_key(name, labels)] += value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        with self._lock:
+            span = self.spans[_key(name, labels)]
+            span[0] += 1
+            span[1] += seconds
+
+    @contextmanager
+    def span(self, name: str, **labels: Any) -> Iterator[None]:
+        """Засекает время блока (в том числе с await внутри — это время по часам)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Текущие значения в JSON-виде: {'counters': {ключ: значение}, 'spans': {ключ: {count, seconds}}}."""
+        with self._lock:
+            return {
+                'counters': {_format_key(key): value for key, value in sorted(self.counters.items())},
+                'spans': {
+                    _format_key(key): {'count': count, 'seconds': round(seconds, 3)}
+                    for key, (count, seconds) in sorted(self.spans.items())
+                },
+            }
+
+    def since(self, baseline: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Разница текущих значений с baseline (snapshot()) — метрики одного запуска."""
+        current = self.snapshot()
+        counters = {
+            key: value - baseline['counters'].get(key, 0)
+            for key, value in current['counters'].items()
+            if value != baseline['counters'].get(key, 0)
+        }
+        spans = {}
+        for key, value in current['spans'].items():
+            before = baseline['spans'].get(key, {'count': 0, 'seconds': 0.0})
+            if value['count'] != before['count']:
+                spans[key] = {'count': value['count'] - before['count'],
+                              'seconds': round(value['seconds'] - before['seconds'], 3)}
+        return {'counters': counters, 'spans': spans}
+
+    def prometheus_text(self) -> str:
+        """Метрики в текстовом формате Prometheus: счетчики *_total, тайминги *_seconds_count/_sum."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            spans = sorted(self.spans.items())
+        lines = []
+        for (name, labels), value in counters:
+            lines.append(f"{_format_key((f'{PREFIX}_{name}_total', labels))} {value:g}")
+        for (name, labels), (count, seconds) in spans:
+            lines.append(f"{_format_key((f'{PREFIX}_{name}_seconds_count', labels))} {count}")
+            lines.append(f"{_format_key((f'{PREFIX}_{name}_seconds_sum', labels))} {seconds:.6f}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def summary_lines(self, data: Optional[Dict[str, Dict[str, Any]]] = None) -> List[str]:
+        """Читаемая сводка: этапы по убыванию времени, затем счетчики."""
+        data = data or self.snapshot()
+        spans = sorted(data['spans'].items(), key=lambda item: -item[1]['seconds'])
+        lines = [f"{key}: {value['count']}×, {value['seconds']:.2f} с" for key, value in spans]
+        lines += [f"{key}: {value:g}" for key, value in data['counters'].items()]
+        return lines
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.spans.clear()
+
+metrics = Metrics()
+inc = metrics.inc
+span = metrics.span
+
+log = get_logger(__name__)
+
+def write_textfile(path: Optional[str] = None) -> Optional[str]:
+    """
+    Записывает метрики в файл Prometheus (по умолчанию METRICS_TEXTFILE; не задан — ничего не делает).
+    Запись атомарная: коллектор не увидит недописанный файл.
+    """
+    path = path or os.getenv("METRICS_TEXTFILE")
+    if not path:
+        return None
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(metrics.prometheus_text())
+    os.replace(tmp_path, path)
+    return path
+
+def log_summary() -> None:
+    """Пишет в лог сводку метрик процесса: где потрачено время и сколько чего израсходовано."""
+    lines = metrics.summary_lines()
+    if lines:
+        log.info("Метрики: " + "; ".join(lines))
+
+@contextmanager
+def tracked_run(period_days: int) -> Iterator[str]:
+    """
+    Запуск, учтенный в runs: start_run на входе, на выходе end_run
+    с JSON-сводкой метрик, накопленных внутри блока.
+    """
+    from telegram_digest.storage import start_run, end_run
+
+    run_id = start_run(period_days)
+    baseline = metrics.snapshot()
+    try:
+        yield run_id
+    finally:
+        end_run(run_id, metrics.since(baseline))
@@ -1,29 +1,186 @@
-import os
-from firebase_admin import firestore
-from telegram_digest.firebase_db import init_firebase
+"""
+Миграции схемы Firestore (команда `migrate`).
 
-def migrate_to_flat_messages():
-    db = init_firebase()
-    print("Project id:", db.project)
-    messages_flat = db.collection('messages')
-    messages = list(db.collection_group('messages').stream())
-    print(f"Найдено сообщений во всех messages: {len(messages)}")
-    migrated = 0
-    for msg_doc in messages:
-        data = msg_doc.to_dict()
-        # Получаем id канала из пути: posts/{channel}/messages/{msg_id}
-        path_parts = msg_doc.reference.path.split('/')
+Общий исполнитель run_migration:
+  - читает исходные документы страницами по курсору (порядок по __name__),
+    не загружая коллекцию целиком;
+  - пишет пакетами WriteBatch (до BATCH_LIMIT операций) в нескольких потоках,
+    пока читается следующая страница;
+  - после каждой записанной по порядку страницы сохраняет курсор в чекпоинт:
+    прерванная миграция продолжается с места остановки, а записи идемпотентны
+    (set по детерминированному id), поэтому повтор страницы безопасен;
+  - в режиме dry_run только читает выборку, считает документы агрегирующим
+    count() и оценивает время полной миграции по скорости чтения.
+
+Новая миграция — это Migration с источником (запрос) и преобразованием
+документа в запись, добавленная в MIGRATIONS.
+"""
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from google.cloud.firestore_v1.field_path import FieldPath
+from telegram_digest.checkpoint import Checkpoint
+from telegram_digest.firebase_db import BATCH_LIMIT, get_db
+from telegram_digest.metrics import get_logger
+
+log = get_logger(__name__)
+
+# Сколько документов читать в dry_run для оценки скорости
+DRY_RUN_SAMPLE = 2000
+
+# Преобразование: снимок документа -> (ссылка на целевой документ, данные) или None — пропустить
+Transform = Callable[[Any, Any], Optional[Tuple[Any, Dict[str, Any]]]]
+
+class Migration:
+    """Миграция: source(db) — запрос к исходным документам, transform(snapshot, db) — запись."""
+
+    def __init__(self, name: str, description: str, source: Callable[[Any], Any], transform: Transform, merge: bool = False):
+        self.name = name
+        self.description = description
+        self.source = source
+        self.transform = transform
+        # merge=True — дописывать поля в существующий документ, а не заменять его
+        self.merge = merge
+
+def _flat_message(snapshot, db) -> Optional[Tuple[Any, Dict[str, Any]]]:
+    """posts/{channel}/messages/{msg_id} -> messages/{channel}_{msg_id} с полем channel."""
+    path_parts = snapshot.reference.path.split('/')
+    # collection_group('messages') видит и саму плоскую коллекцию messages — ее не трогаем
+    if len(path_parts) < 4 or path_parts[-4] != 'posts':
+        return None
+    channel_id = path_parts[-3]
+    data = snapshot.to_dict() or {}
+    data['channel'] = channel_id
+    return db.collection('messages').document(f"{channel_id}_{data.get('msg_id', snapshot.id)}"), data
+
+MIGRATIONS: Dict[str, Migration] = {
+    migration.name: migration for migration in [
+        Migration(
+            "flat-messages",
+            "posts/{channel}/messages/* -> плоская коллекция messages",
+            lambda db: db.collection_group('messages'),
+            _flat_message,
+        ),
+    ]
+}
+
+def _iter_pages(query, page_size: int, start_after: Optional[str], db) -> Iterator[List[Any]]:
+    """Страницы снимков в порядке __name__; start_after — полный путь последнего обработанного документа."""
+    query = query.order_by(FieldPath.document_id())
+    cursor = db.document(start_after) if start_after else None
+    while True:
+        page_query = query.limit(page_size)
+        if cursor is not None:
+            page_query = page_query.start_after({FieldPath.document_id(): cursor})
+        page = list(page_query.stream())
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        cursor = page[-1].reference
+
+def _commit(db, writes: List[Tuple[Any, Dict[str, Any]]], merge: bool) -> int:
+    for start in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for doc_ref, data in writes[start:start + BATCH_LIMIT]:
+            batch.set(doc_ref, data, merge=merge)
+        batch.commit()
+    return len(writes)
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} ч {minutes} мин" if hours else f"{minutes} мин {seconds} с"
+
+def _estimate(migration: Migration, db, page_size: int, sample: int) -> Dict[str, Any]:
+    """Пробный прогон: читает sample документов, ничего не пишет, оценивает длительность."""
+    query = migration.source(db)
+    total = int(query.count(alias='count').get()[0][0].value)
+    started = time.monotonic()
+    read = writes = 0
+    for page in _iter_pages(query, min(page_size, sample), None, db):
+        read += len(page)
+        writes += sum(1 for snapshot in page if migration.transform(snapshot, db) is not None)
+        if read >= sample:
+            break
+    elapsed = max(time.monotonic() - started, 1e-6)
+    rate = read / elapsed
+    # Запись идет параллельно чтению, поэтому общая длительность ограничена скоростью чтения
+    estimate = total / rate if rate else 0
+    log.info(f"{migration.name}: документов {total}, в выборке {read} (к записи {writes}), "
+             f"чтение {rate:.0f} док/с, оценка ≈ {_format_seconds(estimate)}")
+    return {'total': total, 'sampled': read, 'to_write': writes, 'docs_per_second': round(rate, 1), 'estimated_seconds': round(estimate)}
+
+def run_migration(
+    name: str,
+    page_size: int = BATCH_LIMIT,
+    workers: int = 8,
+    dry_run: bool = False,
+    restart: bool = False,
+    sample: int = DRY_RUN_SAMPLE,
+    db=None,
+) -> Dict[str, Any]:
+    """
+    Выполняет миграцию name из MIGRATIONS и возвращает счетчики.
+    workers — сколько пакетов записи коммитить одновременно.
+    restart — игнорировать чекпоинт и начать сначала.
+    """
+    if name not in MIGRATIONS:
+        raise ValueError(f"Unknown migration {name!r}, expected one of: {', '.join(MIGRATIONS)}")
+    migration = MIGRATIONS[name]
+    db = db or get_db()
+    if dry_run:
+        return _estimate(migration, db, page_size, sample)
+
+    checkpoint = Checkpoint(f"migrate_{name}")
+    if restart:
+        checkpoint.clear()
+    state = checkpoint.load()
+    if state:
+        log.info(f"{name}: продолжаем после {state['cursor']} (прочитано {state['read']})")
+    read, written = state.get('read', 0), state.get('written', 0)
+    started = time.monotonic()
+    session_read = 0
+    # Страницы в порядке чтения: (курсор, прочитано на странице, future записи)
+    in_flight: Deque[Tuple[str, int, Future]] = deque()
+
+    def complete_oldest() -> None:
+        nonlocal read, written
+        cursor, page_read, future = in_flight[0]
+        # Упавшая страница остается в очереди: чекпоинт не должен уйти дальше нее
+        written += future.result()
+        in_flight.popleft()
+        read += page_read
+        # Курсор двигаем только по непрерывному префиксу записанных страниц
+        checkpoint.save({'cursor': cursor, 'read': read, 'written': written})
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
         try:
-            channel_id = path_parts[path_parts.index('posts') + 1]
-        except Exception:
-            channel_id = 'unknown'
-        data['channel'] = channel_id
-        doc_id = f"{channel_id}_{data.get('msg_id', msg_doc.id)}"
-        messages_flat.document(doc_id).set(data)
-        migrated += 1
-        text = data.get('plain_text') or ""
-        print(f"Мигрировано: {doc_id}, plain_text: {text[:50]}")
-    print(f"Всего мигрировано сообщений: {migrated}")
+            for page in _iter_pages(migration.source(db), page_size, state.get('cursor'), db):
+                writes = [write for write in (migration.transform(snapshot, db) for snapshot in page) if write is not None]
+                in_flight.append((page[-1].reference.path, len(page), executor.submit(_commit, db, writes, migration.merge)))
+                session_read += len(page)
+                while in_flight and in_flight[0][2].done():
+                    complete_oldest()
+                # Не читаем дальше, чем успеваем писать
+                while len(in_flight) > max(1, workers) * 2:
+                    complete_oldest()
+                rate = session_read / max(time.monotonic() - started, 1e-6)
+                log.info(f"{name}: прочитано {read + sum(item[1] for item in in_flight)}, записано {written} ({rate:.0f} док/с)")
+            while in_flight:
+                complete_oldest()
+        finally:
+            # При ошибке дожидаемся уже отправленных пакетов, чтобы чекпоинт не отстал от записанного
+            while in_flight and not in_flight[0][2].exception():
+                complete_oldest()
+    checkpoint.clear()
+    elapsed = time.monotonic() - started
+    log.info(f"{name}: готово — прочитано {read}, записано {written} за {_format_seconds(elapsed)}")
+    return {'read': read, 'written': written, 'seconds': round(elapsed, 1)}
+
+def migrate_to_flat_messages():
+    return run_migration("flat-messages")
 
 if __name__ == "__main__":
-    migrate_to_flat_messages() 
\ No newline at end of file
+    migrate_to_flat_messages()
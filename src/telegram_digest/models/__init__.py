@@ -1 +1,23 @@
- 
\ No newline at end of file
+import hashlib
+from typing import Any, Dict
+
+def post_doc_id(channel_id: str, msg_id: int) -> str:
+    """ID документа поста в хранилище: <канал>_<id сообщения>."""
+    return f"{channel_id}_{msg_id}"
+
+def link_doc_id(url: str) -> str:
+    """ID документа ссылки: хэш нормализованного URL (в id документа Firestore нельзя '/')."""
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+def is_valid_post(post: Dict[str, Any]) -> bool:
+    """Проверки на валидность поста: есть id, канал, дата и хотя бы 5 слов текста."""
+    if not post.get('msg_id') or not post.get('channel_id') or not post.get('date'):
+        return False
+    plain_text = post.get('plain_text')
+    if plain_text is None or (isinstance(plain_text, str) and not plain_text.strip()):
+        return False
+    if isinstance(plain_text, str) and len(plain_text.split()) < 5:
+        return False
+    return True
+
+__all__ = ["post_doc_id", "link_doc_id", "is_valid_post"]
@@ -0,0 +1,120 @@
+"""
+Нормализация сообщений Telegram: текст, компактные entities и HTML для дайджеста.
+
+message.message — это уже обычный текст (разметка лежит отдельно в entities),
+поэтому plain_text берется как есть, без html2text. Entities сохраняются
+словарями {type, offset, length[, url][, user_id]}, а HTML строится из них.
+Смещения entities в Telegram считаются в кодовых единицах UTF-16.
+"""
+import inspect
+from functools import lru_cache
+from html import escape
+from typing import Any, Dict, List, Optional, Tuple
+
+# Необязательные поля entities, которые сохраняем
+EXTRA_FIELDS = ('url', 'user_id')
+
+# Тип entity -> (открывающий, закрывающий) тег; ссылки обрабатываются отдельно
+SIMPLE_TAGS = {
+    'MessageEntityBold': ('<b>', '</b>'),
+    'MessageEntityItalic': ('<i>', '</i>'),
+    'MessageEntityUnderline': ('<u>', '</u>'),
+    'MessageEntityStrike': ('<s>', '</s>'),
+    'MessageEntityCode': ('<code>', '</code>'),
+    'MessageEntityPre': ('<pre>', '</pre>'),
+    'MessageEntitySpoiler': ('<span class="spoiler">', '</span>'),
+    'MessageEntityBlockquote': ('<blockquote>', '</blockquote>'),
+}
+
+@lru_cache(maxsize=None)
+def _extra_fields(entity_class: type) -> Tuple[str, ...]:
+    """Какие из EXTRA_FIELDS есть у класса entity — определяется один раз на класс."""
+    parameters = inspect.signature(entity_class.__init__).parameters
+    return tuple(name for name in EXTRA_FIELDS if name in parameters)
+
+def compact_entities(entities: Optional[List[Any]]) -> List[Dict[str, Any]]:
+    """Преобразует entities Telethon в словари с теми же ключами, что хранятся в базе."""
+    result = []
+    for entity in entities or ():
+        data = {'type': entity.__class__.__name__, 'offset': entity.offset, 'length': entity.length}
+        for name in _extra_fields(entity.__class__):
+            data[name] = getattr(entity, name)
+        result.append(data)
+    return result
+
+def utf16_slice(text: str, offset: int, length: int) -> str:
+    """Подстрока по смещению и длине в кодовых единицах UTF-16 (как в entities Telegram)."""
+    units = text.encode('utf-16-le')
+    return units[offset * 2:(offset + length) * 2].decode('utf-16-le', errors='ignore')
+
+def _open_tag(entity: Dict[str, Any], text: str) -> Tuple[str, str]:
+    kind = entity['type']
+    if kind in SIMPLE_TAGS:
+        return SIMPLE_TAGS[kind]
+    if kind == 'MessageEntityTextUrl':
+        return f'<a href="{escape(entity.get("url") or "")}">', '</a>'
+    if kind == 'MessageEntityUrl':
+        href = text if "://" in text else "http://" + text
+        return f'<a href="{escape(href)}">', '</a>'
+    if kind == 'MessageEntityEmail':
+        return f'<a href="mailto:{escape(text)}">', '</a>'
+    return '', ''
+
+def entities_to_html(text: Optional[str], entities: Optional[List[Dict[str, Any]]]) -> str:
+    """
+    Строит HTML из текста и компактных entities: текст экранируется,
+    переводы строк становятся <br>, разметка — тегами. Пересекающиеся
+    (а не вложенные) entities корректно закрываются и открываются заново.
+    """
+    if not text:
+        return ""
+    units = text.encode('utf-16-le')
+    total = len(units) // 2
+
+    def segment(start: int, end: int) -> str:
+        return units[start * 2:end * 2].decode('utf-16-le')
+
+    spans = []
+    for entity in entities or ():
+        start = max(0, entity['offset'])
+        end = min(total, entity['offset'] + entity['length'])
+        if end <= start:
+            continue
+        open_tag, close_tag = _open_tag(entity, segment(start, end))
+        if open_tag:
+            spans.append((start, end, open_tag, close_tag))
+    if not spans:
+        return escape(text).replace("\n", "<br>")
+
+    # Внешние entities открываются первыми: по началу, затем более длинные
+    spans.sort(key=lambda span: (span[0], -span[1]))
+    boundaries = sorted({0, total, *(span[0] for span in spans), *(span[1] for span in spans)})
+    parts: List[str] = []
+    stack: List[Tuple[int, int, str, str]] = []
+    next_span = 0
+    for position, following in zip(boundaries, boundaries[1:] + [None]):
+        # Закрываем закончившиеся; те, что выше них в стеке, закрываем и открываем заново
+        ended = [i for i, span in enumerate(stack) if span[1] == position]
+        if ended:
+            closed = stack[ended[0]:]
+            del stack[ended[0]:]
+            for span in reversed(closed):
+                parts.append(span[3])
+            for span in closed:
+                if span[1] != position:
+                    parts.append(span[2])
+                    stack.append(span)
+        while next_span < len(spans) and spans[next_span][0] == position:
+            span = spans[next_span]
+            parts.append(span[2])
+            stack.append(span)
+            next_span += 1
+        if following is not None:
+            parts.append(escape(segment(position, following)).replace("\n", "<br>"))
+    return "".join(parts)
+
+def normalize_message(message: Any) -> Tuple[Optional[str], List[Dict[str, Any]], str]:
+    """Возвращает (plain_text, компактные entities, HTML) для сообщения Telethon."""
+    text = message.message or None
+    entities = compact_entities(message.entities)
+    return text, entities, entities_to_html(text, entities)
@@ -1,77 +1,212 @@
 import os
+import time
+import hashlib
+import multiprocessing
+from html import escape as html_escape
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Tuple
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-from weasyprint import HTML
-from telegram_digest.firebase_db import init_firebase
+from collections import deque
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
 from telegram_digest.config import load_channels_from_yaml
-from google.cloud.firestore_v1.base_query import FieldFilter
-from firebase_admin import firestore
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup, Tag
+from telegram_digest.storage import iter_digest_posts
+from telegram_digest.fragment_cache import FragmentCache
+from telegram_digest.metrics import get_logger, inc, metrics, span
+
+log = get_logger(__name__)
+
+# weasyprint, ebooklib и firebase импортируются внутри функций,
+# которые их используют: импорт модуля остается дешевым.
 
 OUTPUT_DIR = "output"
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
 TEMPLATE_FILE = "digest.html.j2"
+CHANNEL_TEMPLATE_FILE = "_channel.html.j2"
+POST_TEMPLATE_FILE = "_post.html.j2"
 
-# Убедимся, что директория для вывода существует
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Сколько символов summary показывать в заголовке главы EPUB
+EPUB_TITLE_SUMMARY_LENGTH = 80
 
+# Скомпилированные шаблоны кэшируются на диске между запусками;
+# проверка изменений шаблонов (auto_reload) нужна только при разработке
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", "./storage/jinja_cache")
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "").strip().lower() in ("1", "true", "yes")
 
-def get_digest_posts(date_from: datetime, date_to: datetime, channels: List[str]) -> List[dict]:
-    LIMIT = 100
-    all_posts = []
+_env: Optional[Environment] = None
 
-    db = init_firebase()
-    messages_ref = db.collection('messages')
-    
-    for channel in channels:
-        # Получаем 100 самых свежих постов по каналу
-        docs = list(messages_ref.where(
-            filter=FieldFilter('channel', '==', channel)
-        ).order_by('date', direction=firestore.Query.DESCENDING).limit(LIMIT).stream())
-        print(f"Найдено {len(docs)} постов для канала {channel} (сортировка по дате DESC):")
-        for i, doc in enumerate(docs):
-            data = doc.to_dict()
-            print(f"{i+1}. date={data.get('date')}, summary={data.get('summary')}, text={data.get('plain_text')[:80] if data.get('plain_text') else ''}")
-        
-        # Получаем посты и сортируем их в обратном порядке (от старых к новым)
-        posts = [doc.to_dict() for doc in docs]
-        posts.sort(key=lambda x: x['date'])  # ASCENDING
-        all_posts.extend(posts)
-    
-    return all_posts
+def _get_channel_posts(channel: str, date_from: datetime, date_to: datetime) -> List[dict]:
+    posts = list(iter_digest_posts(channel, date_from, date_to))
+    log.info(f"Найдено {len(posts)} постов с summary для канала {channel}")
+    return posts
 
-def render_digest_html(posts: List[dict], date_from: datetime, date_to: datetime) -> str:
-    env = Environment(
-        loader=FileSystemLoader(TEMPLATE_DIR),
-        autoescape=select_autoescape(['html', 'xml'])
+def _jinja_env() -> Environment:
+    """
+    Общее окружение Jinja на процесс: шаблоны компилируются один раз
+    и остаются в памяти, байткод сохраняется в JINJA_CACHE_DIR.
+    """
+    global _env
+    if _env is None:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        _env = Environment(
+            loader=FileSystemLoader(TEMPLATE_DIR),
+            autoescape=select_autoescape(['html', 'xml']),
+            bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR),
+            auto_reload=TEMPLATE_AUTO_RELOAD
+        )
+    return _env
+
+def group_posts_by_channel(posts: Iterable[dict]) -> List[Tuple[str, List[dict]]]:
+    """Группирует посты по каналам, сохраняя порядок первого появления канала."""
+    grouped: Dict[str, List[dict]] = {}
+    for post in posts:
+        grouped.setdefault(post.get('channel'), []).append(post)
+    return list(grouped.items())
+
+def iter_channel_posts(
+    date_from: datetime,
+    date_to: datetime,
+    channels: List[str],
+    prefetch: int = 2
+) -> Iterator[Tuple[str, List[dict]]]:
+    """
+    Отдает (канал, посты) по одному каналу в заданном порядке.
+    Следующие prefetch каналов запрашиваются в фоне, поэтому в памяти
+    одновременно не больше prefetch + 1 каналов, а не весь период.
+    Каналы без постов пропускаются.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, prefetch)) as executor:
+        pending = deque()
+        channel_iter = iter(channels)
+        for channel in islice(channel_iter, prefetch + 1):
+            pending.append((channel, executor.submit(_get_channel_posts, channel, date_from, date_to)))
+        while pending:
+            channel, future = pending.popleft()
+            posts = future.result()
+            next_channel = next(channel_iter, None)
+            if next_channel is not None:
+                pending.append((next_channel, executor.submit(_get_channel_posts, next_channel, date_from, date_to)))
+            if posts:
+                yield channel, posts
+
+def render_post_html(post: dict, env: Optional[Environment] = None) -> str:
+    """Отрисовывает один пост (_post.html.j2) — общий фрагмент для PDF и EPUB."""
+    template = (env or _jinja_env()).get_template(POST_TEMPLATE_FILE)
+    return template.render(post=post)
+
+def template_hash(env: Environment, name: str) -> str:
+    """SHA-256 исходника шаблона — часть ключа кэша фрагментов."""
+    source, _, _ = env.loader.get_source(env, name)
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def render_post_fragments(
+    posts: List[dict],
+    env: Optional[Environment] = None,
+    cache: Optional[FragmentCache] = None
+) -> List[str]:
+    """Отрисовывает посты; при наличии кэша берет готовые фрагменты и рендерит только новые/измененные."""
+    env = env or _jinja_env()
+    if cache is None:
+        return [render_post_html(post, env) for post in posts]
+    fragments = []
+    for post in posts:
+        key = cache.key(post)
+        fragment = cache.get(key) if key else None
+        if fragment is None:
+            fragment = render_post_html(post, env)
+            if key:
+                cache.put(key, fragment)
+        fragments.append(fragment)
+    return fragments
+
+def render_channel_html(channel: str, post_fragments: List[str], env: Optional[Environment] = None) -> str:
+    """Отрисовывает блок одного канала (_channel.html.j2) из готовых фрагментов постов."""
+    template = (env or _jinja_env()).get_template(CHANNEL_TEMPLATE_FILE)
+    return template.render(channel=channel, post_fragments=post_fragments)
+
+def iter_digest_html(
+    channel_chunks: Iterable[str],
+    date_from: datetime,
+    date_to: datetime,
+    env: Optional[Environment] = None,
+    show_header: bool = True
+) -> Iterator[str]:
+    """Потоково отрисовывает дайджест: шапка, блоки каналов по мере поступления, подвал."""
+    template = (env or _jinja_env()).get_template(TEMPLATE_FILE)
+    return template.generate(
+        channel_chunks=channel_chunks, date_from=date_from, date_to=date_to,
+        timedelta=timedelta, show_header=show_header
+    )
+
+def render_digest_html(
+    posts: List[dict],
+    date_from: datetime,
+    date_to: datetime,
+    env: Optional[Environment] = None
+) -> str:
+    env = env or _jinja_env()
+    chunks = (
+        render_channel_html(channel, [render_post_html(post, env) for post in channel_posts], env)
+        for channel, channel_posts in group_posts_by_channel(posts)
     )
-    template = env.get_template(TEMPLATE_FILE)
-    return template.render(posts=posts, date_from=date_from, date_to=date_to, timedelta=timedelta)
+    return "".join(iter_digest_html(chunks, date_from, date_to, env))
+
+def render_digests_html(digests: Iterable[Tuple[List[dict], datetime, datetime]]) -> Iterator[str]:
+    """
+    Пакетно отрисовывает несколько дайджестов (по каналам, периодам, подписчикам)
+    на одних скомпилированных шаблонах: (posts, date_from, date_to) -> HTML.
+    """
+    env = _jinja_env()
+    for posts, date_from, date_to in digests:
+        yield render_digest_html(posts, date_from, date_to, env)
+
+def _output_path(date_from: datetime, date_to: datetime, ext: str) -> str:
+    # Убедимся, что директория для вывода существует
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    fname = f"Telegram_{date_from.strftime('%Y%m%d')}_{date_to.strftime('%Y%m%d')}.{ext}"
+    return os.path.join(OUTPUT_DIR, fname)
 
 def save_pdf_from_html(html: str, date_from: datetime, date_to: datetime) -> str:
-    fname = f"Telegram_{date_from.strftime('%Y%m%d')}_{date_to.strftime('%Y%m%d')}.pdf"
-    out_path = os.path.join(OUTPUT_DIR, fname)
-    HTML(string=html).write_pdf(out_path)
+    from weasyprint import HTML
+
+    out_path = _output_path(date_from, date_to, "pdf")
+    with span("render", format="pdf"):
+        HTML(string=html).write_pdf(out_path)
     return out_path
 
-def save_epub_from_html(html: str, date_from: datetime, date_to: datetime) -> str:
-    """Создает EPUB файл из HTML контента."""
-    fname = f"Telegram_{date_from.strftime('%Y%m%d')}_{date_to.strftime('%Y%m%d')}.epub"
-    out_path = os.path.join(OUTPUT_DIR, fname)
-    
-    # Создаем книгу
-    book = epub.EpubBook()
-    
-    # Устанавливаем метаданные
-    book.set_identifier(f"telegram-digest-{date_from.strftime('%Y%m%d')}")
-    book.set_title(f"Telegram Digest {date_from.strftime('%Y-%m-%d')} - {date_to.strftime('%Y-%m-%d')}")
-    book.set_language('ru')
-    
-    # Создаем CSS стили
-    style = '''
+def _render_pdf(html_path: str, out_path: str) -> str:
+    """Рендерит HTML-файл в PDF. Выполняется в отдельном процессе, поэтому на уровне модуля."""
+    from weasyprint import HTML
+
+    HTML(filename=html_path).write_pdf(out_path)
+    return out_path
+
+def pdf_merge_available() -> bool:
+    """
+    Склейка частей PDF требует pypdf (extra split-pdf: poetry install -E split-pdf):
+    pydyf, на котором пишет WeasyPrint, умеет только создавать PDF, но не читать их.
+    """
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def merge_pdf_parts(part_paths: List[str], out_path: str) -> str:
+    """Склеивает части PDF в один файл по порядку и удаляет части."""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for part_path in part_paths:
+        writer.append(part_path)
+    with open(out_path, "wb") as f:
+        writer.write(f)
+    for part_path in part_paths:
+        os.remove(part_path)
+    return out_path
+
+# CSS для EPUB
+EPUB_STYLE = '''
     body {
         font-family: Georgia, serif;
         line-height: 1.6;
@@ -101,96 +236,215 @@ def save_epub_from_html(html: str, date_from: datetime, date_to: datetime) -> st
         margin-bottom: 1em;
     }
     '''
-    
-    # Добавляем CSS в книгу
-    css = epub.EpubItem(
-        uid="style_default",
-        file_name="style/default.css",
-        media_type="text/css",
-        content=style
-    )
-    book.add_item(css)
-    
-    # Парсим HTML для создания глав
-    soup = BeautifulSoup(html, 'html.parser')
-    chapters = []
-    
-    # Находим все каналы
-    channel_titles = soup.find_all('div', class_='channel-title')
-    for channel_title in channel_titles:
-        # Создаем главу для канала
-        channel_chapter = epub.EpubHtml(
-            title=channel_title.text,
-            file_name=f'channel_{len(chapters)}.xhtml',
-            lang='ru'
+
+class EpubDigest:
+    """
+    Собирает EPUB по частям прямо из данных постов: на каждый канал — глава-раздел,
+    на каждый пост — глава с тем же фрагментом _post.html.j2, что и в PDF.
+    Оглавление двухуровневое: каналы, внутри — посты.
+    """
+    def __init__(self, date_from: datetime, date_to: datetime):
+        from ebooklib import epub
+
+        self.date_from = date_from
+        self.date_to = date_to
+        self.chapters = []
+        self.toc = []
+        # Создаем книгу
+        self.book = epub.EpubBook()
+        
+        # Устанавливаем метаданные
+        self.book.set_identifier(f"telegram-digest-{date_from.strftime('%Y%m%d')}")
+        self.book.set_title(f"Telegram Digest {date_from.strftime('%Y-%m-%d')} - {date_to.strftime('%Y-%m-%d')}")
+        self.book.set_language('ru')
+        
+        # Добавляем CSS в книгу
+        self.css = epub.EpubItem(
+            uid="style_default",
+            file_name="style/default.css",
+            media_type="text/css",
+            content=EPUB_STYLE
+        )
+        self.book.add_item(self.css)
+
+    def _add_chapter(self, title: str, file_name: str, content: str):
+        from ebooklib import epub
+
+        chapter = epub.EpubHtml(title=title, file_name=file_name, lang='ru')
+        chapter.content = content
+        chapter.add_item(self.css)
+        self.book.add_item(chapter)
+        self.chapters.append(chapter)
+        return chapter
+
+    def add_channel(self, channel: str, posts: List[dict], post_fragments: List[str]) -> None:
+        """Добавляет раздел канала и главы его постов из уже отрисованных фрагментов."""
+        from ebooklib import epub
+
+        index = len(self.toc)
+        channel_chapter = self._add_chapter(
+            channel, f'channel_{index}.xhtml', f"<h1>{html_escape(channel)}</h1>"
         )
-        channel_chapter.content = f"<h1>{channel_title.text}</h1>"
-        book.add_item(channel_chapter)
-        chapters.append(channel_chapter)
+        post_chapters = []
+        for number, (post, fragment) in enumerate(zip(posts, post_fragments)):
+            date = post['date'].strftime('%d.%m.%Y %H:%M') if post.get('date') else ''
+            summary = post.get('summary') or 'Post'
+            if len(summary) > EPUB_TITLE_SUMMARY_LENGTH:
+                summary = summary[:EPUB_TITLE_SUMMARY_LENGTH].rstrip() + '…'
+            post_chapters.append(self._add_chapter(
+                f"{date} - {summary}", f'channel_{index}_post_{number}.xhtml', fragment
+            ))
+        self.toc.append((epub.Section(channel, href=channel_chapter.file_name), post_chapters))
+
+    def save(self) -> str:
+        from ebooklib import epub
+
+        out_path = _output_path(self.date_from, self.date_to, "epub")
+        # Создаем оглавление: каналы, внутри — посты
+        self.book.toc = self.toc
         
-        # Находим все посты этого канала
-        current = channel_title.next_sibling
-        while current and not (isinstance(current, Tag) and current.get('class') and 'channel-title' in current.get('class')):
-            if isinstance(current, Tag) and current.get('class') and 'post' in current.get('class'):
-                # Создаем главу для поста
-                post_date = current.find('div', class_='post-date')
-                post_summary = current.find('div', class_='summary')
-                post_text = current.find('div', class_='text')
-                
-                chapter = epub.EpubHtml(
-                    title=f"{post_date.text if post_date else ''} - {post_summary.text if post_summary else 'Post'}",
-                    file_name=f'post_{len(chapters)}.xhtml',
-                    lang='ru'
-                )
-                
-                # Формируем контент главы
-                content = []
-                if post_date:
-                    content.append(f"<div class='post-date'>{post_date.text}</div>")
-                if post_summary:
-                    content.append(f"<div class='summary'><i>{post_summary.text}</i></div>")
-                    content.append("<br><br>")  # Добавляем два переноса строки после саммари
-                if post_text:
-                    content.append(f"<div class='text'>{post_text.decode_contents()}</div>")
-                
-                chapter.content = "\n".join(content)
-                book.add_item(chapter)
-                chapters.append(chapter)
-            current = current.next_sibling
-    
-    # Создаем оглавление
-    book.toc = chapters
-    
-    # Добавляем навигационные файлы
-    book.add_item(epub.EpubNcx())
-    book.add_item(epub.EpubNav())
-    
-    # Определяем порядок чтения
-    book.spine = ['nav'] + chapters
-    
-    # Сохраняем книгу
-    epub.write_epub(out_path, book)
-    return out_path
+        # Добавляем навигационные файлы
+        self.book.add_item(epub.EpubNcx())
+        self.book.add_item(epub.EpubNav())
+        
+        # Определяем порядок чтения
+        self.book.spine = ['nav'] + self.chapters
+        
+        # Сохраняем книгу
+        with span("render", format="epub"):
+            epub.write_epub(out_path, self.book)
+        return out_path
+
+def save_epub(channel_posts: Iterable[Tuple[str, List[dict]]], date_from: datetime, date_to: datetime) -> str:
+    """Создает EPUB файл из постов, сгруппированных по каналам."""
+    env = _jinja_env()
+    epub_digest = EpubDigest(date_from, date_to)
+    for channel, posts in channel_posts:
+        epub_digest.add_channel(channel, posts, [render_post_html(post, env) for post in posts])
+    return epub_digest.save()
 
-def generate_digest(date_from: datetime, date_to: datetime, channels: Optional[List[str]] = None) -> Tuple[str, str, int]:
+def build_digest(
+    channel_posts: Iterable[Tuple[str, List[dict]]],
+    date_from: datetime,
+    date_to: datetime,
+    pdf: bool = True,
+    split_pdf: bool = False,
+    workers: Optional[int] = None,
+    fragment_cache: bool = False
+) -> Tuple[Optional[str], str, int]:
+    """
+    Потоково строит дайджест из (канал, посты): посты канала отрисовываются один раз,
+    блок канала дописывается в HTML-файл, а те же фрагменты становятся главами EPUB.
+    PDF рендерится в пуле процессов, параллельно с записью EPUB.
+    split_pdf=True — каждый канал рендерится отдельной частью PDF сразу по готовности,
+    части обрабатываются параллельно в workers процессах и затем склеиваются.
+    fragment_cache=True — фрагменты постов берутся из дискового кэша (FragmentCache),
+    отрисовываются только новые и измененные посты.
+    pdf=False — только HTML и EPUB (например, для бенчмарков).
+    Возвращает пути к PDF (или None) и EPUB и количество постов.
+    """
+    if pdf and split_pdf and not pdf_merge_available():
+        raise RuntimeError("split_pdf requires pypdf to merge PDF parts: poetry install -E split-pdf")
+    env = _jinja_env()
+    cache = FragmentCache(template_hash=template_hash(env, POST_TEMPLATE_FILE)) if fragment_cache else None
+    epub_digest = EpubDigest(date_from, date_to)
+    count = 0
+    pdf_path = None
+    executor = None
+    part_futures = []
+    if pdf:
+        # spawn, а не fork: в родителе уже работают потоки (чтение каналов, клиенты БД)
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def channel_chunks() -> Iterator[str]:
+        nonlocal count
+        for channel, posts in channel_posts:
+            count += len(posts)
+            # Каждый пост отрисовывается один раз и идет и в PDF, и в EPUB
+            fragments = render_post_fragments(posts, env, cache)
+            epub_digest.add_channel(channel, posts, fragments)
+            chunk = render_channel_html(channel, fragments, env)
+            if executor is not None and split_pdf:
+                part_path = _output_path(date_from, date_to, f"part{len(part_futures) + 1:03d}.html")
+                with open(part_path, "w", encoding="utf-8") as f:
+                    # Заголовок дайджеста — только в первой части
+                    for part in iter_digest_html([chunk], date_from, date_to, env, show_header=not part_futures):
+                        f.write(part)
+                part_futures.append(executor.submit(_render_pdf, part_path, part_path[:-len("html")] + "pdf"))
+            yield chunk
+
+    try:
+        html_path = _output_path(date_from, date_to, "html")
+        # Сюда входит и чтение постов из channel_posts, и рендеринг частей PDF в пуле
+        with span("render", format="html"):
+            if executor is not None and split_pdf:
+                # Части PDF пишутся своими HTML-файлами, общий HTML не нужен
+                for _ in channel_chunks():
+                    pass
+            else:
+                with open(html_path, "w", encoding="utf-8") as f:
+                    for part in iter_digest_html(channel_chunks(), date_from, date_to, env):
+                        f.write(part)
+
+        # Генерируем оба формата: PDF — в пуле процессов, EPUB — тем временем здесь
+        pdf_future = None
+        pdf_started = time.perf_counter()
+        if executor is not None and not split_pdf:
+            pdf_future = executor.submit(_render_pdf, html_path, _output_path(date_from, date_to, "pdf"))
+        epub_path = epub_digest.save()
+        if pdf_future is not None:
+            pdf_path = pdf_future.result()
+            # PDF рендерится в другом процессе: засекаем от отправки до готовности
+            metrics.observe("render", time.perf_counter() - pdf_started, format="pdf")
+        elif part_futures:
+            part_pdfs = [future.result() for future in part_futures]
+            pdf_path = merge_pdf_parts(part_pdfs, _output_path(date_from, date_to, "pdf"))
+            for part_pdf in part_pdfs:
+                os.remove(part_pdf[:-len("pdf")] + "html")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    inc("digest_posts", count)
+    if cache is not None:
+        cache.prune()
+        inc("cache_hits", cache.hits, cache="fragment")
+        inc("cache_misses", cache.misses, cache="fragment")
+        log.info(cache.stats_line())
+    return pdf_path, epub_path, count
+
+def generate_digest(
+    date_from: datetime,
+    date_to: datetime,
+    channels: Optional[List[str]] = None,
+    split_pdf: bool = False,
+    workers: Optional[int] = None,
+    fragment_cache: bool = True
+) -> Tuple[Optional[str], str, int]:
     """
     Генерирует дайджест в форматах PDF и EPUB.
-    Возвращает пути к файлам и количество постов.
+    Посты читаются и отрисовываются по одному каналу, поэтому память
+    не растет пропорционально всему периоду.
+    split_pdf, workers, fragment_cache — см. build_digest.
+    Возвращает пути к PDF (None, если в split_pdf нет ни одной части) и EPUB
+    и количество постов.
     """
     if channels is None:
         channels = load_channels_from_yaml()
-    posts = get_digest_posts(date_from, date_to, channels)
-    html = render_digest_html(posts, date_from, date_to)
-    
-    # Генерируем оба формата
-    pdf_path = save_pdf_from_html(html, date_from, date_to)
-    epub_path = save_epub_from_html(html, date_from, date_to)
-    
-    return pdf_path, epub_path, len(posts)
+    return build_digest(
+        iter_channel_posts(date_from, date_to, channels), date_from, date_to,
+        split_pdf=split_pdf, workers=workers, fragment_cache=fragment_cache
+    )
 
 # Обновляем старую функцию для обратной совместимости
-def generate_pdf_digest(date_from: datetime, date_to: datetime, channels: Optional[List[str]] = None) -> Tuple[str, int]:
-    pdf_path, _, count = generate_digest(date_from, date_to, channels)
+def generate_pdf_digest(
+    date_from: datetime,
+    date_to: datetime,
+    channels: Optional[List[str]] = None,
+    split_pdf: bool = False,
+    workers: Optional[int] = None,
+    fragment_cache: bool = True
+) -> Tuple[Optional[str], int]:
+    pdf_path, _, count = generate_digest(date_from, date_to, channels, split_pdf, workers, fragment_cache)
     return pdf_path, count
 
 def generate_test_pdf(channel: str = "@cryptoEssay"):
@@ -198,78 +452,26 @@ def generate_test_pdf(channel: str = "@cryptoEssay"):
     Генерирует тестовый PDF с постами из указанного канала.
     Если постов нет, использует тестовые данные.
     """
-    db = init_firebase()
-    messages_ref = db.collection('messages')
-    
-    # Проверяем структуру данных
-    print(f"\nПроверяем данные в базе для канала {channel}:")
-    
-    # 1. Проверяем все посты
-    all_docs = list(messages_ref.limit(5).stream())
-    print(f"\nПримеры постов в базе:")
-    for doc in all_docs:
-        data = doc.to_dict()
-        print(f"- channel: {data.get('channel')}")
-        print(f"  summary: {data.get('summary')}")
-        print(f"  date: {data.get('date')}")
-        print("---")
-    
-    # 2. Пробуем найти посты по каналу
-    channel_docs = list(messages_ref.where(filter=FieldFilter('channel', '==', channel)).limit(5).stream())
-    print(f"\nПосты для канала {channel}:")
-    for doc in channel_docs:
-        data = doc.to_dict()
-        print(f"- channel: {data.get('channel')}")
-        print(f"  summary: {data.get('summary')}")
-        print(f"  date: {data.get('date')}")
-        print("---")
-    
-    # 3. Пробуем найти посты с summary (исправленный запрос)
-    # В Firestore для проверки на null используется оператор == с null
-    summary_docs = list(messages_ref.where(filter=FieldFilter('summary', '!=', None)).limit(5).stream())
-    print(f"\nПосты с summary (старый запрос с != None):")
-    for doc in summary_docs:
-        data = doc.to_dict()
-        print(f"- channel: {data.get('channel')}")
-        print(f"  summary: {data.get('summary')}")
-        print(f"  date: {data.get('date')}")
-        print("---")
-    
-    # Новый запрос для проверки - используем == null
-    summary_docs_new = list(messages_ref.where(filter=FieldFilter('summary', '==', None)).limit(5).stream())
-    print(f"\nПосты БЕЗ summary (запрос с == null):")
-    for doc in summary_docs_new:
-        data = doc.to_dict()
-        print(f"- channel: {data.get('channel')}")
-        print(f"  summary: {data.get('summary')}")
-        print(f"  date: {data.get('date')}")
-        print("---")
-    
-    # Теперь пробуем основной запрос - ищем посты где summary существует и не пустой
-    # Сначала получаем все посты канала
-    channel_posts = list(messages_ref.where(filter=FieldFilter('channel', '==', channel)).stream())
-    # Фильтруем их в Python, чтобы найти те, у которых есть summary
-    docs = [doc for doc in channel_posts if doc.to_dict().get('summary')]
-    print(f"\nРезультат основного запроса:")
-    print(f"Найдено постов: {len(docs)}")
-    
-    if docs:
-        test_posts = []
-        for doc in docs:
-            post = doc.to_dict()
-            print(f"\nОбрабатываем пост:")
-            print(f"- summary: {post.get('summary')}")
-            print(f"- text_html: {post.get('text_html')}")
-            print(f"- date: {post.get('date')}")
-            test_posts.append({
-                'summary': post.get('summary', ''),
-                'text_html': post.get('text_html', ''),
-                'date': post.get('date')
-            })
-        test_posts.sort(key=lambda x: x['date'])
-        print(f"\nПодготовлено постов для PDF: {len(test_posts)}")
+    from telegram_digest.storage import count_posts, iter_digest_posts
+
+    log.info(f"Проверяем данные в базе для канала {channel}:")
+    log.info(f"Всего постов в базе: {count_posts()}, в канале: {count_posts(channel)}")
+
+    # Посты канала с summary: фильтр на стороне хранилища, чтение страницами
+    test_posts = [
+        {
+            'summary': post.get('summary', ''),
+            'text_html': post.get('text_html', ''),
+            'date': post.get('date')
+        }
+        for post in iter_digest_posts(channel, datetime(1970, 1, 1, tzinfo=timezone.utc), datetime.now(timezone.utc))
+    ]
+    log.info(f"Постов с summary: {len(test_posts)}")
+
+    if test_posts:
+        log.info(f"Подготовлено постов для PDF: {len(test_posts)}")
     else:
-        print("Постов не найдено, используем тестовые данные")
+        log.info("Постов не найдено, используем тестовые данные")
         test_posts = [
             {
                 'summary': 'Это тестовое саммари 1',
@@ -284,23 +486,20 @@ def generate_test_pdf(channel: str = "@cryptoEssay"):
         ]
     
     date_from = datetime.now(timezone.utc) - timedelta(days=7)
-    print("DEBUG: date_from вычислен:", date_from)
+    log.debug(f"date_from вычислен: {date_from}")
     date_to = datetime.now(timezone.utc)
-    print("DEBUG: date_to вычислен:", date_to)
-    print(f"\nПериод для PDF: {date_from} - {date_to}")
+    log.debug(f"date_to вычислен: {date_to}")
+    log.info(f"Период для PDF: {date_from} - {date_to}")
     
     try:
-        print("\nГенерируем HTML...")
+        log.info("Генерируем HTML...")
         html = render_digest_html(test_posts, date_from, date_to)
-        print("HTML сгенерирован успешно")
+        log.info("HTML сгенерирован успешно")
         
-        print("\nСохраняем PDF...")
+        log.info("Сохраняем PDF...")
         pdf_path = save_pdf_from_html(html, date_from, date_to)
-        print(f"Тестовый PDF сгенерирован: {pdf_path}")
-        print(f"Количество постов: {len(test_posts)}")
-    except Exception as e:
-        print(f"\nОшибка при генерации PDF: {str(e)}")
-        print(f"Тип ошибки: {type(e)}")
-        import traceback
-        print(f"Traceback:\n{traceback.format_exc()}")
+        log.info(f"Тестовый PDF сгенерирован: {pdf_path}")
+        log.info(f"Количество постов: {len(test_posts)}")
+    except Exception:
+        log.exception("Ошибка при генерации PDF")
         raise 
\ No newline at end of file
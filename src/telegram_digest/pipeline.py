@@ -0,0 +1,148 @@
+"""
+Конвейер fetch -> summarize -> digest в одном процессе (команда `run`).
+
+Одно соединение с Telegram и один клиент хранилища на весь запуск.
+Загруженные страницы сразу уходят в summarize_stream через asyncio.Queue,
+так что саммари делаются, пока остальные каналы еще загружаются.
+Дайджест собирается из постов в памяти; из хранилища дочитываются только
+посты периода, которые не загружались в этом запуске (старше самого
+старого загруженного сообщения канала).
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from telegram_digest.fetcher import fetch_posts
+from telegram_digest.models import is_valid_post, post_doc_id
+from telegram_digest.metrics import get_logger
+from telegram_digest.storage import get_posts_by_ids, iter_digest_posts
+from telegram_digest.summarizer import (
+    DEFAULT_CONCURRENCY, DEFAULT_RPM, DEFAULT_TPM, summarize_stream
+)
+
+log = get_logger(__name__)
+
+async def fetch_and_summarize(
+    client,
+    channel_ids: List[str],
+    days: int = 1,
+    fetch_concurrency: int = 5,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rpm: Optional[int] = DEFAULT_RPM,
+    tpm: Optional[int] = DEFAULT_TPM,
+    pack_tokens: int = 0,
+    to_summarize: Optional[asyncio.Queue] = None,
+    summary_client=None,
+    run_id: Optional[str] = None,
+) -> Dict[str, List[dict]]:
+    """
+    Загружает каналы и параллельно делает саммари для загруженных постов.
+    Новые посты и сохраненные ранее без summary отправляются в summarizer,
+    для остальных summary читается из хранилища одним get_posts_by_ids на страницу.
+    to_summarize — очередь между загрузкой и summarizer (можно передать свою, чтобы следить за глубиной),
+    summary_client — клиент OpenAI (по умолчанию создается на вызов).
+    run_id — запуск, к которому относится загрузка (см. fetch_posts).
+    Возвращает посты по каналам (поля как в хранилище, плюс id) с заполненным summary, где оно есть.
+    """
+    fetched: Dict[str, List[dict]] = {channel_id: [] for channel_id in channel_ids}
+    if to_summarize is None:
+        to_summarize = asyncio.Queue()
+
+    async def on_posts(channel_id: str, page_posts: List[dict]) -> None:
+        posts = []
+        for post in page_posts:
+            # Невалидные посты не сохраняются — и в дайджест не попадают
+            if not is_valid_post(post):
+                continue
+            post['id'] = post_doc_id(channel_id, post['msg_id'])
+            post['channel'] = channel_id
+            posts.append(post)
+        known = [post['id'] for post in posts if not post['added']]
+        stored = await asyncio.to_thread(get_posts_by_ids, known, ['summary']) if known else {}
+        pending = []
+        for post in posts:
+            summary = stored.get(post['id'], {}).get('summary')
+            if summary is None:
+                pending.append(post)
+            else:
+                post['summary'] = summary
+        fetched[channel_id].extend(posts)
+        if pending:
+            to_summarize.put_nowait(pending)
+
+    async def fetch() -> None:
+        try:
+            await fetch_posts(client, channel_ids, days, concurrency=fetch_concurrency, on_posts=on_posts, run_id=run_id)
+        finally:
+            to_summarize.put_nowait(None)
+
+    _, summaries = await asyncio.gather(
+        fetch(),
+        summarize_stream(to_summarize, concurrency, rpm, tpm, pack_tokens=pack_tokens, client=summary_client)
+    )
+    for posts in fetched.values():
+        for post in posts:
+            if post['id'] in summaries:
+                post['summary'] = summaries[post['id']]
+    return fetched
+
+def iter_pipeline_channel_posts(
+    fetched: Dict[str, List[dict]],
+    date_from: datetime,
+    date_to: datetime
+) -> Iterator[Tuple[str, List[dict]]]:
+    """
+    Отдает (канал, посты с summary от старых к новым) для build_digest.
+    Загруженные в этом запуске посты берутся из памяти; из хранилища читается
+    только начало периода — до самого старого загруженного сообщения канала.
+    """
+    for channel, posts in fetched.items():
+        in_memory = {
+            post['id']: post for post in posts
+            if post.get('summary') is not None and date_from <= post['date'] < date_to
+        }
+        # Страницы идут от новых к старым, поэтому все, что новее самого старого
+        # загруженного сообщения, уже в памяти (секунда запаса — на посты с той же датой)
+        boundary = min((post['date'] for post in posts), default=date_to) + timedelta(seconds=1)
+        stored = [
+            post for post in iter_digest_posts(channel, date_from, min(boundary, date_to))
+            if post['id'] not in in_memory
+        ]
+        channel_posts = sorted(stored + list(in_memory.values()), key=lambda post: post['date'])
+        log.info(f"Канал {channel}: из памяти {len(in_memory)}, из хранилища {len(stored)}")
+        if channel_posts:
+            yield channel, channel_posts
+
+async def run_pipeline(
+    client,
+    channel_ids: List[str],
+    days: int = 1,
+    fetch_concurrency: int = 5,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rpm: Optional[int] = DEFAULT_RPM,
+    tpm: Optional[int] = DEFAULT_TPM,
+    pack_tokens: int = 0,
+    links: bool = False,
+    run_id: Optional[str] = None,
+) -> Tuple[Dict[str, List[dict]], datetime, datetime]:
+    """
+    Подключается к Telegram один раз, загружает и суммаризирует посты.
+    links=True — затем загружает и суммаризирует ссылки из загруженных постов (см. links.py).
+    run_id — запуск, в который записываются метрики (см. metrics.tracked_run).
+    Возвращает посты по каналам и период дайджеста [date_from, date_to).
+    """
+    date_to = datetime.now(timezone.utc)
+    date_from = date_to - timedelta(days=days)
+    await client.connect()
+    try:
+        fetched = await fetch_and_summarize(
+            client, channel_ids, days, fetch_concurrency, concurrency, rpm, tpm, pack_tokens, run_id=run_id
+        )
+    finally:
+        await client.disconnect()
+    if links:
+        from telegram_digest.links import collect_urls, enrich_links
+
+        # Ссылка из нескольких каналов загружается и суммаризируется один раз
+        urls = collect_urls(post for posts in fetched.values() for post in posts)
+        await enrich_links(urls, summarize=True)
+    return fetched, date_from, date_to
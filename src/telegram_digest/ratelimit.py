@@ -0,0 +1,35 @@
+import asyncio
+import time
+from typing import Optional
+
+class TokenBucket:
+    """
+    Асинхронное «ведро токенов»: не более rate единиц за period секунд.
+    Используется для ограничения запросов и токенов в минуту.
+    rate = 0 или None — без ограничений.
+    """
+    def __init__(self, rate: Optional[float], period: float = 60.0):
+        self.capacity = rate or 0
+        self.tokens = self.capacity
+        self.fill_rate = self.capacity / period if self.capacity else 0
+        self.updated = time.monotonic()
+        # Lock создаем лениво: он должен принадлежать работающему event loop
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Ждет, пока в ведре наберется amount единиц, и забирает их."""
+        if not self.capacity:
+            return
+        # Запрос больше емкости ведра иначе не выполнился бы никогда
+        amount = min(amount, self.capacity)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.fill_rate)
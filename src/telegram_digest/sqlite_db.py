@@ -0,0 +1,473 @@
+import os
+import json
+import uuid
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Iterator
+from dotenv import load_dotenv
+from telegram_digest.models import is_valid_post, post_doc_id, link_doc_id
+
+# Загружаем переменные окружения
+load_dotenv()
+
+DEFAULT_DB_PATH = "./storage/telegram-digest.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id TEXT PRIMARY KEY,
+    msg_id INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    date TEXT NOT NULL,
+    text_html TEXT,
+    plain_text TEXT,
+    summary TEXT,
+    entities TEXT NOT NULL DEFAULT '[]',
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_posts_channel_date ON posts(channel, date);
+CREATE INDEX IF NOT EXISTS idx_posts_no_summary ON posts(date) WHERE summary IS NULL;
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    ended_at TEXT,
+    period_days INTEGER,
+    status TEXT NOT NULL,
+    metrics TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs(started_at);
+CREATE TABLE IF NOT EXISTS channel_state (
+    channel TEXT PRIMARY KEY,
+    last_seen_msg_id INTEGER NOT NULL,
+    covered_from TEXT,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channel_meta (
+    channel TEXT PRIMARY KEY,
+    peer_id INTEGER NOT NULL,
+    access_hash INTEGER NOT NULL,
+    title TEXT,
+    username TEXT,
+    resolved_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    final_url TEXT,
+    status INTEGER,
+    content_type TEXT,
+    title TEXT,
+    text TEXT,
+    summary TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    error TEXT,
+    fetched_at TEXT NOT NULL
+);
+"""
+
+# Соединение SQLite нельзя делить между потоками, а fetcher пишет из asyncio.to_thread
+_local = threading.local()
+
+def get_db_path() -> str:
+    return os.getenv("SQLITE_DB_PATH", DEFAULT_DB_PATH)
+
+def get_connection() -> sqlite3.Connection:
+    """Возвращает соединение текущего потока, при первом вызове создает схему."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        path = get_db_path()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        # WAL: читатели не блокируют писателя, запись дешевле
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _add_missing_columns(conn)
+        _local.conn = conn
+    return conn
+
+# Колонки, появившиеся после первой версии схемы: в старых базах их добавляем ALTER TABLE
+ADDED_COLUMNS = [
+    ('runs', 'metrics', 'TEXT'),
+]
+
+def _add_missing_columns(conn: sqlite3.Connection) -> None:
+    for table, column, declaration in ADDED_COLUMNS:
+        existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+def _to_db_date(value: datetime) -> str:
+    """Даты храним строкой ISO 8601 в UTC — так они сортируются лексикографически."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec='microseconds')
+
+def _from_db_date(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+def _now() -> str:
+    return _to_db_date(datetime.now(timezone.utc))
+
+def _row_to_post(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        'id': row['id'],
+        'msg_id': row['msg_id'],
+        'channel': row['channel'],
+        'date': _from_db_date(row['date']),
+        'text_html': row['text_html'],
+        'plain_text': row['plain_text'],
+        'summary': row['summary'],
+        'entities': json.loads(row['entities']),
+        'updated_at': _from_db_date(row['updated_at']),
+    }
+
+def upsert_post(
+    msg_id: int,
+    channel_id: str,
+    date: datetime,
+    text_html: str,
+    plain_text: Optional[str],
+    summary: Optional[str] = None,
+    entities: Optional[List[Dict[str, Any]]] = None,
+) -> bool:
+    """Добавляет пост. Возвращает True, если добавлен, иначе False."""
+    return upsert_posts([{
+        'msg_id': msg_id,
+        'channel_id': channel_id,
+        'date': date,
+        'text_html': text_html,
+        'plain_text': plain_text,
+        'summary': summary,
+        'entities': entities,
+    }])[0]
+
+def upsert_posts(posts: List[Dict[str, Any]]) -> List[bool]:
+    """
+    Пакетно добавляет посты одной транзакцией (INSERT OR IGNORE).
+    Возвращает список того же размера: True — пост добавлен, False — пропущен.
+    """
+    results = [False] * len(posts)
+    conn = get_connection()
+    now = _now()
+    with conn:
+        for i, post in enumerate(posts):
+            if not is_valid_post(post):
+                continue
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO posts "
+                "(id, msg_id, channel, date, text_html, plain_text, summary, entities, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    post_doc_id(post['channel_id'], post['msg_id']),
+                    post['msg_id'],
+                    post['channel_id'],
+                    _to_db_date(post['date']),
+                    post.get('text_html'),
+                    post['plain_text'],
+                    post.get('summary'),
+                    json.dumps(post.get('entities') or [], ensure_ascii=False),
+                    now,
+                )
+            )
+            results[i] = cursor.rowcount == 1
+    return results
+
+def update_posts(posts: List[Dict[str, Any]]) -> List[bool]:
+    """
+    Сохраняет отредактированные посты, создавая отсутствующие.
+    Если текст изменился, summary сбрасывается. Возвращает True для постов с новым текстом.
+    """
+    results = [False] * len(posts)
+    conn = get_connection()
+    now = _now()
+    with conn:
+        for i, post in enumerate(posts):
+            if not is_valid_post(post):
+                continue
+            doc_id = post_doc_id(post['channel_id'], post['msg_id'])
+            row = conn.execute("SELECT plain_text FROM posts WHERE id = ?", (doc_id,)).fetchone()
+            changed = row is None or row['plain_text'] != post['plain_text']
+            conn.execute(
+                "INSERT INTO posts "
+                "(id, msg_id, channel, date, text_html, plain_text, summary, entities, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET text_html = excluded.text_html, "
+                "plain_text = excluded.plain_text, entities = excluded.entities, "
+                "updated_at = excluded.updated_at, "
+                "summary = CASE WHEN ? THEN NULL ELSE posts.summary END",
+                (
+                    doc_id,
+                    post['msg_id'],
+                    post['channel_id'],
+                    _to_db_date(post['date']),
+                    post.get('text_html'),
+                    post['plain_text'],
+                    json.dumps(post.get('entities') or [], ensure_ascii=False),
+                    now,
+                    changed,
+                )
+            )
+            results[i] = changed
+    return results
+
+def get_posts(
+    channel_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: int = 10
+) -> List[Dict[str, Any]]:
+    """Получает посты из канала за указанный период (новые первыми)."""
+    sql = "SELECT * FROM posts WHERE channel = ?"
+    params: List[Any] = [channel_id]
+    if start_date:
+        sql += " AND date >= ?"
+        params.append(_to_db_date(start_date))
+    if end_date:
+        sql += " AND date <= ?"
+        params.append(_to_db_date(end_date))
+    sql += " ORDER BY date DESC LIMIT ?"
+    params.append(limit)
+    return [_row_to_post(row) for row in get_connection().execute(sql, params)]
+
+def iter_digest_posts(
+    channel_id: str,
+    date_from: datetime,
+    date_to: datetime,
+    page_size: int = 300
+) -> Iterator[Dict[str, Any]]:
+    """Итерирует посты канала с date_from <= date < date_to и заполненным summary, от старых к новым."""
+    cursor = get_connection().execute(
+        "SELECT * FROM posts WHERE channel = ? AND date >= ? AND date < ? AND summary IS NOT NULL "
+        "ORDER BY date",
+        (channel_id, _to_db_date(date_from), _to_db_date(date_to))
+    )
+    while True:
+        rows = cursor.fetchmany(page_size)
+        if not rows:
+            return
+        for row in rows:
+            yield _row_to_post(row)
+
+def get_posts_without_summary(limit: int = 50) -> List[Dict[str, Any]]:
+    """Возвращает посты без summary; id документа кладется в поле 'id'."""
+    rows = get_connection().execute(
+        "SELECT * FROM posts WHERE summary IS NULL ORDER BY date LIMIT ?", (limit,)
+    )
+    return [_row_to_post(row) for row in rows]
+
+def get_posts_by_ids(doc_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Читает посты по id: {id: пост}, отсутствующие пропускаются. fields не используется — строки дешевые."""
+    conn = get_connection()
+    posts = {}
+    # SQLite ограничивает число параметров запроса
+    for start in range(0, len(doc_ids), 500):
+        chunk = doc_ids[start:start + 500]
+        rows = conn.execute(
+            f"SELECT * FROM posts WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+        )
+        for row in rows:
+            posts[row['id']] = _row_to_post(row)
+    return posts
+
+def save_summaries(summaries: Dict[str, str]) -> None:
+    """Сохраняет summary одной транзакцией: {id поста: summary}."""
+    conn = get_connection()
+    now = _now()
+    with conn:
+        conn.executemany(
+            "UPDATE posts SET summary = ?, updated_at = ? WHERE id = ?",
+            [(summary, now, doc_id) for doc_id, summary in summaries.items()]
+        )
+
+def get_channel_state(channel_id: str) -> Dict[str, Any]:
+    """
+    Возвращает состояние канала или пустой словарь: отметку загрузки
+    (last_seen_msg_id, covered_from) и кэш метаданных (peer_id, access_hash, title, username, resolved_at).
+    """
+    conn = get_connection()
+    state: Dict[str, Any] = {}
+    row = conn.execute("SELECT * FROM channel_state WHERE channel = ?", (channel_id,)).fetchone()
+    if row is not None:
+        state.update({
+            'last_seen_msg_id': row['last_seen_msg_id'],
+            'covered_from': _from_db_date(row['covered_from']),
+            'updated_at': _from_db_date(row['updated_at']),
+        })
+    row = conn.execute("SELECT * FROM channel_meta WHERE channel = ?", (channel_id,)).fetchone()
+    if row is not None:
+        state.update({
+            'peer_id': row['peer_id'],
+            'access_hash': row['access_hash'],
+            'title': row['title'],
+            'username': row['username'],
+            'resolved_at': _from_db_date(row['resolved_at']),
+        })
+    return state
+
+def update_channel_state(channel_id: str, last_seen_msg_id: int, covered_from: datetime) -> None:
+    """Сохраняет отметку последнего загруженного сообщения канала."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO channel_state (channel, last_seen_msg_id, covered_from, updated_at) "
+            "VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(channel) DO UPDATE SET last_seen_msg_id = excluded.last_seen_msg_id, "
+            "covered_from = excluded.covered_from, updated_at = excluded.updated_at",
+            (channel_id, last_seen_msg_id, _to_db_date(covered_from), _now())
+        )
+
+def update_channel_meta(channel_id: str, peer_id: int, access_hash: int, title: str, username: Optional[str]) -> None:
+    """Кэширует разрешенный канал, чтобы не вызывать get_entity при каждой загрузке."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO channel_meta (channel, peer_id, access_hash, title, username, resolved_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (channel_id, peer_id, access_hash, title, username, _now())
+        )
+
+LINK_FIELDS = ('url', 'final_url', 'status', 'content_type', 'title', 'text', 'summary',
+               'etag', 'last_modified', 'error', 'fetched_at')
+
+def get_links(urls: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Возвращает сохраненные ссылки по нормализованным URL: {url: запись}."""
+    conn = get_connection()
+    links = {}
+    for start in range(0, len(urls), 500):
+        chunk = [link_doc_id(url) for url in urls[start:start + 500]]
+        rows = conn.execute(f"SELECT * FROM links WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+        for row in rows:
+            link = {field: row[field] for field in LINK_FIELDS}
+            link['fetched_at'] = _from_db_date(link['fetched_at'])
+            links[link['url']] = link
+    return links
+
+def save_links(links: List[Dict[str, Any]]) -> None:
+    """Сохраняет записи ссылок целиком (ключ — нормализованный URL в поле url)."""
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO links (id, {', '.join(LINK_FIELDS)}) "
+            f"VALUES ({', '.join('?' * (len(LINK_FIELDS) + 1))})",
+            [
+                (link_doc_id(link['url']),) + tuple(
+                    _to_db_date(link['fetched_at']) if field == 'fetched_at' else link.get(field)
+                    for field in LINK_FIELDS
+                )
+                for link in links
+            ]
+        )
+
+def count_posts(channel_id: Optional[str] = None, before: Optional[datetime] = None) -> int:
+    """Число постов (канала, с датой раньше before)."""
+    conditions, params = [], []
+    if channel_id is not None:
+        conditions.append("channel = ?")
+        params.append(channel_id)
+    if before is not None:
+        conditions.append("date < ?")
+        params.append(_to_db_date(before))
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return get_connection().execute(f"SELECT COUNT(*) FROM posts{where}", params).fetchone()[0]
+
+# Поля постов, которые можно запросить в iter_post_pages
+POST_FIELDS = ('msg_id', 'channel', 'date', 'text_html', 'plain_text', 'summary', 'entities', 'updated_at')
+
+def iter_post_pages(
+    fields: List[str],
+    page_size: int = 500,
+    start_after: Optional[str] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Обходит все посты страницами в порядке id, читая только поля fields.
+    Каждый пост — {'id': ..., поле: значение}; start_after — id последнего обработанного поста.
+    """
+    unknown = set(fields) - set(POST_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown post fields: {', '.join(sorted(unknown))}")
+    conn = get_connection()
+    columns = ", ".join(("id",) + tuple(fields))
+    cursor = start_after
+    while True:
+        if cursor is None:
+            rows = conn.execute(f"SELECT {columns} FROM posts ORDER BY id LIMIT ?", (page_size,)).fetchall()
+        else:
+            rows = conn.execute(
+                f"SELECT {columns} FROM posts WHERE id > ? ORDER BY id LIMIT ?", (cursor, page_size)
+            ).fetchall()
+        page = []
+        for row in rows:
+            post = {'id': row['id']}
+            for field in fields:
+                value = row[field]
+                if field in ('date', 'updated_at'):
+                    value = _from_db_date(value)
+                elif field == 'entities':
+                    value = json.loads(value)
+                post[field] = value
+            page.append(post)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        cursor = page[-1]['id']
+
+def get_post_ids_before(before: datetime, limit: int = 500) -> List[str]:
+    """id постов с датой раньше before (не больше limit)."""
+    rows = get_connection().execute(
+        "SELECT id FROM posts WHERE date < ? LIMIT ?", (_to_db_date(before), limit)
+    )
+    return [row['id'] for row in rows]
+
+def delete_posts(doc_ids: List[str]) -> None:
+    """Удаляет посты по id одной транзакцией."""
+    conn = get_connection()
+    with conn:
+        conn.executemany("DELETE FROM posts WHERE id = ?", [(doc_id,) for doc_id in doc_ids])
+
+def touch_posts(doc_ids: List[str]) -> None:
+    """Проставляет updated_at постам."""
+    conn = get_connection()
+    now = _now()
+    with conn:
+        conn.executemany("UPDATE posts SET updated_at = ? WHERE id = ?", [(now, doc_id) for doc_id in doc_ids])
+
+def start_run(period_days: int) -> str:
+    """Начинает новый run, возвращает его ID."""
+    run_id = uuid.uuid4().hex
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO runs (id, started_at, period_days, status) VALUES (?, ?, ?, 'running')",
+            (run_id, _now(), period_days)
+        )
+    return run_id
+
+def end_run(run_id: str, metrics: Optional[Dict[str, Any]] = None) -> None:
+    """Завершает run, устанавливая ended_at; metrics — JSON-сводка метрик запуска."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE runs SET ended_at = ?, status = 'completed', metrics = ? WHERE id = ?",
+            (_now(), json.dumps(metrics, ensure_ascii=False) if metrics is not None else None, run_id)
+        )
+
+def get_latest_run() -> Optional[Dict[str, Any]]:
+    """Получает информацию о последнем запуске."""
+    row = get_connection().execute(
+        "SELECT * FROM runs ORDER BY started_at DESC LIMIT 1"
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        'started_at': _from_db_date(row['started_at']),
+        'ended_at': _from_db_date(row['ended_at']),
+        'period_days': row['period_days'],
+        'status': row['status'],
+        'metrics': json.loads(row['metrics']) if row['metrics'] else None,
+    }
@@ -0,0 +1,195 @@
+"""
+Единая точка доступа к хранилищу.
+Бэкенд выбирается переменной окружения STORAGE_BACKEND:
+  firestore — Firebase Firestore (по умолчанию), см. firebase_db.py;
+  sqlite    — локальный файл SQLITE_DB_PATH, см. sqlite_db.py.
+Оба модуля реализуют одинаковый набор функций, перечисленных ниже.
+
+Здесь же, в одном месте для обоих бэкендов, считаются метрики хранилища:
+время каждой операции (span "storage", метка op) и число прочитанных
+и записанных документов (счетчики db_reads и db_writes).
+"""
+import os
+from datetime import datetime
+from importlib import import_module
+from types import ModuleType
+from typing import Optional, List, Dict, Any, Iterable, Iterator
+from dotenv import load_dotenv
+from telegram_digest.metrics import inc, span
+
+# Загружаем переменные окружения
+load_dotenv()
+
+BACKENDS = {
+    'firestore': 'telegram_digest.firebase_db',
+    'sqlite': 'telegram_digest.sqlite_db',
+}
+
+_backend: Optional[ModuleType] = None
+
+def get_backend_name() -> str:
+    return os.getenv("STORAGE_BACKEND", "firestore").strip().lower()
+
+def get_backend() -> ModuleType:
+    """Возвращает модуль выбранного бэкенда (импортируется при первом обращении)."""
+    global _backend
+    if _backend is None:
+        name = get_backend_name()
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown STORAGE_BACKEND={name!r}, expected one of: {', '.join(BACKENDS)}")
+        _backend = import_module(BACKENDS[name])
+    return _backend
+
+def _count_reads(op: str, documents: Iterable[Any]) -> Iterator[Any]:
+    """Считает прочитанные документы по мере итерации (для постраничных чтений)."""
+    for document in documents:
+        inc("db_reads", 1 if isinstance(document, dict) else len(document), op=op)
+        yield document
+
+def upsert_post(
+    msg_id: int,
+    channel_id: str,
+    date: datetime,
+    text_html: str,
+    plain_text: Optional[str],
+    summary: Optional[str] = None,
+    entities: Optional[List[Dict[str, Any]]] = None,
+) -> bool:
+    """Добавляет пост. Возвращает True, если добавлен, иначе False."""
+    with span("storage", op="upsert_post"):
+        added = get_backend().upsert_post(msg_id, channel_id, date, text_html, plain_text, summary, entities)
+    inc("db_writes", int(added), op="upsert_post")
+    return added
+
+def upsert_posts(posts: List[Dict[str, Any]]) -> List[bool]:
+    """Пакетно добавляет посты, возвращает флаг добавления для каждого."""
+    with span("storage", op="upsert_posts"):
+        results = get_backend().upsert_posts(posts)
+    inc("db_writes", sum(results), op="upsert_posts")
+    return results
+
+def update_posts(posts: List[Dict[str, Any]]) -> List[bool]:
+    """Сохраняет отредактированные посты; при изменении текста summary сбрасывается."""
+    with span("storage", op="update_posts"):
+        results = get_backend().update_posts(posts)
+    inc("db_writes", len(posts), op="update_posts")
+    return results
+
+def get_posts(
+    channel_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: int = 10
+) -> List[Dict[str, Any]]:
+    """Получает посты из канала за указанный период (новые первыми)."""
+    with span("storage", op="get_posts"):
+        posts = get_backend().get_posts(channel_id, start_date, end_date, limit)
+    inc("db_reads", len(posts), op="get_posts")
+    return posts
+
+def iter_digest_posts(
+    channel_id: str,
+    date_from: datetime,
+    date_to: datetime,
+    page_size: int = 300
+) -> Iterator[Dict[str, Any]]:
+    """Итерирует посты канала за [date_from, date_to) с заполненным summary, от старых к новым."""
+    return _count_reads("iter_digest_posts", get_backend().iter_digest_posts(channel_id, date_from, date_to, page_size))
+
+def get_posts_without_summary(limit: int = 50) -> List[Dict[str, Any]]:
+    """Возвращает посты без summary с полем 'id'."""
+    with span("storage", op="get_posts_without_summary"):
+        posts = get_backend().get_posts_without_summary(limit)
+    inc("db_reads", len(posts), op="get_posts_without_summary")
+    return posts
+
+def get_posts_by_ids(doc_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Читает посты по id: {id: пост}; fields — какие поля нужны (если бэкенд умеет проекцию)."""
+    with span("storage", op="get_posts_by_ids"):
+        posts = get_backend().get_posts_by_ids(doc_ids, fields)
+    inc("db_reads", len(posts), op="get_posts_by_ids")
+    return posts
+
+def save_summaries(summaries: Dict[str, str]) -> None:
+    """Сохраняет summary: {id поста: summary}."""
+    with span("storage", op="save_summaries"):
+        get_backend().save_summaries(summaries)
+    inc("db_writes", len(summaries), op="save_summaries")
+
+def get_channel_state(channel_id: str) -> Dict[str, Any]:
+    """Возвращает состояние загрузки и кэш метаданных канала или пустой словарь."""
+    with span("storage", op="get_channel_state"):
+        state = get_backend().get_channel_state(channel_id)
+    inc("db_reads", 1, op="get_channel_state")
+    return state
+
+def update_channel_state(channel_id: str, last_seen_msg_id: int, covered_from: datetime) -> None:
+    """Сохраняет отметку последнего загруженного сообщения канала."""
+    with span("storage", op="update_channel_state"):
+        get_backend().update_channel_state(channel_id, last_seen_msg_id, covered_from)
+    inc("db_writes", 1, op="update_channel_state")
+
+def update_channel_meta(channel_id: str, peer_id: int, access_hash: int, title: str, username: Optional[str]) -> None:
+    """Кэширует разрешенный канал (peer и access_hash, название, username)."""
+    with span("storage", op="update_channel_meta"):
+        get_backend().update_channel_meta(channel_id, peer_id, access_hash, title, username)
+    inc("db_writes", 1, op="update_channel_meta")
+
+def get_links(urls: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Возвращает сохраненные ссылки по нормализованным URL: {url: запись}."""
+    with span("storage", op="get_links"):
+        links = get_backend().get_links(urls)
+    inc("db_reads", len(links), op="get_links")
+    return links
+
+def save_links(links: List[Dict[str, Any]]) -> None:
+    """Сохраняет записи ссылок (url, final_url, status, title, text, summary, etag, last_modified, ...)."""
+    with span("storage", op="save_links"):
+        get_backend().save_links(links)
+    inc("db_writes", len(links), op="save_links")
+
+def count_posts(channel_id: Optional[str] = None, before: Optional[datetime] = None) -> int:
+    """Число постов (канала, с датой раньше before) без чтения самих постов."""
+    with span("storage", op="count_posts"):
+        count = get_backend().count_posts(channel_id, before)
+    inc("db_aggregations", 1, op="count_posts")
+    return count
+
+def iter_post_pages(
+    fields: List[str],
+    page_size: int = 500,
+    start_after: Optional[str] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """Обходит все посты страницами по id, читая только fields; start_after — курсор (id поста)."""
+    return _count_reads("iter_post_pages", get_backend().iter_post_pages(fields, page_size, start_after))
+
+def get_post_ids_before(before: datetime, limit: int = 500) -> List[str]:
+    """id постов с датой раньше before (не больше limit)."""
+    with span("storage", op="get_post_ids_before"):
+        doc_ids = get_backend().get_post_ids_before(before, limit)
+    inc("db_reads", len(doc_ids), op="get_post_ids_before")
+    return doc_ids
+
+def delete_posts(doc_ids: List[str]) -> None:
+    """Удаляет посты по id пакетами."""
+    with span("storage", op="delete_posts"):
+        get_backend().delete_posts(doc_ids)
+    inc("db_writes", len(doc_ids), op="delete_posts")
+
+def touch_posts(doc_ids: List[str]) -> None:
+    """Проставляет updated_at постам пакетами."""
+    with span("storage", op="touch_posts"):
+        get_backend().touch_posts(doc_ids)
+    inc("db_writes", len(doc_ids), op="touch_posts")
+
+def start_run(period_days: int) -> str:
+    """Начинает новый run, возвращает его ID."""
+    return get_backend().start_run(period_days)
+
+def end_run(run_id: str, metrics: Optional[Dict[str, Any]] = None) -> None:
+    """Завершает run; metrics — JSON-сводка метрик запуска (см. metrics.tracked_run)."""
+    get_backend().end_run(run_id, metrics)
+
+def get_latest_run() -> Optional[Dict[str, Any]]:
+    """Получает информацию о последнем запуске."""
+    return get_backend().get_latest_run()
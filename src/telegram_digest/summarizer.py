@@ -1,58 +1,377 @@
 import os
-import time
-from typing import List, Dict, Any
+import json
+import random
+import asyncio
+from typing import List, Dict, Tuple, Optional, Callable, Awaitable
 import openai
-import typer
-from firebase_admin import firestore
-from telegram_digest.firebase_db import init_firebase
-from google.cloud.firestore_v1.base_query import FieldFilter
+from telegram_digest.metrics import get_logger, inc, span
+from telegram_digest.ratelimit import TokenBucket
+from telegram_digest.storage import get_posts_without_summary, save_summaries
+from telegram_digest.summary_cache import SummaryCache, make_key, DEFAULT_CACHE_PATH, DEFAULT_MAX_ENTRIES
 
-def summarize(batch_size: int = 50) -> int:
+log = get_logger(__name__)
+
+MODEL = "gpt-3.5-turbo"
+SYSTEM_PROMPT = "Сделай краткое саммари этого текста на русском языке (1-2 предложения):"
+# Увеличивать при изменении промпта или параметров генерации — старый кэш перестанет совпадать
+PROMPT_VERSION = 1
+MAX_TOKENS = 100
+
+# Промпт пакетного режима: несколько постов в одном запросе, ответ — JSON по id
+PACK_SYSTEM_PROMPT = (
+    "Для каждого текста ниже сделай краткое саммари на русском языке (1-2 предложения). "
+    "Тексты разделены заголовками вида «### id». "
+    "Ответь только JSON-объектом {\"<id>\": \"<саммари>\"} со всеми id."
+)
+# Больше постов в одном запросе — длиннее ответ и выше риск обрезанного JSON
+PACK_MAX_POSTS = 20
+
+# Сколько саммари копим перед пакетной записью в базу
+WRITE_BATCH_SIZE = 100
+
+# Ограничения по умолчанию (можно переопределить в CLI)
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RPM = 500
+DEFAULT_TPM = 200_000
+MAX_RETRIES = 5
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка токенов запроса: для кириллицы ~2 символа на токен плюс ответ."""
+    return len(SYSTEM_PROMPT + text) // 2 + MAX_TOKENS
+
+def estimate_pack_tokens(texts: List[str]) -> int:
+    """Оценка токенов пакетного запроса: все тексты плюс ответ на каждый."""
+    return (len(PACK_SYSTEM_PROMPT) + sum(len(text) + 10 for text in texts)) // 2 + MAX_TOKENS * len(texts)
+
+def make_packs(items: List[Tuple[str, str]], pack_tokens: int) -> List[List[Tuple[str, str]]]:
+    """Группирует пары (id, текст) в пакеты не дороже pack_tokens и не длиннее PACK_MAX_POSTS."""
+    packs: List[List[Tuple[str, str]]] = []
+    current: List[Tuple[str, str]] = []
+    for item in items:
+        candidate = current + [item]
+        if current and (len(candidate) > PACK_MAX_POSTS
+                        or estimate_pack_tokens([text for _, text in candidate]) > pack_tokens):
+            packs.append(current)
+            candidate = [item]
+        current = candidate
+    if current:
+        packs.append(current)
+    return packs
+
+def parse_pack_reply(content: str, ids: List[str]) -> Dict[str, str]:
+    """
+    Разбирает JSON-ответ пакетного запроса.
+    Возвращает саммари только для известных id с непустой строкой;
+    при некорректном JSON — пустой словарь.
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    summaries = {}
+    for item_id in ids:
+        value = data.get(item_id)
+        if isinstance(value, str) and value.strip():
+            summaries[item_id] = value.strip()
+    return summaries
+
+def _is_retryable(error: Exception) -> bool:
+    """429, 5xx и сетевые ошибки повторяем, остальные — нет."""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Экспоненциальная задержка с «полным» джиттером, с учетом Retry-After."""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, 1)
+            except ValueError:
+                pass
+    return random.uniform(0, min(60.0, 2 ** attempt))
+
+async def summarize_texts(
+    items: List[Tuple[str, str]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rpm: Optional[int] = DEFAULT_RPM,
+    tpm: Optional[int] = DEFAULT_TPM,
+    client: Optional[openai.AsyncOpenAI] = None,
+    on_summary: Optional[Callable[[str, str], Awaitable[None]]] = None,
+    pack_tokens: int = 0,
+    stream: Optional[asyncio.Queue] = None,
+) -> Dict[str, str]:
+    """
+    Асинхронно делает саммари для пар (id, текст), держа до concurrency запросов в работе.
+    Запросы ограничены по количеству (rpm) и токенам (tpm) в минуту,
+    429/5xx повторяются с экспоненциальной задержкой и джиттером.
+    client — клиент OpenAI; по умолчанию создается из OPENAI_API_KEY/OPENAI_BASE_URL,
+    так что движок можно направить на локальный stub-сервер.
+    on_summary вызывается для каждого готового саммари.
+    pack_tokens > 0 включает пакетный режим: несколько текстов в одном запросе
+    с JSON-ответом; если ответ некорректен, пакет делится пополам и повторяется.
+    stream — очередь, из которой поступают новые списки пар (id, текст) в дополнение к items;
+    None в очереди означает конец потока. Лимиты общие для всех поступивших текстов.
+    Возвращает {id: summary} для успешно обработанных текстов.
+    """
+    if client is None:
+        # Повторы делаем сами, с учетом лимитов, поэтому встроенные отключаем
+        client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    requests_bucket = TokenBucket(rpm)
+    tokens_bucket = TokenBucket(tpm)
+    queue: asyncio.Queue = asyncio.Queue()
+    results: Dict[str, str] = {}
+
+    def enqueue(batch: List[Tuple[str, str]]) -> None:
+        packs = make_packs(batch, pack_tokens) if pack_tokens > 0 else [[item] for item in batch]
+        for pack in packs:
+            queue.put_nowait(pack)
+
+    async def request_completion(messages: List[Dict[str, str]], tokens: int, max_tokens: int, **kwargs) -> str:
+        for attempt in range(MAX_RETRIES + 1):
+            await requests_bucket.acquire()
+            await tokens_bucket.acquire(tokens)
+            inc("openai_requests")
+            try:
+                with span("openai_request"):
+                    response = await client.chat.completions.create(
+                        model=MODEL,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=0.5,
+                        **kwargs
+                    )
+                usage = getattr(response, 'usage', None)
+                if usage is not None:
+                    inc("openai_tokens", usage.prompt_tokens or 0, kind="prompt")
+                    inc("openai_tokens", usage.completion_tokens or 0, kind="completion")
+                return (response.choices[0].message.content or "").strip()
+            except Exception as e:
+                if attempt == MAX_RETRIES or not _is_retryable(e):
+                    inc("openai_errors")
+                    raise
+                inc("openai_retries")
+                delay = _retry_delay(e, attempt)
+                log.info(f"Повтор запроса через {delay:.1f} с: {e}")
+                await asyncio.sleep(delay)
+
+    async def request_summary(text: str) -> str:
+        return await request_completion(
+            [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": text}
+            ],
+            estimate_tokens(text),
+            MAX_TOKENS
+        )
+
+    async def request_pack(pack: List[Tuple[str, str]]) -> Dict[str, str]:
+        # Внутри запроса используем короткие id, чтобы не тратить токены на ключи кэша
+        local_ids = [str(i + 1) for i in range(len(pack))]
+        content = "\n\n".join(f"### {local_id}\n{text}" for local_id, (_, text) in zip(local_ids, pack))
+        reply = await request_completion(
+            [
+                {"role": "system", "content": PACK_SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            estimate_pack_tokens([text for _, text in pack]),
+            MAX_TOKENS * len(pack),
+            response_format={"type": "json_object"}
+        )
+        parsed = parse_pack_reply(reply, local_ids)
+        return {item_id: parsed[local_id] for local_id, (item_id, _) in zip(local_ids, pack) if local_id in parsed}
+
+    async def handle(pack: List[Tuple[str, str]]) -> Dict[str, str]:
+        if len(pack) == 1:
+            item_id, text = pack[0]
+            return {item_id: await request_summary(text)}
+        summaries = await request_pack(pack)
+        missing = [item for item in pack if item[0] not in summaries]
+        if missing:
+            # Ответ некорректен или неполон: оставшиеся тексты повторяем меньшими пакетами
+            log.warning(f"Пакетный ответ без {len(missing)} из {len(pack)} саммари, делим пакет")
+            middle = (len(missing) + 1) // 2
+            for part in (missing[:middle], missing[middle:]):
+                if part:
+                    queue.put_nowait(part)
+        return summaries
+
+    async def worker() -> None:
+        while True:
+            pack = await queue.get()
+            try:
+                try:
+                    summaries = await handle(pack)
+                except Exception as e:
+                    log.error(f"Ошибка при обработке сообщений {', '.join(item_id for item_id, _ in pack)}: {e}")
+                    continue
+                for item_id, summary in summaries.items():
+                    results[item_id] = summary
+                    if on_summary is not None:
+                        await on_summary(item_id, summary)
+            finally:
+                # Части разделенного пакета попадают в очередь раньше, чем родитель отмечен готовым
+                queue.task_done()
+
+    async def feed() -> None:
+        enqueue(items)
+        if stream is not None:
+            while True:
+                batch = await stream.get()
+                if batch is None:
+                    break
+                enqueue(batch)
+        await queue.join()
+
+    feeder = asyncio.ensure_future(feed())
+    workers = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))]
+    try:
+        # feed завершается, когда все пакеты обработаны; воркер — только с ошибкой
+        done, _ = await asyncio.wait([feeder, *workers], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in [feeder, *workers]:
+            task.cancel()
+        await asyncio.gather(feeder, *workers, return_exceptions=True)
+    return results
+
+def _plan_summaries(
+    docs: List[dict],
+    cache: SummaryCache,
+    ready: Dict[str, str],
+    doc_ids_by_key: Dict[str, List[str]]
+) -> List[Tuple[str, str]]:
+    """
+    Раскладывает посты (с полями id и plain_text): короткие и найденные в кэше
+    сразу попадают в ready, остальные возвращаются парами (ключ кэша, текст) для OpenAI.
+    Одинаковые тексты отправляются один раз: doc_ids_by_key — ключ -> id ожидающих постов.
+    """
+    items: List[Tuple[str, str]] = []
+    for data in docs:
+        plain = data.get('plain_text') or ""
+        if not plain.strip():
+            log.debug(f"Пропускаем {data['id']}: пустой plain_text")
+            continue
+        word_count = len(plain.split())
+        if word_count < 5:
+            log.debug(f"Пропускаем {data['id']}: слишком короткий текст (слов: {word_count})")
+            continue
+        if word_count < 50:
+            # Короткий текст помечаем как обработанный (summary='')
+            ready[data['id']] = ""
+            continue
+        key = make_key(plain, MODEL, PROMPT_VERSION)
+        if key in doc_ids_by_key:
+            # Повтор текста в этом же запуске — тоже попадание: запроса к OpenAI не будет
+            cache.hits += 1
+            doc_ids_by_key[key].append(data['id'])
+            continue
+        cached = cache.get(key)
+        if cached is not None:
+            ready[data['id']] = cached
+            continue
+        doc_ids_by_key[key] = [data['id']]
+        items.append((key, plain))
+    return items
+
+async def summarize_stream(
+    posts: asyncio.Queue,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rpm: Optional[int] = DEFAULT_RPM,
+    tpm: Optional[int] = DEFAULT_TPM,
+    cache_path: str = DEFAULT_CACHE_PATH,
+    cache_size: int = DEFAULT_MAX_ENTRIES,
+    pack_tokens: int = 0,
+    client: Optional[openai.AsyncOpenAI] = None,
+) -> Dict[str, str]:
     """
-    Генерирует саммари для сообщений без дайджеста в коллекции messages.
+    Делает саммари для постов, поступающих в очередь списками (None — конец потока):
+    запросы к OpenAI идут, пока очередь еще пополняется. Саммари пишутся в хранилище
+    пакетами по WRITE_BATCH_SIZE. Возвращает {id поста: summary} для всех обработанных постов.
+    """
+    cache = SummaryCache(cache_path, cache_size)
+    resolved: Dict[str, str] = {}
+    pending: Dict[str, str] = {}
+    doc_ids_by_key: Dict[str, List[str]] = {}
+    stream: asyncio.Queue = asyncio.Queue()
+    requested = 0
+    ready_count = 0
+
+    async def save(ready: Dict[str, str], force: bool = False) -> None:
+        resolved.update(ready)
+        pending.update(ready)
+        if pending and (force or len(pending) >= WRITE_BATCH_SIZE):
+            batch = dict(pending)
+            pending.clear()
+            await asyncio.to_thread(save_summaries, batch)
+
+    async def feed() -> None:
+        nonlocal requested, ready_count
+        while True:
+            docs = await posts.get()
+            if docs is None:
+                break
+            ready: Dict[str, str] = {}
+            items = _plan_summaries(docs, cache, ready, doc_ids_by_key)
+            requested += len(items)
+            ready_count += len(ready)
+            if items:
+                stream.put_nowait(items)
+            await save(ready)
+        stream.put_nowait(None)
+
+    async def on_summary(key: str, summary: str) -> None:
+        cache.put(key, summary)
+        # Ключ убираем: тот же текст, пришедший позже, найдется в кэше
+        await save({doc_id: summary for doc_id in doc_ids_by_key.pop(key)})
+
+    try:
+        await asyncio.gather(
+            feed(),
+            summarize_texts([], concurrency, rpm, tpm, client, on_summary, pack_tokens, stream)
+        )
+        await save({}, force=True)
+    finally:
+        cache.close()
+    inc("cache_hits", cache.hits, cache="summary")
+    inc("cache_misses", cache.misses, cache="summary")
+    inc("summaries", len(resolved))
+    log.info(f"Отправлено в OpenAI: {requested}, готово без запроса: {ready_count}")
+    log.info(f"Кэш саммари: попаданий {cache.hits}, промахов {cache.misses}")
+    return resolved
+
+def summarize(
+    batch_size: int = 50,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rpm: Optional[int] = DEFAULT_RPM,
+    tpm: Optional[int] = DEFAULT_TPM,
+    cache_path: str = DEFAULT_CACHE_PATH,
+    cache_size: int = DEFAULT_MAX_ENTRIES,
+    pack_tokens: int = 0,
+) -> int:
+    """
+    Генерирует саммари для сообщений без дайджеста в хранилище.
     batch_size: сколько документов обработать за один запуск
+    concurrency, rpm, tpm: параллельность и лимиты запросов к OpenAI
+    cache_path, cache_size: файл и размер кэша саммари по хэшу текста
+    pack_tokens: бюджет токенов пакетного запроса (0 — по одному посту на запрос)
     """
-    db = init_firebase()
-    messages_ref = db.collection('messages')
-    # Новый синтаксис фильтрации
-    query = messages_ref.where(filter=FieldFilter('summary', '==', None)).limit(batch_size)
-    docs = list(query.stream())
-    print(f"Найдено {len(docs)} сообщений без summary")
-    processed_count = 0
-    for doc in docs:
-        try:
-            data = doc.to_dict()
-            plain = data.get('plain_text') or ""
-            print(f"\nСообщение {doc.id}: plain_text длина={len(plain)}")
-            if not plain.strip():
-                print("Пропускаем: пустой plain_text")
-                continue
-            word_count = len(plain.split())
-            if word_count < 5:
-                print(f"Пропускаем: слишком короткий текст (слов: {word_count})")
-                continue
-            if word_count < 50:
-                print(f"Текст слишком короткий для summary (слов: {word_count}), помечаем как обработанный (summary='')")
-                doc.reference.update({"summary": ""})
-                processed_count += 1
-                continue
-            print(f"Отправляем в OpenAI: {plain[:200]}{'...' if len(plain) > 200 else ''}")
-            openai.api_key = os.getenv("OPENAI_API_KEY")
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Сделай краткое саммари этого текста на русском языке (1-2 предложения):"},
-                    {"role": "user", "content": plain}
-                ],
-                max_tokens=100,
-                temperature=0.5
-            )
-            summary = response.choices[0].message.content.strip()
-            print(f"Получено summary: {summary}")
-            doc.reference.update({"summary": summary})
-            print(f"Сохранено summary для сообщения {doc.id}")
-            processed_count += 1
-        except Exception as e:
-            print(f"Ошибка при обработке сообщения {doc.id}: {e}")
-    print(f"Всего обработано: {processed_count}")
-    return processed_count 
\ No newline at end of file
+    docs = get_posts_without_summary(batch_size)
+    log.info(f"Найдено {len(docs)} сообщений без summary")
+
+    async def run() -> Dict[str, str]:
+        posts: asyncio.Queue = asyncio.Queue()
+        posts.put_nowait(docs)
+        posts.put_nowait(None)
+        return await summarize_stream(posts, concurrency, rpm, tpm, cache_path, cache_size, pack_tokens)
+
+    processed_count = len(asyncio.run(run()))
+    log.info(f"Всего обработано: {processed_count}")
+    return processed_count
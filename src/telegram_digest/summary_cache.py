@@ -0,0 +1,80 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import unicodedata
+from typing import Optional
+
+DEFAULT_CACHE_PATH = "./storage/summary_cache.db"
+DEFAULT_MAX_ENTRIES = 100_000
+
+# Вытесняем старые записи не на каждой вставке, а раз в EVICT_EVERY вставок
+EVICT_EVERY = 100
+
+def normalize_text(text: str) -> str:
+    """Нормализует текст для ключа кэша: Unicode NFKC, схлопнутые пробелы, без краев."""
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+def make_key(text: str, model: str, prompt_version: int) -> str:
+    """Ключ кэша: SHA-256 от модели, версии промпта и нормализованного текста."""
+    payload = f"{model}\0{prompt_version}\0{normalize_text(text)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class SummaryCache:
+    """
+    Локальный кэш саммари в SQLite с вытеснением по LRU.
+    Репосты и одинаковые тексты в разных каналах получают саммари из кэша,
+    без повторного запроса к OpenAI.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT PRIMARY KEY, summary TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_last_used ON summaries(last_used)")
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает саммари по ключу или None и обновляет время использования."""
+        row = self.conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE summaries SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key: str, summary: str) -> None:
+        """Сохраняет саммари в кэш."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO summaries (key, summary, last_used) VALUES (?, ?, ?)",
+            (key, summary, time.time())
+        )
+        self.conn.commit()
+        self._puts += 1
+        if self._puts % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self) -> None:
+        """Удаляет давно не использованные записи сверх max_entries."""
+        self.conn.execute(
+            "DELETE FROM summaries WHERE key IN ("
+            "SELECT key FROM summaries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.evict()
+        self.conn.close()
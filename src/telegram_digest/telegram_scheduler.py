@@ -0,0 +1,91 @@
+"""
+Единая точка запросов к Telegram с учетом FloodWait.
+
+Telegram ограничивает запросы по классам методов: разрешение каналов
+(ResolveUsername/get_entity) режется намного жестче, чем чтение истории.
+Поэтому у каждого класса свое ведро токенов, а после FloodWaitError
+на время ожидания приостанавливается весь класс: повторные запросы
+в это время только продлили бы блокировку.
+"""
+import time
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+from telethon.errors import FloodWaitError
+from telegram_digest.metrics import inc, span
+from telegram_digest.ratelimit import TokenBucket
+
+# Классы методов
+RESOLVE = "resolve"
+HISTORY = "history"
+
+# Запросов в минуту по умолчанию для каждого класса
+DEFAULT_LIMITS = {
+    RESOLVE: 20,
+    HISTORY: 300,
+}
+
+class TelegramScheduler:
+    """Ограничивает запросы по классам методов и ведет статистику FloodWait."""
+
+    def __init__(self, client, limits: Optional[Dict[str, float]] = None):
+        self.client = client
+        # Все FloodWait обрабатываем сами: иначе Telethon молча спит на коротких ожиданиях
+        # и они не попадают ни в паузу класса, ни в статистику
+        self.client.flood_sleep_threshold = 0
+        self.buckets = {kind: TokenBucket(rate) for kind, rate in (limits or DEFAULT_LIMITS).items()}
+        # Класс методов -> time.monotonic(), до которого запросы этого класса не отправляем
+        self.paused_until: Dict[str, float] = {}
+        self.requests: Counter = Counter()
+        self.flood_waits: Counter = Counter()
+        self.flood_wait_seconds: Counter = Counter()
+        self.max_flood_wait = 0
+
+    async def call(self, kind: str, request: Union[Any, Callable[[], Awaitable[Any]]]) -> Any:
+        """
+        Выполняет запрос класса kind: TL-запрос (client(request)) или функцию без аргументов,
+        возвращающую корутину (например, lambda: client.get_entity(...)).
+        При FloodWaitError ставит класс на паузу и пробрасывает ошибку —
+        вызывающий решает, вернуть ли работу в очередь.
+        """
+        while True:
+            delay = self.paused_until.get(kind, 0) - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        bucket = self.buckets.get(kind)
+        if bucket is not None:
+            await bucket.acquire()
+        self.requests[kind] += 1
+        inc("telegram_requests", kind=kind)
+        try:
+            with span("telegram_request", kind=kind):
+                if callable(request):
+                    return await request()
+                return await self.client(request)
+        except FloodWaitError as e:
+            inc("telegram_flood_waits", kind=kind)
+            inc("telegram_flood_wait_seconds", e.seconds, kind=kind)
+            self.flood_waits[kind] += 1
+            self.flood_wait_seconds[kind] += e.seconds
+            self.max_flood_wait = max(self.max_flood_wait, e.seconds)
+            self.paused_until[kind] = max(self.paused_until.get(kind, 0), time.monotonic() + e.seconds)
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'requests': dict(self.requests),
+            'flood_waits': dict(self.flood_waits),
+            'flood_wait_seconds': dict(self.flood_wait_seconds),
+            'max_flood_wait': self.max_flood_wait,
+        }
+
+    def stats_line(self) -> str:
+        requests = ", ".join(f"{kind} {count}" for kind, count in sorted(self.requests.items())) or "нет"
+        line = f"Запросы к Telegram: {requests}"
+        if self.flood_waits:
+            waits = ", ".join(
+                f"{kind} {count} ({self.flood_wait_seconds[kind]} с)" for kind, count in sorted(self.flood_waits.items())
+            )
+            line += f"; FloodWait: {waits}, максимум {self.max_flood_wait} с"
+        return line
@@ -0,0 +1,14 @@
+import threading
+
+import pytest
+
+from telegram_digest import sqlite_db, storage
+
+@pytest.fixture
+def sqlite_storage(tmp_path, monkeypatch):
+    """Хранилище — отдельная SQLite-база теста."""
+    monkeypatch.setenv("STORAGE_BACKEND", "sqlite")
+    monkeypatch.setenv("SQLITE_DB_PATH", str(tmp_path / "digest.db"))
+    monkeypatch.setattr(storage, "_backend", None)
+    # Соединения кэшируются по потокам — сбрасываем, чтобы каждый тест получил свою базу
+    monkeypatch.setattr(sqlite_db, "_local", threading.local())
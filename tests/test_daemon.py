@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+from telegram_digest import daemon
+
+class FakeClient:
+    def __init__(self):
+        self.connected = False
+
+    async def connect(self):
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+async def http_get(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    response = (await reader.read()).decode("utf-8")
+    writer.close()
+    head, body = response.split("\r\n\r\n", 1)
+    return head.split("\r\n")[0], body
+
+def test_daemon_fetches_due_channels_and_serves_metrics(monkeypatch):
+    calls = []
+
+    async def fake_fetch_and_summarize(client, channels, *args, to_summarize=None, summary_client=None):
+        calls.append(list(channels))
+        to_summarize.put_nowait(["post"])
+        return {channel: [{'id': f"{channel}_1"}] for channel in channels}
+
+    monkeypatch.setattr(daemon, "fetch_and_summarize", fake_fetch_and_summarize)
+    backlog = [{'id': "@fast_0", 'plain_text': "пост, оставшийся без саммари после сбоя"}]
+    monkeypatch.setattr(daemon, "get_posts_without_summary", lambda limit: [backlog.pop()] if backlog else [])
+
+    async def fake_summarize_stream(queue, *args, **kwargs):
+        posts = await queue.get()
+        assert await queue.get() is None
+        return {post['id']: "саммари" for post in posts}
+
+    monkeypatch.setattr(daemon, "summarize_stream", fake_summarize_stream)
+    digest_daemon = daemon.DigestDaemon(
+        FakeClient(), {"@fast": 1, "@slow": 60}, port=0, tick_seconds=0.01, summary_client=object()
+    )
+
+    async def scenario():
+        task = asyncio.ensure_future(digest_daemon.run())
+        while not digest_daemon.stats['backlog_summaries']:
+            await asyncio.sleep(0.01)
+        health = await http_get(digest_daemon.port, "/health")
+        metrics = await http_get(digest_daemon.port, "/metrics")
+        digest_daemon.stopping.set()
+        await task
+        return health, metrics
+
+    (health_status, health_body), (_, metrics_body) = asyncio.run(scenario())
+
+    # Оба канала загружаются сразу, затем каждый — по своему интервалу
+    assert calls == [["@fast", "@slow"]]
+    assert digest_daemon.next_fetch["@slow"] - digest_daemon.next_fetch["@fast"] > 3500
+    assert health_status == "HTTP/1.1 200 OK"
+    health = json.loads(health_body)
+    assert health['status'] == "ok" and health['posts_fetched'] == 2
+    assert 'telegram_digest_channel_lag_seconds{channel="@fast"}' in metrics_body
+    assert "telegram_digest_fetch_ticks_total 1" in metrics_body
+    # Пост без summary из прошлых тиков досуммаризирован после загрузки
+    assert health['backlog_summaries'] == 1
+    assert "telegram_digest_backlog_summaries_total 1" in metrics_body
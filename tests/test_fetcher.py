@@ -0,0 +1,210 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Channel, ChatPhotoEmpty, InputPeerChannel, Message, PeerChannel
+
+from telegram_digest import fetcher, storage
+
+pytestmark = pytest.mark.usefixtures("sqlite_storage")
+
+class FakeClient:
+    def __init__(self):
+        self.resolved = 0
+
+    async def get_entity(self, channel_id):
+        self.resolved += 1
+        return Channel(id=777, title="Канал", photo=ChatPhotoEmpty(), date=None,
+                       access_hash=4242, username=channel_id.lstrip("@"))
+
+def resolve(client, force=False):
+    state = storage.get_channel_state("@chan")
+    return asyncio.run(fetcher._resolve_channel(client, "@chan", state, force))
+
+def test_resolve_channel_uses_cached_peer_until_ttl_or_force(monkeypatch):
+    client = FakeClient()
+
+    first = resolve(client)
+    second = resolve(client)
+
+    assert first == second == (InputPeerChannel(777, 4242), "Канал", "chan")
+    assert client.resolved == 1
+    resolve(client, force=True)
+    assert client.resolved == 2
+    monkeypatch.setattr(fetcher, "CHANNEL_META_TTL", timedelta(0))
+    resolve(client)
+    assert client.resolved == 3
+
+class FloodingHistoryClient(FakeClient):
+    """Отдает историю страницами, на второй странице один раз отвечает FloodWait."""
+
+    def __init__(self, messages):
+        super().__init__()
+        self.messages = messages
+        self.offsets = []
+        self.flooded = False
+
+    async def __call__(self, request):
+        self.offsets.append(request.offset_id)
+        if request.offset_id and not self.flooded:
+            self.flooded = True
+            raise FloodWaitError(request=request, capture=0)
+        older = [m for m in self.messages if not request.offset_id or m.id < request.offset_id]
+        return SimpleNamespace(messages=older[:request.limit])
+
+def test_fetch_posts_requeues_flooded_channel_and_resumes_from_same_page():
+    now = datetime.now(timezone.utc)
+    messages = [
+        Message(id=msg_id, peer_id=PeerChannel(777), date=now - timedelta(minutes=msg_id),
+                message=f"пост номер {msg_id} про что-то важное")
+        for msg_id in (3, 2, 1)
+    ]
+    client = FloodingHistoryClient(messages)
+    scheduler = fetcher.TelegramScheduler(client)
+
+    asyncio.run(fetcher.fetch_posts(client, ["@chan"], days=1, limit=2, scheduler=scheduler))
+
+    # Вторая страница запрошена повторно с тем же offset_id, первая — не перечитывалась
+    assert client.offsets == [0, 2, 2]
+    assert scheduler.flood_waits == {"history": 1}
+    assert [post['msg_id'] for post in storage.get_posts("@chan", limit=10)] == [1, 2, 3]
+    assert storage.get_channel_state("@chan")['last_seen_msg_id'] == 3
+
+class HistoryClient(FakeClient):
+    """История каналов {канал: сообщения от новых к старым} с учетом offset_id и min_id; записывает запросы."""
+
+    def __init__(self, history, delay=0.0, errors=None):
+        super().__init__()
+        self.history = history
+        self.delay = delay
+        # (канал, offset_id) -> ошибка, которую один раз вернет запрос этой страницы
+        self.errors = dict(errors or {})
+        self.peers = {}
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+
+    async def get_entity(self, channel_id):
+        self.resolved += 1
+        peer_id = self.peers.setdefault(channel_id, len(self.peers) + 1)
+        return Channel(id=peer_id, title=channel_id, photo=ChatPhotoEmpty(), date=None,
+                       access_hash=4242, username=channel_id.lstrip("@"))
+
+    async def __call__(self, request):
+        channel = next(name for name, peer_id in self.peers.items() if peer_id == request.peer.channel_id)
+        self.requests.append((channel, request.offset_id, request.min_id))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            error = self.errors.pop((channel, request.offset_id), None)
+            if error is not None:
+                raise error
+        finally:
+            self.active -= 1
+        messages = [m for m in self.history[channel]
+                    if (not request.offset_id or m.id < request.offset_id) and m.id > request.min_id]
+        return SimpleNamespace(messages=messages[:request.limit])
+
+def make_messages(ages):
+    """Сообщения {msg_id: возраст} от новых к старым."""
+    now = datetime.now(timezone.utc)
+    return [
+        Message(id=msg_id, peer_id=PeerChannel(1), date=now - age, message=f"пост номер {msg_id} про что-то важное")
+        for msg_id, age in sorted(ages.items(), reverse=True)
+    ]
+
+def fetch(client, days=1, limit=10, channels=("@chan",), **kwargs):
+    asyncio.run(fetcher.fetch_posts(client, list(channels), days=days, limit=limit, **kwargs))
+    requests = list(client.requests)
+    client.requests.clear()
+    return requests
+
+def stored_ids(channel="@chan"):
+    return sorted(post['msg_id'] for post in storage.get_posts(channel, limit=100))
+
+def test_incremental_runs_use_min_id_and_wider_days_reread_history():
+    history = {"@chan": make_messages({3: timedelta(hours=1), 2: timedelta(hours=30), 1: timedelta(hours=50)})}
+    client = HistoryClient(history)
+
+    assert fetch(client, days=1) == [("@chan", 0, 0)]
+    assert stored_ids() == [3]
+    state = storage.get_channel_state("@chan")
+    assert state['last_seen_msg_id'] == 3
+    assert abs(state['covered_from'] - (datetime.now(timezone.utc) - timedelta(days=1))) < timedelta(minutes=1)
+
+    # Период покрыт: запрашиваются только сообщения новее отметки
+    history["@chan"] = make_messages({4: timedelta(minutes=1)}) + history["@chan"]
+    assert fetch(client, days=1) == [("@chan", 0, 3)]
+    assert stored_ids() == [3, 4]
+
+    # Период шире загруженного: история читается без min_id, covered_from сдвигается назад
+    assert fetch(client, days=3) == [("@chan", 0, 0)]
+    assert stored_ids() == [1, 2, 3, 4]
+    state = storage.get_channel_state("@chan")
+    assert state['last_seen_msg_id'] == 4
+    assert abs(state['covered_from'] - (datetime.now(timezone.utc) - timedelta(days=3))) < timedelta(minutes=1)
+
+    # Более узкий период снова инкрементальный и не сужает covered_from
+    assert fetch(client, days=2) == [("@chan", 0, 4)]
+    assert storage.get_channel_state("@chan")['covered_from'] == state['covered_from']
+
+def test_history_is_paged_by_offset_id_until_start_of_period():
+    ages = {msg_id: timedelta(hours=7 - msg_id) for msg_id in range(2, 7)}
+    # Сообщение 1 старше периода: на нем чтение останавливается
+    ages[1] = timedelta(days=2)
+    client = HistoryClient({"@chan": make_messages(ages)})
+
+    assert fetch(client, days=1, limit=2) == [("@chan", 0, 0), ("@chan", 5, 0), ("@chan", 3, 0)]
+    assert stored_ids() == [2, 3, 4, 5, 6]
+    assert storage.get_channel_state("@chan")['last_seen_msg_id'] == 6
+
+def test_channel_state_is_saved_only_after_full_pass():
+    history = {"@chan": make_messages({msg_id: timedelta(hours=5 - msg_id) for msg_id in range(1, 5)})}
+    client = HistoryClient(history, errors={("@chan", 3): RuntimeError("обрыв соединения")})
+
+    assert fetch(client, limit=2) == [("@chan", 0, 0), ("@chan", 3, 0)]
+    # Первая страница сохранена, но отметки нет: иначе следующий запуск пропустил бы сообщения 1 и 2
+    assert stored_ids() == [3, 4]
+    assert 'last_seen_msg_id' not in storage.get_channel_state("@chan")
+
+    assert fetch(client, limit=2) == [("@chan", 0, 0), ("@chan", 3, 0), ("@chan", 1, 0)]
+    assert stored_ids() == [1, 2, 3, 4]
+    assert storage.get_channel_state("@chan")['last_seen_msg_id'] == 4
+
+def test_fetch_posts_caps_channels_in_flight():
+    channels = [f"@c{i}" for i in range(6)]
+    client = HistoryClient({channel: make_messages({1: timedelta(hours=1)}) for channel in channels}, delay=0.02)
+
+    fetch(client, channels=channels, concurrency=2)
+
+    assert client.max_active == 2
+    assert all(stored_ids(channel) == [1] for channel in channels)
+
+def test_flood_wait_requeues_only_flooded_channel():
+    channels = ["@a", "@b", "@c"]
+    client = HistoryClient(
+        {channel: make_messages({1: timedelta(hours=1)}) for channel in channels},
+        errors={("@a", 0): FloodWaitError(request=None, capture=0)}
+    )
+    requeued = []
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        call_later = loop.call_later
+
+        def spy(delay, callback, task):
+            requeued.append((delay, task['channel_id']))
+            return call_later(delay, callback, task)
+
+        loop.call_later = spy
+        await fetcher.fetch_posts(client, channels, days=1, concurrency=1)
+
+    asyncio.run(run())
+
+    assert requeued == [(0, "@a")]
+    # Единственный воркер не ждет @a, а берет следующие каналы; @a догружается после них
+    assert [channel for channel, _, _ in client.requests] == ["@a", "@b", "@c", "@a"]
+    assert all(stored_ids(channel) == [1] for channel in channels)
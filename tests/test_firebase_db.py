@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+
+from telegram_digest import firebase_db
+
+class FakeRef:
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+class FakeSnapshot:
+    def __init__(self, doc_id, exists):
+        self.id = doc_id
+        self.exists = exists
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = {}
+
+    def set(self, ref, data, merge=False):
+        self.writes[ref.id] = data
+
+    def commit(self):
+        self.db.commits.append(len(self.writes))
+        self.db.docs.update(self.writes)
+
+class FakeCollection:
+    def document(self, doc_id):
+        return FakeRef(doc_id)
+
+class FakeDb:
+    def __init__(self, docs):
+        self.docs = dict(docs)
+        self.reads = []
+        self.commits = []
+
+    def collection(self, name):
+        return FakeCollection()
+
+    def get_all(self, refs, field_paths=None):
+        self.reads.append((len(refs), field_paths))
+        return [FakeSnapshot(ref.id, ref.id in self.docs) for ref in refs]
+
+    def batch(self):
+        return FakeBatch(self)
+
+def make_post(msg_id, text="один два три четыре пять шесть"):
+    return {'msg_id': msg_id, 'channel_id': "@chan", 'date': datetime.now(timezone.utc), 'plain_text': text}
+
+def test_upsert_posts_checks_existence_and_writes_in_500_op_chunks(monkeypatch):
+    # Пост 2 и весь последний пакет (1001–1100) уже сохранены
+    existing = [2, *range(1001, 1101)]
+    db = FakeDb({f"@chan_{msg_id}": {'msg_id': msg_id} for msg_id in existing})
+    monkeypatch.setattr(firebase_db, "_db", db)
+    posts = [make_post(msg_id) for msg_id in range(1, 1101)]
+    posts.insert(1, make_post(5000, text="коротко"))
+    posts.append(make_post(1))
+
+    results = firebase_db.upsert_posts(posts)
+
+    # Невалидный пост и дубликат в пакет не попадают, существование — по одному полю
+    assert db.reads == [(500, ['msg_id']), (500, ['msg_id']), (100, ['msg_id'])]
+    # Пакет, где все посты уже есть, не коммитится
+    assert db.commits == [499, 500]
+    assert len(results) == len(posts)
+    added = {post['msg_id'] for post, flag in zip(posts, results) if flag}
+    assert added == set(range(1, 1001)) - {2}
+    assert results[1] is False and results[-1] is False
+    assert db.docs["@chan_3"]['entities'] == []
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from telegram_digest import links, storage
+
+PAGE = (
+    "<html><head><title>Заголовок</title><script>var x = 1;</script></head>"
+    "<body><nav>меню</nav><article><p>Первый абзац.</p><p>Второй абзац.</p></article></body></html>"
+).encode("utf-8")
+ETAG = '"v1"'
+
+pytestmark = pytest.mark.usefixtures("sqlite_storage")
+
+@pytest.fixture
+def server():
+    """Локальный HTTP-сервер: считает запросы по пути и максимум одновременных запросов."""
+    state = {'requests': Counter(), 'active': 0, 'max_active': 0, 'not_modified': 0, 'status': None}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                state['requests'][self.path.split("?")[0]] += 1
+                state['active'] += 1
+                state['max_active'] = max(state['max_active'], state['active'])
+            try:
+                time.sleep(0.05)
+                if state.get('status'):
+                    self.send_response(state['status'])
+                    self.end_headers()
+                    return
+                if self.headers.get("If-None-Match") == ETAG:
+                    state['not_modified'] += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(PAGE)))
+                self.send_header("ETag", ETAG)
+                self.end_headers()
+                self.wfile.write(PAGE)
+            finally:
+                with lock:
+                    state['active'] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    state['base'] = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+def make_post(post_id, text, entities):
+    return {'id': post_id, 'plain_text': text, 'entities': entities}
+
+def test_normalize_url_drops_tracking_and_fragment():
+    assert links.normalize_url("HTTPS://Example.COM:443/a?utm_source=tg&b=1#top") == "https://example.com/a?b=1"
+    assert links.normalize_url("example.com") == "http://example.com/"
+    assert links.normalize_url("mailto:someone@example.com") is None
+
+def test_shared_link_is_fetched_once_and_revalidated(server):
+    base = server['base']
+    text = f"Смотрите {base}/page 🚀"
+    # Одна и та же ссылка в двух каналах: голой ссылкой (смещение после эмодзи не влияет) и ссылкой-текстом с меткой
+    posts = [
+        make_post("@a_1", text, [{'type': 'MessageEntityUrl', 'offset': 9, 'length': len(base) + 5}]),
+        make_post("@b_1", "Ссылка", [{'type': 'MessageEntityTextUrl', 'offset': 0, 'length': 6,
+                                      'url': f"{base}/page?utm_source=b#comments"}]),
+    ]
+    urls = links.collect_urls(posts)
+    assert urls == {f"{base}/page": ["@a_1", "@b_1"]}
+
+    stats = asyncio.run(links.enrich_links(urls))
+    assert stats['fetched'] == 1
+    assert server['requests']['/page'] == 1
+    record = storage.get_links(list(urls))[f"{base}/page"]
+    assert record['title'] == "Заголовок"
+    assert record['text'] == "Первый абзац.\nВторой абзац."
+    assert record['etag'] == ETAG
+
+    # В пределах ttl ссылка не запрашивается
+    stats = asyncio.run(links.enrich_links(urls))
+    assert stats['cached'] == 1 and server['requests']['/page'] == 1
+
+    # После ttl — условный запрос; 304 сохраняет текст
+    stats = asyncio.run(links.enrich_links(urls, ttl=timedelta(0)))
+    assert stats['not_modified'] == 1 and server['not_modified'] == 1
+    assert storage.get_links(list(urls))[f"{base}/page"]['text'] == "Первый абзац.\nВторой абзац."
+
+def test_error_response_keeps_stored_page_and_summary(server):
+    url = f"{server['base']}/page"
+    asyncio.run(links.enrich_links([url]))
+    record = storage.get_links([url])[url]
+    storage.save_links([dict(record, summary="Саммари страницы")])
+
+    # Временная ошибка при перепроверке не стирает текст и оплаченное саммари
+    server['status'] = 429
+    stats = asyncio.run(links.enrich_links([url], ttl=timedelta(0)))
+
+    assert stats['errors'] == 1
+    record = storage.get_links([url])[url]
+    assert (record['status'], record['error']) == (429, "HTTP 429")
+    assert record['text'] == "Первый абзац.\nВторой абзац."
+    assert record['summary'] == "Саммари страницы"
+    assert record['etag'] == ETAG
+
+def test_failed_fetch_is_retried_after_error_ttl(server):
+    url = f"{server['base']}/page"
+    server['status'] = 503
+    stats = asyncio.run(links.enrich_links([url]))
+    assert stats['errors'] == 1
+
+    # Ошибка не продлевает запись на весь LINK_TTL: повтор после короткого error_ttl
+    stats = asyncio.run(links.enrich_links([url]))
+    assert stats['cached'] == 1 and server['requests']['/page'] == 1
+    server['status'] = None
+    stats = asyncio.run(links.enrich_links([url], error_ttl=timedelta(0)))
+    assert stats['fetched'] == 1 and server['requests']['/page'] == 2
+    record = storage.get_links([url])[url]
+    assert record['error'] is None and record['text'] == "Первый абзац.\nВторой абзац."
+
+    # Успешная запись снова живет весь ttl
+    stats = asyncio.run(links.enrich_links([url], error_ttl=timedelta(0)))
+    assert stats['cached'] == 1 and server['requests']['/page'] == 2
+
+def test_per_domain_limit(server):
+    urls = [f"{server['base']}/page{i}" for i in range(8)]
+    stats = asyncio.run(links.enrich_links(urls, concurrency=8, per_domain=2))
+    assert stats['fetched'] == 8
+    assert server['max_active'] <= 2
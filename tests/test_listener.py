@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timezone
+
+from telegram_digest import listener
+
+def make_post(msg_id):
+    return {'msg_id': msg_id, 'channel_id': '@chan', 'date': datetime.now(timezone.utc)}
+
+def test_post_buffer_flushes_by_size_and_by_time(monkeypatch):
+    writes = []
+    monkeypatch.setattr(listener, "upsert_posts", lambda posts: writes.append(("new", len(posts))) or [True] * len(posts))
+    monkeypatch.setattr(listener, "update_posts", lambda posts: writes.append(("edit", len(posts))) or [True] * len(posts))
+
+    async def scenario():
+        buffer = listener.PostBuffer(max_size=3, max_delay=0.05)
+        flusher = asyncio.ensure_future(buffer.run())
+        for msg_id in range(3):
+            await buffer.add(make_post(msg_id))
+        # Третий пост заполнил буфер — запись сразу, без ожидания
+        assert writes == [("new", 3)]
+        await buffer.add(make_post(1), edited=True)
+        await asyncio.sleep(0.15)
+        flusher.cancel()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    assert writes == [("new", 3), ("edit", 1)]
+    assert (buffer.added, buffer.updated, len(buffer)) == (3, 1, 0)
+
+def test_post_buffer_keeps_posts_when_write_fails(monkeypatch):
+    writes = []
+    failures = ["edit"]
+
+    def update_posts(posts):
+        if failures:
+            raise RuntimeError(failures.pop())
+        writes.append(("edit", [post['msg_id'] for post in posts]))
+        return [True] * len(posts)
+
+    monkeypatch.setattr(listener, "upsert_posts", lambda posts: writes.append(("new", [post['msg_id'] for post in posts])) or [True] * len(posts))
+    monkeypatch.setattr(listener, "update_posts", update_posts)
+
+    async def scenario():
+        buffer = listener.PostBuffer(max_size=10, max_delay=60)
+        await buffer.add(make_post(1))
+        await buffer.add(make_post(2), edited=True)
+        try:
+            await buffer.flush()
+        except RuntimeError:
+            pass
+        # Новые посты записаны, правка осталась в буфере вместе с пришедшей после сбоя
+        assert (len(buffer.new_posts), len(buffer.edited_posts)) == (0, 1)
+        assert buffer.first_added is not None
+        await buffer.add(make_post(3), edited=True)
+        await buffer.flush()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    assert writes == [("new", [1]), ("edit", [2, 3])]
+    assert (buffer.added, buffer.updated, len(buffer)) == (1, 2, 0)
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from telegram_digest import maintenance, sqlite_db, storage
+from telegram_digest.checkpoint import Checkpoint
+
+LONG_TEXT = "один два три четыре пять шесть"
+
+pytestmark = pytest.mark.usefixtures("sqlite_storage")
+
+@pytest.fixture(autouse=True)
+def checkpoint_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+
+def insert_post(msg_id, date, text):
+    # Напрямую: upsert_posts не пропускает короткие посты, а в старых базах они есть
+    conn = sqlite_db.get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO posts (id, msg_id, channel, date, text_html, plain_text, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (f"@chan_{msg_id:03d}", msg_id, "@chan", sqlite_db._to_db_date(date), text, text, sqlite_db._now())
+        )
+
+def test_clean_resumes_from_checkpoint(monkeypatch):
+    now = datetime.now(timezone.utc)
+    for msg_id in range(1, 11):
+        insert_post(msg_id, now, "коротко" if msg_id % 2 else LONG_TEXT)
+
+    deleted_batches = []
+
+    def failing_delete(doc_ids):
+        if deleted_batches:
+            raise RuntimeError("сбой")
+        deleted_batches.append(doc_ids)
+        storage.delete_posts(doc_ids)
+
+    monkeypatch.setattr(maintenance, "delete_posts", failing_delete)
+    with pytest.raises(RuntimeError):
+        maintenance.clean_short_posts(page_size=4)
+    assert Checkpoint("maintain_clean").load() == {'cursor': "@chan_004", 'scanned': 4, 'matched': 2}
+
+    monkeypatch.setattr(maintenance, "delete_posts", storage.delete_posts)
+    stats = maintenance.clean_short_posts(page_size=4)
+    assert stats == {'scanned': 10, 'matched': 5}
+    assert storage.count_posts() == 5
+    assert Checkpoint("maintain_clean").load() == {}
+
+def test_prune_and_dry_run():
+    now = datetime.now(timezone.utc)
+    for msg_id in range(1, 8):
+        insert_post(msg_id, now - timedelta(days=msg_id * 10), LONG_TEXT)
+
+    results = maintenance.run_maintenance(["clean", "prune"], retention_days=35, dry_run=True)
+    assert results["prune"] == {'matched': 4, 'deleted': 0}
+    assert storage.count_posts() == 7
+
+    assert maintenance.prune_old_posts(35, page_size=3) == {'matched': 4, 'deleted': 4}
+    assert storage.count_posts() == 3
+    assert storage.count_posts(before=now - timedelta(days=35)) == 0
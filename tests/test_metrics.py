@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+from telegram_digest import storage
+from telegram_digest.metrics import Metrics, metrics, tracked_run, write_textfile
+
+def test_counters_spans_and_prometheus_text():
+    registry = Metrics()
+    registry.inc("db_reads", 3, op="get_posts")
+    registry.inc("db_reads", 2, op="get_posts")
+    registry.inc("db_writes", 0, op="save_summaries")
+    with registry.span("render", format="pdf"):
+        pass
+    baseline = registry.snapshot()
+    registry.inc("db_reads", 4, op="get_posts")
+    registry.inc("summaries")
+
+    assert registry.since(baseline) == {
+        'counters': {'db_reads{op="get_posts"}': 4, 'summaries': 1},
+        'spans': {},
+    }
+    text = registry.prometheus_text()
+    assert 'telegram_digest_db_reads_total{op="get_posts"} 9\n' in text
+    assert "db_writes" not in text
+    assert 'telegram_digest_render_seconds_count{format="pdf"} 1\n' in text
+    assert 'telegram_digest_render_seconds_sum{format="pdf"}' in text
+
+def test_tracked_run_stores_metrics_and_textfile(sqlite_storage, tmp_path):
+    with tracked_run(1):
+        text = "один два три четыре пять шесть"
+        storage.upsert_posts([{
+            'msg_id': 1, 'channel_id': "@chan", 'date': datetime.now(timezone.utc),
+            'text_html': text, 'plain_text': text,
+        }])
+    run = storage.get_latest_run()
+    assert run['status'] == "completed"
+    assert run['metrics']['counters'] == {'db_writes{op="upsert_posts"}': 1}
+    assert run['metrics']['spans']['storage{op="upsert_posts"}']['count'] == 1
+
+    path = write_textfile(str(tmp_path / "metrics" / "digest.prom"))
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == metrics.prometheus_text()
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from telegram_digest import migrate_flat
+from telegram_digest.checkpoint import Checkpoint
+
+class FakeRef:
+    def __init__(self, path):
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+class FakeSnapshot:
+    def __init__(self, path, data):
+        self.reference = FakeRef(path)
+        self.id = self.reference.id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref.path, data))
+
+    def commit(self):
+        with self.db.lock:
+            if any(path in self.db.fail_on for path, _ in self.writes):
+                self.db.fail_on.clear()
+                raise RuntimeError("commit failed")
+            self.db.docs.update(self.writes)
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+
+    def document(self, doc_id):
+        return FakeRef(f"{self.name}/{doc_id}")
+
+class FakeDb:
+    def __init__(self):
+        self.docs = {}
+        self.fail_on = set()
+        self.lock = threading.Lock()
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def collection(self, name):
+        return FakeCollection(name)
+
+    def collection_group(self, name):
+        return None
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+    snapshots = [
+        FakeSnapshot(f"posts/@chan/messages/{i:03d}", {'msg_id': i, 'plain_text': f"пост {i}"}) for i in range(1, 11)
+    ]
+    # Уже плоский документ тоже виден в collection_group('messages')
+    snapshots.append(FakeSnapshot("messages/@chan_1", {'msg_id': 1, 'channel': '@chan'}))
+    snapshots.sort(key=lambda snapshot: snapshot.reference.path)
+    starts = []
+
+    def fake_iter_pages(query, page_size, start_after, db):
+        starts.append(start_after)
+        remaining = [s for s in snapshots if start_after is None or s.reference.path > start_after]
+        for start in range(0, len(remaining), page_size):
+            yield remaining[start:start + page_size]
+
+    monkeypatch.setattr(migrate_flat, "_iter_pages", fake_iter_pages)
+    return starts
+
+def test_flat_migration_resumes_after_failed_batch(source):
+    db = FakeDb()
+    db.fail_on.add("messages/@chan_7")
+    with pytest.raises(RuntimeError):
+        migrate_flat.run_migration("flat-messages", page_size=3, workers=2, db=db)
+    # Чекпоинт не ушел дальше упавшей страницы
+    state = Checkpoint("migrate_flat-messages").load()
+    assert state['cursor'] < "posts/@chan/messages/007"
+
+    stats = migrate_flat.run_migration("flat-messages", page_size=3, workers=2, db=db)
+    assert source[-1] == state['cursor']
+    assert stats['read'] == 11 and stats['written'] == 10
+    assert sorted(db.docs) == sorted(f"messages/@chan_{i}" for i in range(1, 11))
+    assert db.docs["messages/@chan_7"] == {'msg_id': 7, 'plain_text': "пост 7", 'channel': '@chan'}
+    assert Checkpoint("migrate_flat-messages").load() == {}
@@ -0,0 +1,44 @@
+from datetime import datetime, timezone
+
+from telethon.tl.types import Message, MessageEntityBold, MessageEntityMentionName, MessageEntityTextUrl, PeerChannel
+
+from telegram_digest.normalization import compact_entities, entities_to_html, normalize_message
+
+def test_compact_entities_keeps_stored_keys():
+    entities = [MessageEntityBold(0, 3), MessageEntityTextUrl(4, 2, url="https://t.me"), MessageEntityMentionName(7, 2, user_id=5)]
+
+    assert compact_entities(entities) == [
+        {'type': 'MessageEntityBold', 'offset': 0, 'length': 3},
+        {'type': 'MessageEntityTextUrl', 'offset': 4, 'length': 2, 'url': "https://t.me"},
+        {'type': 'MessageEntityMentionName', 'offset': 7, 'length': 2, 'user_id': 5},
+    ]
+
+def test_entities_to_html_uses_utf16_offsets_and_escapes_text():
+    # Эмодзи занимает две кодовые единицы UTF-16
+    text = "🚀 *старт* <b>\nссылка"
+    entities = [
+        {'type': 'MessageEntityBold', 'offset': 3, 'length': 7},
+        {'type': 'MessageEntityTextUrl', 'offset': 15, 'length': 6, 'url': "https://a.b/?x=1&y=2"},
+    ]
+
+    assert entities_to_html(text, entities) == (
+        '🚀 <b>*старт*</b> &lt;b&gt;<br><a href="https://a.b/?x=1&amp;y=2">ссылка</a>'
+    )
+
+def test_entities_to_html_reopens_overlapping_entities():
+    entities = [
+        {'type': 'MessageEntityBold', 'offset': 0, 'length': 4},
+        {'type': 'MessageEntityItalic', 'offset': 2, 'length': 4},
+    ]
+
+    assert entities_to_html("abcdef", entities) == "<b>ab<i>cd</i></b><i>ef</i>"
+
+def test_normalize_message_keeps_plain_text_as_is():
+    message = Message(id=1, peer_id=PeerChannel(1), date=datetime.now(timezone.utc),
+                      message="Цена *не* 100_000", entities=[MessageEntityBold(0, 4)])
+
+    plain_text, entities, text_html = normalize_message(message)
+
+    assert plain_text == "Цена *не* 100_000"
+    assert entities == [{'type': 'MessageEntityBold', 'offset': 0, 'length': 4}]
+    assert text_html == "<b>Цена</b> *не* 100_000"
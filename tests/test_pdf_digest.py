@@ -0,0 +1,119 @@
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from telegram_digest import pdf_digest
+
+DATE_FROM = datetime(2025, 6, 1, tzinfo=timezone.utc)
+DATE_TO = DATE_FROM + timedelta(days=7)
+
+@pytest.fixture(autouse=True)
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_digest, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(pdf_digest, "JINJA_CACHE_DIR", str(tmp_path / "jinja_cache"))
+    monkeypatch.setattr(pdf_digest, "_env", None)
+
+def make_posts():
+    return [
+        {
+            'channel': '@first' if i < 2 else '@second',
+            'date': DATE_FROM + timedelta(hours=i),
+            'summary': f"Саммари {i}",
+            'text_html': f"<b>Пост {i}</b>",
+        }
+        for i in range(3)
+    ]
+
+def test_build_digest_writes_html_and_nested_epub():
+    channel_posts = pdf_digest.group_posts_by_channel(make_posts())
+
+    pdf_path, epub_path, count = pdf_digest.build_digest(iter(channel_posts), DATE_FROM, DATE_TO, pdf=False)
+
+    assert pdf_path is None
+    assert count == 3
+    with open(epub_path.replace(".epub", ".html"), encoding="utf-8") as f:
+        html = f.read()
+    assert html.index("@first") < html.index("Пост 1") < html.index("@second") < html.index("Пост 2")
+    with zipfile.ZipFile(epub_path) as book:
+        nav = book.read("EPUB/nav.xhtml").decode("utf-8")
+        post = book.read("EPUB/channel_1_post_0.xhtml").decode("utf-8")
+    # Оглавление двухуровневое: канал, внутри — его посты
+    assert nav.index("@first") < nav.index("Саммари 1") < nav.index("@second") < nav.index("Саммари 2")
+    assert "<b>Пост 2</b>" in post and 'class="summary"' in post
+
+def test_render_digest_html_matches_streaming_chunks():
+    html = pdf_digest.render_digest_html(make_posts(), DATE_FROM, DATE_TO)
+    assert html.count('class="post"') == 3
+    assert html.count('class="channel-title"') == 2
+    # Разделитель только между постами внутри канала
+    assert html.count('class="divider"') == 1
+
+def test_fragment_cache_renders_only_changed_posts(tmp_path):
+    posts = make_posts()
+    for i, post in enumerate(posts):
+        post['id'] = f"{post['channel']}_{i}"
+        post['updated_at'] = DATE_FROM
+    env = pdf_digest._jinja_env()
+    template_hash = pdf_digest.template_hash(env, pdf_digest.POST_TEMPLATE_FILE)
+
+    first = pdf_digest.FragmentCache(str(tmp_path / "fragments"), template_hash)
+    fragments = pdf_digest.render_post_fragments(posts, env, first)
+    assert (first.hits, first.misses) == (0, 3)
+
+    posts[1]['updated_at'] = DATE_TO
+    posts[1]['summary'] = "Новое саммари"
+    second = pdf_digest.FragmentCache(str(tmp_path / "fragments"), template_hash)
+    cached = pdf_digest.render_post_fragments(posts, env, second)
+    assert (second.hits, second.misses) == (2, 1)
+    assert cached[0] == fragments[0]
+    assert "Новое саммари" in cached[1]
+
+def test_render_digests_html_matches_single_render():
+    posts = make_posts()
+    digests = [(posts, DATE_FROM, DATE_TO), (posts[:1], DATE_FROM, DATE_FROM + timedelta(days=1))]
+
+    rendered = list(pdf_digest.render_digests_html(digests))
+
+    assert rendered == [pdf_digest.render_digest_html(*digest) for digest in digests]
+    assert pdf_digest._jinja_env() is pdf_digest._jinja_env()
+
+def test_split_pdf_requires_pypdf(monkeypatch):
+    monkeypatch.setattr(pdf_digest, "pdf_merge_available", lambda: False)
+    with pytest.raises(RuntimeError, match="pypdf"):
+        pdf_digest.build_digest(iter(pdf_digest.group_posts_by_channel(make_posts())), DATE_FROM, DATE_TO, split_pdf=True)
+
+def test_merge_pdf_parts_keeps_order_and_removes_parts(tmp_path):
+    pypdf = pytest.importorskip("pypdf")
+    part_paths = []
+    for pages in (1, 2):
+        writer = pypdf.PdfWriter()
+        for _ in range(pages):
+            writer.add_blank_page(width=100 * pages, height=100)
+        part_paths.append(str(tmp_path / f"part{pages}.pdf"))
+        with open(part_paths[-1], "wb") as f:
+            writer.write(f)
+
+    merged = pdf_digest.merge_pdf_parts(part_paths, str(tmp_path / "digest.pdf"))
+
+    assert [page.mediabox.width for page in pypdf.PdfReader(merged).pages] == [100, 200, 200]
+    assert [path.name for path in tmp_path.iterdir()] == ["digest.pdf"]
+
+def test_split_pdf_merges_parts_without_full_html(tmp_path):
+    pypdf = pytest.importorskip("pypdf")
+    try:
+        import weasyprint  # noqa: F401
+    except (ImportError, OSError):
+        pytest.skip("WeasyPrint недоступен (нет pango)")
+    channel_posts = pdf_digest.group_posts_by_channel(make_posts())
+
+    pdf_path, epub_path, count = pdf_digest.build_digest(
+        iter(channel_posts), DATE_FROM, DATE_TO, split_pdf=True, workers=2
+    )
+
+    assert count == 3
+    assert len(pypdf.PdfReader(pdf_path).pages) >= 2
+    # Остались только итоговые PDF и EPUB — ни частей, ни общего HTML
+    assert sorted(path.name for path in tmp_path.iterdir() if path.is_file()) == sorted(
+        [pdf_path.rsplit("/", 1)[-1], epub_path.rsplit("/", 1)[-1]]
+    )
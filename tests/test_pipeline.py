@@ -0,0 +1,58 @@
+import asyncio
+import functools
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from telegram_digest import pipeline, storage
+from telegram_digest.summarizer import summarize_stream
+
+LONG_TEXT = " ".join(["слово"] * 60)
+
+pytestmark = pytest.mark.usefixtures("sqlite_storage")
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="новое саммари"))])
+
+def make_post(msg_id, date, text):
+    return {'msg_id': msg_id, 'channel_id': '@chan', 'date': date, 'text_html': text, 'plain_text': text}
+
+def test_pipeline_summarizes_fetched_posts_and_reads_only_older_from_storage(tmp_path, monkeypatch):
+    now = datetime.now(timezone.utc)
+    # Сохранены раньше: пост 1 не загружается в этом запуске, пост 2 загружается повторно
+    storage.upsert_posts([make_post(1, now - timedelta(hours=30), LONG_TEXT),
+                          make_post(2, now - timedelta(hours=20), LONG_TEXT + " два")])
+    storage.save_summaries({"@chan_1": "старое саммари", "@chan_2": "сохраненное саммари"})
+    page = [make_post(4, now - timedelta(hours=1), "десять слов " * 5),
+            make_post(3, now - timedelta(hours=2), LONG_TEXT + " три"),
+            make_post(2, now - timedelta(hours=20), LONG_TEXT + " два")]
+
+    async def fake_fetch_posts(client, channel_ids, days, concurrency, on_posts, run_id=None):
+        results = await asyncio.to_thread(storage.upsert_posts, page)
+        for post, added in zip(page, results):
+            post['added'] = added
+        await on_posts('@chan', page)
+
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(pipeline, "fetch_posts", fake_fetch_posts)
+    monkeypatch.setattr(pipeline, "summarize_stream", functools.partial(
+        summarize_stream, cache_path=str(tmp_path / "cache.db")
+    ))
+
+    fetched = asyncio.run(pipeline.fetch_and_summarize(None, ['@chan'], days=2, summary_client=client))
+    channel_posts = list(pipeline.iter_pipeline_channel_posts(fetched, now - timedelta(days=2), now))
+
+    assert completions.calls == 1
+    [(channel, posts)] = channel_posts
+    assert channel == '@chan'
+    assert [(post['msg_id'], post['summary']) for post in posts] == [
+        (1, "старое саммари"), (2, "сохраненное саммари"), (3, "новое саммари"), (4, "")
+    ]
+    assert storage.get_posts_by_ids(["@chan_3", "@chan_4"])["@chan_3"]['summary'] == "новое саммари"
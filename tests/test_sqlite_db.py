@@ -0,0 +1,129 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from telegram_digest import sqlite_db, storage
+
+pytestmark = pytest.mark.usefixtures("sqlite_storage")
+
+def make_post(msg_id, date, channel="@chan", text="один два три четыре пять шесть"):
+    return {
+        'msg_id': msg_id,
+        'channel_id': channel,
+        'date': date,
+        'text_html': text,
+        'plain_text': text,
+        'entities': [{'type': 'MessageEntityBold', 'offset': 0, 'length': 4}],
+    }
+
+def test_upsert_posts_skips_invalid_and_existing():
+    now = datetime.now(timezone.utc)
+    posts = [make_post(1, now), make_post(2, now, text="слишком коротко"), make_post(1, now)]
+    assert sqlite_db.upsert_posts(posts) == [True, False, False]
+    assert sqlite_db.upsert_posts([make_post(1, now), make_post(3, now + timedelta(minutes=1))]) == [False, True]
+    stored = sqlite_db.get_posts("@chan", limit=10)
+    assert [post['msg_id'] for post in stored] == [3, 1]
+    assert stored[0]['entities'][0]['type'] == 'MessageEntityBold'
+
+def test_iter_digest_posts_filters_range_and_summary():
+    start = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    # Пост N опубликован в день N-2 относительно start
+    sqlite_db.upsert_posts([make_post(i, start + timedelta(days=i - 2)) for i in range(1, 8)])
+    sqlite_db.save_summaries({f"@chan_{i}": f"summary {i}" for i in (1, 2, 4, 5, 6)})
+    sqlite_db.save_summaries({"@chan_3": ""})
+
+    posts = list(sqlite_db.iter_digest_posts("@chan", start, start + timedelta(days=4), page_size=2))
+
+    # 1 — до периода, 3 — короткий пост с пустым summary (попадает в дайджест),
+    # 6 — после периода, 7 — без summary
+    assert [post['msg_id'] for post in posts] == [2, 3, 4, 5]
+    assert posts[0]['date'] == start
+
+def test_summary_queries_and_channel_state():
+    now = datetime.now(timezone.utc)
+    sqlite_db.upsert_posts([make_post(1, now), make_post(2, now - timedelta(hours=1))])
+    pending = sqlite_db.get_posts_without_summary(10)
+    assert [post['id'] for post in pending] == ["@chan_2", "@chan_1"]
+    sqlite_db.save_summaries({"@chan_2": "готово"})
+    assert [post['id'] for post in sqlite_db.get_posts_without_summary(10)] == ["@chan_1"]
+
+    assert sqlite_db.get_channel_state("@chan") == {}
+    sqlite_db.update_channel_state("@chan", 42, now)
+    state = sqlite_db.get_channel_state("@chan")
+    assert state['last_seen_msg_id'] == 42
+    assert state['covered_from'] == now
+
+def test_update_posts_resets_summary_only_when_text_changes():
+    now = datetime.now(timezone.utc)
+    sqlite_db.upsert_posts([make_post(1, now), make_post(2, now)])
+    sqlite_db.save_summaries({"@chan_1": "summary 1", "@chan_2": "summary 2"})
+
+    edited = make_post(1, now, text="один два три четыре пять шесть семь")
+    same = make_post(2, now)
+    same['entities'] = []
+    created = make_post(3, now)
+    assert sqlite_db.update_posts([edited, same, created]) == [True, False, True]
+
+    stored = sqlite_db.get_posts_by_ids(["@chan_1", "@chan_2", "@chan_3"])
+    assert stored["@chan_1"]['summary'] is None
+    assert stored["@chan_1"]['plain_text'].endswith("семь")
+    assert stored["@chan_2"]['summary'] == "summary 2"
+    assert stored["@chan_2"]['entities'] == []
+    assert stored["@chan_3"]['summary'] is None
+
+def test_connection_per_thread_in_wal_mode():
+    conn = sqlite_db.get_connection()
+    assert sqlite_db.get_connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    sqlite_db.upsert_posts([make_post(1, datetime.now(timezone.utc))])
+    # fetcher пишет из asyncio.to_thread: у потока свое соединение к той же базе
+    seen = {}
+
+    def worker():
+        seen['conn'] = sqlite_db.get_connection()
+        seen['posts'] = sqlite_db.get_posts("@chan", limit=10)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert seen['conn'] is not conn
+    assert [post['msg_id'] for post in seen['posts']] == [1]
+
+def test_queries_use_indexes():
+    conn = sqlite_db.get_connection()
+
+    def plan(query, params):
+        return " ".join(row['detail'] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params))
+
+    assert "idx_posts_no_summary" in plan("SELECT * FROM posts WHERE summary IS NULL ORDER BY date LIMIT ?", (50,))
+    assert "idx_posts_channel_date" in plan(
+        "SELECT * FROM posts WHERE channel = ? ORDER BY date DESC LIMIT ?", ("@chan", 10)
+    )
+
+def test_runs_lifecycle():
+    assert sqlite_db.get_latest_run() is None
+    run_id = sqlite_db.start_run(7)
+    run = sqlite_db.get_latest_run()
+    assert run['status'] == 'running'
+    assert run['period_days'] == 7
+    assert run['ended_at'] is None
+
+    sqlite_db.end_run(run_id, {'posts_fetched': 3})
+    run = sqlite_db.get_latest_run()
+    assert run['status'] == 'completed'
+    assert run['ended_at'] >= run['started_at']
+    assert run['metrics'] == {'posts_fetched': 3}
+
+def test_storage_selects_backend_from_env(monkeypatch):
+    monkeypatch.setattr(storage, "_backend", None)
+    monkeypatch.setenv("STORAGE_BACKEND", " SQLite ")
+    assert storage.get_backend() is sqlite_db
+    assert storage.upsert_post(1, "@chan", datetime.now(timezone.utc), "<b>пост</b>", "один два три четыре пять")
+    assert [post['id'] for post in storage.get_posts_without_summary()] == ["@chan_1"]
+
+    monkeypatch.setattr(storage, "_backend", None)
+    monkeypatch.setenv("STORAGE_BACKEND", "mongo")
+    with pytest.raises(ValueError, match="STORAGE_BACKEND"):
+        storage.get_backend()
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import re
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from telegram_digest import summarizer, summary_cache
+from telegram_digest.ratelimit import TokenBucket
+
+def api_error(error_class, status, headers=None):
+    request = httpx.Request("POST", "http://stub/v1/chat/completions")
+    return error_class("stub error", response=httpx.Response(status, headers=headers, request=request), body=None)
+
+class StubOpenAI:
+    """Заглушка AsyncOpenAI: ответы задает reply(messages), failures — ошибки первых запросов."""
+
+    def __init__(self, reply=None, failures=(), delay=0.0):
+        self.reply = reply or (lambda messages: "Саммари: " + messages[-1]['content'][:20])
+        self.failures = list(failures)
+        self.delay = delay
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, model, messages, max_tokens, temperature, **kwargs):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.failures:
+                raise self.failures.pop(0)
+            content = self.reply(messages)
+        finally:
+            self.active -= 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    delays = []
+
+    def fake_delay(error, attempt):
+        delays.append((type(error).__name__, attempt))
+        return 0
+
+    monkeypatch.setattr(summarizer, "_retry_delay", fake_delay)
+    return delays
+
+def summarize(items, client, **kwargs):
+    kwargs.setdefault("rpm", None)
+    kwargs.setdefault("tpm", None)
+    return asyncio.run(summarizer.summarize_texts(items, client=client, **kwargs))
+
+def test_retries_429_and_5xx_then_succeeds(no_backoff):
+    client = StubOpenAI(failures=[
+        api_error(openai.RateLimitError, 429),
+        api_error(openai.InternalServerError, 503),
+    ])
+
+    results = summarize([("a", "текст поста")], client)
+
+    assert results == {"a": "Саммари: текст поста"}
+    assert client.calls == 3
+    assert no_backoff == [("RateLimitError", 0), ("InternalServerError", 1)]
+
+def test_client_errors_are_not_retried_and_retries_are_bounded(no_backoff):
+    client = StubOpenAI(failures=[api_error(openai.BadRequestError, 400)])
+    assert summarize([("a", "текст")], client) == {}
+    assert client.calls == 1
+
+    client = StubOpenAI(failures=[api_error(openai.RateLimitError, 429)] * (summarizer.MAX_RETRIES + 1))
+    assert summarize([("a", "текст")], client) == {}
+    assert client.calls == summarizer.MAX_RETRIES + 1
+
+def test_retry_delay_uses_jitter_and_retry_after(monkeypatch):
+    # Полный джиттер: случайное значение от 0 до 2**attempt (не больше минуты)
+    monkeypatch.setattr(summarizer.random, "uniform", lambda low, high: high)
+    assert summarizer._retry_delay(api_error(openai.InternalServerError, 503), 3) == 8
+    assert summarizer._retry_delay(api_error(openai.InternalServerError, 503), 10) == 60
+    assert summarizer._retry_delay(api_error(openai.RateLimitError, 429, {"retry-after": "2"}), 0) == 3
+
+def test_concurrency_caps_requests_in_flight():
+    client = StubOpenAI(delay=0.01)
+    items = [(str(i), f"текст {i}") for i in range(20)]
+
+    results = summarize(items, client, concurrency=3)
+
+    assert len(results) == 20
+    assert client.max_active == 3
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(5, period=0.5)
+
+    async def take(count, amount=1):
+        started = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire(amount)
+        return time.monotonic() - started
+
+    # Полное ведро отдается сразу, дальше — 10 единиц в секунду
+    assert asyncio.run(take(5)) < 0.05
+    assert asyncio.run(take(5)) >= 0.4
+    # Запрос больше емкости ждет полного ведра, а не вечно
+    assert asyncio.run(take(1, amount=100)) < 0.6
+    assert asyncio.run(TokenBucket(None).acquire(10 ** 9)) is None
+
+def pack_reply(messages):
+    """Ответ пакетного режима: саммари по каждому «### id», либо обычное саммари одного текста."""
+    content = messages[-1]['content']
+    blocks = re.findall(r"^### (\S+)\n(.*?)(?=\n\n### |\Z)", content, re.M | re.S)
+    if not blocks:
+        return "S:" + content
+    return json.dumps({local_id: "S:" + text for local_id, text in blocks}, ensure_ascii=False)
+
+def test_make_packs_respects_token_budget_and_post_limit(monkeypatch):
+    items = [(str(i), "слово " * 40) for i in range(6)] + [("big", "слово " * 2000)]
+    budget = summarizer.estimate_pack_tokens([text for _, text in items[:3]])
+
+    packs = summarizer.make_packs(items, budget)
+
+    assert [[item_id for item_id, _ in pack] for pack in packs] == [["0", "1", "2"], ["3", "4", "5"], ["big"]]
+    # Текст дороже бюджета идет отдельным пакетом, а не теряется
+    assert summarizer.estimate_pack_tokens([packs[-1][0][1]]) > budget
+    monkeypatch.setattr(summarizer, "PACK_MAX_POSTS", 2)
+    assert [len(pack) for pack in summarizer.make_packs(items[:6], 10 ** 6)] == [2, 2, 2]
+
+def test_parse_pack_reply_keeps_only_known_nonempty_ids():
+    reply = json.dumps({"1": " Первое ", "2": "", "3": 42, "99": "Чужое"})
+    assert summarizer.parse_pack_reply(reply, ["1", "2", "3", "4"]) == {"1": "Первое"}
+    assert summarizer.parse_pack_reply("{не json", ["1"]) == {}
+    assert summarizer.parse_pack_reply('["1"]', ["1"]) == {}
+
+@pytest.mark.parametrize("first_reply", [
+    # Неполный ответ с лишним id
+    lambda messages: json.dumps({"1": "S:текст a", "99": "S:чужое"}, ensure_ascii=False),
+    # Некорректный JSON
+    lambda messages: '{"1": "S:текст a", "2":',
+])
+def test_bad_pack_reply_is_split_and_summaries_match_posts(first_reply):
+    replies = [first_reply]
+    client = StubOpenAI(reply=lambda messages: (replies.pop(0) if replies else pack_reply)(messages))
+    items = [(item_id, f"текст {item_id}") for item_id in "abcd"]
+
+    results = summarize(items, client, pack_tokens=10 ** 6)
+
+    # Каждое саммари — от своего текста, лишний id ответа никуда не попал
+    assert results == {item_id: f"S:текст {item_id}" for item_id in "abcd"}
+    assert client.calls > 1
+
+def test_cache_key_normalizes_text_and_includes_model_and_prompt():
+    key = summary_cache.make_key("Ｐｏｓｔ  ﬁnal\n", "model", 1)
+    # NFKC: полноширинные буквы и лигатуры, схлопнутые пробелы
+    assert key == summary_cache.make_key("Post final", "model", 1)
+    assert key != summary_cache.make_key("Post final", "other-model", 1)
+    assert key != summary_cache.make_key("Post final", "model", 2)
+
+def test_cache_evicts_least_recently_used_every_100_puts(tmp_path, monkeypatch):
+    clock = iter(range(10 ** 6))
+    monkeypatch.setattr(summary_cache.time, "time", lambda: next(clock))
+    cache = summary_cache.SummaryCache(str(tmp_path / "cache.db"), max_entries=50)
+    for i in range(99):
+        cache.put(f"k{i}", f"s{i}")
+        if i >= 10:
+            # Первые десять записей продолжают использоваться
+            assert cache.get(f"k{i % 10}") == f"s{i % 10}"
+    # Вытеснение не на каждой вставке
+    assert cache.conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0] == 99
+
+    cache.put("k99", "s99")
+
+    keys = {row[0] for row in cache.conn.execute("SELECT key FROM summaries")}
+    assert len(keys) == 50
+    assert {f"k{i}" for i in range(10)} <= keys
+    assert "k10" not in keys and "k99" in keys
+    cache.close()
+
+def test_stream_dedups_texts_within_run_and_counts_hits(tmp_path, monkeypatch):
+    saved = {}
+    monkeypatch.setattr(summarizer, "save_summaries", saved.update)
+    text = " ".join(["слово"] * 60)
+    posts = [
+        {'id': "@a_1", 'plain_text': text},
+        {'id': "@b_1", 'plain_text': text.replace(" ", "  ")},
+        {'id': "@c_1", 'plain_text': text + " другое"},
+    ]
+    client = StubOpenAI(reply=lambda messages: "S:" + messages[-1]['content'].split()[-1])
+    cache_path = str(tmp_path / "cache.db")
+    logs = []
+    monkeypatch.setattr(summarizer.log, "info", logs.append)
+
+    async def run():
+        queue: asyncio.Queue = asyncio.Queue()
+        queue.put_nowait(posts)
+        queue.put_nowait(None)
+        return await summarizer.summarize_stream(queue, rpm=None, tpm=None, cache_path=cache_path, client=client)
+
+    summaries = asyncio.run(run())
+
+    assert client.calls == 2
+    assert summaries == saved == {"@a_1": "S:слово", "@b_1": "S:слово", "@c_1": "S:другое"}
+    assert "Кэш саммари: попаданий 1, промахов 2" in logs
+
+    # Второй запуск: все из кэша
+    summaries = asyncio.run(run())
+    assert client.calls == 2
+    assert "Кэш саммари: попаданий 3, промахов 0" in logs